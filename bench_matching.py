@@ -0,0 +1,185 @@
+"""
+Scaling benchmark for SecretSantaMatcher.run_match.
+
+Usage: python bench_matching.py [--min 10] [--max 1000000] [--mix uniform senior_heavy]
+                                [--policy senior_junior] [--constraints] [--trials 3]
+                                [--shards 8 --workers 4]
+                                [--json results.json] [--baseline old.json]
+Runs every size (10, 100, ... up to --max) and tier mix, and reports wall
+time, peak memory, failure rate, solver repair counts and senior -> junior
+coverage. Per-participant cost should stay flat as n grows. With --shards
+the run is split into that many hash shards matched in --workers processes
+(ShardedMatcher); wall time should then drop with the number of cores.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+from utils.constraints import NoReciprocal, NoRepeatPairs, SameDomainExclusion
+from utils.matching import SecretSantaMatcher, MatchingError, TIER_POLICIES
+from utils.sharding import ShardedMatcher
+from utils.synthetic import TIER_MIXES, make_participants, previous_pairs, tier_counts
+
+
+def make_constraints(participants, seed):
+    return [NoReciprocal(), SameDomainExclusion(), NoRepeatPairs(previous_pairs(participants, seed))]
+
+
+def check(participants, assignments):
+    """Every participant gives and receives exactly once, never to themselves."""
+    emails = {p["email"] for p in participants}
+    return (
+        set(assignments) == emails
+        and set(assignments.values()) == emails
+        and all(giver != receiver for giver, receiver in assignments.items())
+    )
+
+
+def senior_junior_coverage(participants, assignments):
+    """Share of possible senior -> junior pairs (min(seniors, juniors)) that were made."""
+    level = {p["email"]: p["expertise_level"] for p in participants}
+    seniors = sum(1 for v in level.values() if v == "Senior")
+    juniors = sum(1 for v in level.values() if v == "Junior")
+    possible = min(seniors, juniors)
+    if not possible:
+        return None
+    made = sum(1 for g, r in assignments.items() if level[g] == "Senior" and level[r] == "Junior")
+    return made / possible
+
+
+def make_matcher(participants, constraints, policy, seed, shards=None, workers=None):
+    if shards:
+        return ShardedMatcher(participants, shards=shards, constraints=constraints, policy=policy,
+                              seed=seed, max_workers=workers)
+    return SecretSantaMatcher(participants, constraints=constraints, policy=policy, seed=seed)
+
+
+def bench(n, mix, policy, constrained, trials, shards=None, workers=None):
+    participants = make_participants(n, mix, seed=n, companies=max(2, n // 50) if constrained else 0)
+    constraints = make_constraints(participants, seed=n) if constrained else None
+
+    times, failures, coverage = [], 0, []
+    repairs = {"greedy_misses": 0, "augmented": 0, "reciprocal_swaps": 0}
+    for trial in range(trials):
+        matcher = make_matcher(participants, constraints, policy, trial, shards, workers)
+        start = time.perf_counter()
+        try:
+            assignments = matcher.run_match()
+        except MatchingError:
+            failures += 1
+            continue
+        times.append(time.perf_counter() - start)
+        if not check(participants, assignments):
+            failures += 1
+            continue
+        for key in repairs:
+            repairs[key] += matcher.stats.get(key, 0)
+        share = senior_junior_coverage(participants, assignments)
+        if share is not None:
+            coverage.append(share)
+
+    # Peak memory from a separate traced run (tracing slows the timed runs down)
+    tracemalloc.start()
+    try:
+        make_matcher(participants, constraints, policy, 0, shards, workers).run_match()
+    except MatchingError:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    junior, mid, senior = tier_counts(n, mix)
+    best = min(times) if times else None
+    return {
+        "n": n,
+        "mix": mix,
+        "tiers": {"Junior": junior, "Mid": mid, "Senior": senior},
+        "policy": policy,
+        "constrained": constrained,
+        "shards": shards,
+        "workers": workers,
+        "trials": trials,
+        "best_seconds": best,
+        "median_seconds": statistics.median(times) if times else None,
+        "us_per_participant": best / n * 1e6 if best else None,
+        "peak_memory_bytes": peak,
+        "failure_rate": failures / trials,
+        "repairs_per_run": {key: value / max(1, trials - failures) for key, value in repairs.items()},
+        "senior_junior_coverage": min(coverage) if coverage else None,
+    }
+
+
+def regressions(results, baseline, tolerance):
+    """Results more than `tolerance` times slower, or failing more often, than a baseline run."""
+    def key(r):
+        return r["n"], r["mix"], r["policy"], r["constrained"], r.get("shards"), r.get("workers")
+
+    previous = {key(r): r for r in baseline["results"]}
+    found = []
+    for r in results:
+        old = previous.get(key(r))
+        if not old:
+            continue
+        if r["failure_rate"] > old["failure_rate"]:
+            found.append(f"n={r['n']} {r['mix']}: failure rate {old['failure_rate']:.0%} -> {r['failure_rate']:.0%}")
+        # Tiny sizes are dominated by timer noise
+        if r["n"] >= 1000 and old["us_per_participant"] and r["us_per_participant"]:
+            if r["us_per_participant"] > old["us_per_participant"] * tolerance:
+                found.append(
+                    f"n={r['n']} {r['mix']}: {old['us_per_participant']:.2f} -> {r['us_per_participant']:.2f} us/participant"
+                )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--min", type=int, default=10, help="smallest participant count")
+    parser.add_argument("--max", type=int, default=1_000_000, help="largest participant count")
+    parser.add_argument("--mix", nargs="+", default=["uniform", "senior_heavy"], choices=list(TIER_MIXES))
+    parser.add_argument("--policy", default="senior_junior", choices=list(TIER_POLICIES))
+    parser.add_argument("--constraints", action="store_true",
+                        help="no reciprocal pairs, shared company domains and last year's pairs")
+    parser.add_argument("--trials", type=int, default=3, help="seeds per size")
+    parser.add_argument("--shards", type=int, help="split each run into this many hash shards (ShardedMatcher)")
+    parser.add_argument("--workers", type=int, help="worker processes for --shards (default: CPU count)")
+    parser.add_argument("--json", help="write results to this file ('-' for stdout)")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown vs the baseline")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'n':>10} {'mix':>13} {'seconds':>10} {'us/part':>9} {'peak MiB':>9} {'fail':>6} {'repairs':>8} {'sr->jr':>7}",
+          file=sys.stderr)
+    n = args.min
+    while n <= args.max:
+        for mix in args.mix:
+            r = bench(n, mix, args.policy, args.constraints, args.trials, args.shards, args.workers)
+            results.append(r)
+            seconds = f"{r['best_seconds']:.4f}" if r["best_seconds"] is not None else "-"
+            per = f"{r['us_per_participant']:.2f}" if r["us_per_participant"] is not None else "-"
+            repairs = r["repairs_per_run"]["augmented"] + r["repairs_per_run"]["reciprocal_swaps"]
+            coverage = f"{r['senior_junior_coverage']:.0%}" if r["senior_junior_coverage"] is not None else "-"
+            print(f"{n:>10} {mix:>13} {seconds:>10} {per:>9} {r['peak_memory_bytes'] / 2**20:>9.1f} "
+                  f"{r['failure_rate']:>6.0%} {repairs:>8.1f} {coverage:>7}", file=sys.stderr)
+        n *= 10
+
+    report = {"python": sys.version.split()[0], "results": results}
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Import-time benchmark for the app's cold start.
+
+Usage: python bench_startup.py [--runs 5] [--budget-ms 40] [--json report.json]
+Imports the modules streamlit_app loads in fresh interpreters with
+`python -X importtime`, reports the cost on top of streamlit itself and
+the slowest modules, and fails if the budget is exceeded or a heavy
+dependency is pulled in at import time.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+APP_MODULES = [
+    "utils.db", "utils.matching", "utils.constraints", "utils.mailer", "utils.throttle",
+    "utils.templates", "utils.auth", "utils.export", "utils.metrics", "utils.sponsors", "utils.assignment_graph", "utils.optimizer",
+]
+# Only loaded on first use (DB call, email send, token, export, admin table)
+HEAVY = ["supabase", "postgrest", "httpx", "resend", "jwt", "cryptography", "pyarrow", "pandas", "numpy", "streamlit"]
+
+
+def import_profile(modules):
+    """{module: cumulative microseconds} and the modules loaded, from one fresh interpreter."""
+    code = f"import sys; import {', '.join(modules)}; print(' '.join(sorted(sys.modules)))"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.getenv("PYTHONPATH")])))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          capture_output=True, text=True, env=env, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times, set(proc.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to sample (median is reported)")
+    parser.add_argument("--budget-ms", type=float, default=40.0, help="allowed import cost of the app's own modules")
+    parser.add_argument("--json", help="write the report to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    _, baseline = import_profile(["sys"])  # interpreter startup (site, .pth files)
+    totals, per_module = [], {}
+    loaded = set()
+    for _ in range(args.runs):
+        times, modules = import_profile(APP_MODULES)
+        loaded |= modules
+        # Top-level entries only; their cumulative time includes what they pulled in
+        totals.append(sum(times.get(m, 0) for m in APP_MODULES) / 1000)
+        for name, us in times.items():
+            if name not in baseline:
+                per_module.setdefault(name, []).append(us / 1000)
+
+    total = statistics.median(totals)
+    slowest = sorted(((statistics.median(v), k) for k, v in per_module.items()), reverse=True)[:15]
+    heavy = sorted(m for m in HEAVY if m in loaded)
+
+    print(f"App modules: {total:.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)", file=sys.stderr)
+    print("Slowest imports (cumulative ms):", file=sys.stderr)
+    for ms, name in slowest:
+        print(f"  {ms:8.1f}  {name}", file=sys.stderr)
+    if heavy:
+        print(f"Heavy modules loaded at import: {', '.join(heavy)}", file=sys.stderr)
+
+    report = {
+        "app_modules_ms": total,
+        "budget_ms": args.budget_ms,
+        "per_module_ms": {name: ms for ms, name in slowest},
+        "heavy_loaded": heavy,
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if total > args.budget_ms or heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
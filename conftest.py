@@ -0,0 +1,45 @@
+import inspect
+
+import pytest
+
+import utils.db as db
+import utils.mailer as mailer
+from utils.fake_db import FakeSupabase
+
+
+def use_fake_backend(monkeypatch):
+    """Point utils.db at a fresh in-memory backend with retry backoff skipped, until monkeypatch undoes it."""
+    backend = FakeSupabase(seed=1)
+    monkeypatch.setattr(db, "supabase", backend)
+    monkeypatch.setattr(db, "_sleep", lambda seconds: None)
+    db.clear_cache()
+    return backend
+
+
+def skip_backoff(monkeypatch):
+    """Skip the mailer's retry backoff (real seconds) until monkeypatch undoes it."""
+    monkeypatch.setattr(mailer, "_sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    """A fresh FakeSupabase behind utils.db for one test."""
+    yield use_fake_backend(monkeypatch)
+    db.clear_cache()
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    skip_backoff(monkeypatch)
+
+
+FIXTURES = {"fake": use_fake_backend, "no_backoff": skip_backoff}
+
+
+def run(test):
+    """Call a test outside pytest (the __main__ blocks), providing the fixtures above by name."""
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        try:
+            test(**{name: FIXTURES[name](monkeypatch) for name in inspect.signature(test).parameters})
+        finally:
+            db.clear_cache()
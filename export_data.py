@@ -0,0 +1,47 @@
+"""
+Offline export of participants or the active run's assignments.
+
+Usage: python export_data.py participants --format csv --output participants.csv
+       python export_data.py assignments --format parquet --output assignments.parquet
+Rows are streamed page by page, so memory stays flat for any table size.
+"""
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from utils.export import EXPORTS, FORMATS, export
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("kind", choices=list(EXPORTS))
+    parser.add_argument("--format", default="csv", choices=FORMATS)
+    parser.add_argument("--output", help="file to write (default: stdout for CSV, <kind>.parquet for Parquet)")
+    parser.add_argument("--page-size", type=int, default=1000, help="rows per database request")
+    args = parser.parse_args()
+
+    load_dotenv()
+    start = time.perf_counter()
+    output = args.output or (f"{args.kind}.parquet" if args.format == "parquet" else None)
+    try:
+        if args.format == "csv":
+            if output:
+                with open(output, "w", newline="", encoding="utf-8") as out:
+                    count = export(args.kind, "csv", out, page_size=args.page_size)
+            else:
+                count = export(args.kind, "csv", sys.stdout, page_size=args.page_size)
+        else:
+            count = export(args.kind, "parquet", output, page_size=args.page_size)
+    except Exception as e:
+        # Don't leave a truncated file that looks like a finished export
+        if output and os.path.exists(output):
+            os.remove(output)
+        sys.exit(f"Export failed: {e}")
+    print(f"Exported {count} {args.kind} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
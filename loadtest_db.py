@@ -0,0 +1,111 @@
+"""
+Offline load test of utils.db against the in-memory backend.
+
+Usage: python loadtest_db.py [--participants 10000] [--threads 16] [--ops 20000]
+                             [--latency-ms 5] [--failure-rate 0] [--write-ratio 0.05]
+Mixes cached profile/assignment reads, paginated admin reads and profile
+saves across threads, then reports throughput, per-operation latency,
+cache hit rate and how many requests reached the backend.
+"""
+import argparse
+import os
+import random
+import statistics
+import threading
+import time
+
+os.environ["SECRET_SANTA_DB_BACKEND"] = "memory"
+
+from utils import db  # noqa: E402
+from utils.matching import SecretSantaMatcher  # noqa: E402
+from utils.synthetic import make_participants  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--participants", type=int, default=10_000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=20_000, help="total operations across all threads")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="simulated round-trip time")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--write-ratio", type=float, default=0.05, help="share of operations that save a profile")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fake = db.get_client()
+    participants = make_participants(args.participants, "realistic", seed=args.seed)
+    table = fake.tables["participants"]
+    for row in participants:
+        table.insert(row)
+    assignments = SecretSantaMatcher(participants, seed=args.seed).run_match()
+    result = db.save_assignments(assignments)
+    print(f"Setup: {len(participants)} participants, run saved: {bool(result)}")
+
+    fake.latency = args.latency_ms / 1000
+    fake.failure_rate = args.failure_rate
+    fake.requests.clear()
+    db.clear_cache()
+    emails = [p["email"] for p in participants]
+    # A few users refresh a lot: pick emails with a skewed (log-uniform) distribution
+    hot = lambda rng: emails[int(len(emails) ** rng.random()) - 1]
+
+    def save(rng):
+        email = hot(rng)
+        return db.save_profile(email, {"name": f"User {rng.random():.3f}", "linkedin_url": "", "website_url": "",
+                                       "bio": "", "pledge": "", "expertise_level": "Mid", "wishlist": []})[0]
+
+    operations = {
+        "load_user_profile": (0.60, lambda rng: db.load_user_profile(hot(rng))),
+        "get_assignment_for_user": (0.25, lambda rng: db.get_assignment_for_user(hot(rng))),
+        "get_participants_page": (0.10, lambda rng: db.get_participants_page(page=rng.randrange(20))),
+        "save_profile": (args.write_ratio, save),
+    }
+    names = list(operations)
+    weights = [operations[name][0] for name in names]
+    latencies = {name: [] for name in names}
+    lock = threading.Lock()
+    per_thread = args.ops // args.threads
+
+    def worker(i):
+        rng = random.Random(args.seed * 1000 + i)
+        local = {name: [] for name in names}
+        for name in rng.choices(names, weights, k=per_thread):
+            start = time.perf_counter()
+            operations[name][1](rng)
+            local[name].append(time.perf_counter() - start)
+        with lock:
+            for name in names:
+                latencies[name].extend(local[name])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = sum(len(v) for v in latencies.values())
+    print(f"\n{total} ops in {elapsed:.2f}s = {total / elapsed:,.0f} ops/s "
+          f"({args.threads} threads, {args.latency_ms}ms simulated latency)")
+    print(f"{'operation':>26} {'count':>7} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name in names:
+        values = latencies[name]
+        if values:
+            print(f"{name:>26} {len(values):>7} {statistics.mean(values) * 1000:>8.2f} "
+                  f"{percentile(values, 0.5) * 1000:>8.2f} {percentile(values, 0.95) * 1000:>8.2f}")
+    stats = db.cache_stats()
+    print(f"\nCache: {stats['hit_rate']:.1%} hit rate, {stats['size']}/{stats['maxsize']} entries, "
+          f"{stats['evictions']} evictions")
+    print(f"Backend requests: {sum(fake.requests.values())} for {total} operations")
+    for (name, action), count in sorted(fake.requests.items()):
+        print(f"  {name} {action}: {count}")
+
+
+if __name__ == "__main__":
+    main()
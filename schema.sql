@@ -1,8 +1,17 @@
 -- Drop existing tables to start fresh
+drop view if exists public.assignment_history;
+drop view if exists public.final_runs;
+drop view if exists public.active_assignments_named;
+drop view if exists public.active_assignments;
+drop function if exists public.activate_match_run(uuid);
+drop function if exists public.apply_assignment_changes(uuid, jsonb, text[], integer, text, integer);
+drop function if exists public.admin_stats();
+drop function if exists public.assign_sponsor_gifts(jsonb);
 drop table if exists public.disputes;
 drop table if exists public.sponsor_gifts;
 drop table if exists public.sponsors;
 drop table if exists public.assignments;
+drop table if exists public.match_runs;
 drop table if exists public.participants;
 
 -- 1. Participants (SEO Community Members)
@@ -44,21 +53,140 @@ create table if not exists public.sponsor_gifts (
   is_claimed boolean default false
 );
 
--- 4. Assignments (Secret Santa Pairs)
+-- One gift per person, enforced even across concurrent giveaways
+create unique index if not exists sponsor_gifts_one_per_winner on public.sponsor_gifts (winner_id) where winner_id is not null;
+
+-- Giveaway results in one statement: only fills gifts that are still open
+-- and skips winners who already hold one, so re-runs never overwrite.
+-- Returns the ids of the gifts it assigned.
+create or replace function public.assign_sponsor_gifts(p_assignments jsonb)
+returns setof uuid language sql as $$
+  update public.sponsor_gifts g
+     set winner_id = w.winner_id
+    from (
+      select distinct on (winner_id) gift_id, winner_id
+      from jsonb_to_recordset(p_assignments) as x(gift_id uuid, winner_id uuid)
+    ) w
+   where g.id = w.gift_id
+     and g.winner_id is null
+     and not g.is_claimed
+     and not exists (select 1 from public.sponsor_gifts o where o.winner_id = w.winner_id)
+  returning g.id;
+$$;
+
+-- 4. Match Runs (one row per generated set of assignments)
+create table if not exists public.match_runs (
+  id uuid default gen_random_uuid() primary key,
+  created_at timestamp with time zone default timezone('utc'::text, now()) not null,
+  seed bigint, -- Re-running with the same seed and options regenerates the same pairs
+  digest text, -- assignment_digest() of the pairs, to verify a re-run in O(n)
+  size integer, -- Number of assignments
+  options jsonb default '{}'::jsonb, -- Tier policy and matching rules used
+  status text default 'writing', -- writing, active, retired
+  is_active boolean default false, -- Exactly one run is live; see activate_match_run()
+  activated_at timestamp with time zone -- Last time this run went live
+);
+
+create unique index if not exists match_runs_one_active on public.match_runs (is_active) where is_active;
+
+-- 5. Assignments (Secret Santa Pairs)
 create table if not exists public.assignments (
   id uuid default gen_random_uuid() primary key,
   created_at timestamp with time zone default timezone('utc'::text, now()) not null,
   giver_id uuid references public.participants(id),
   receiver_id uuid references public.participants(id),
-  year integer default 2024,
-  status text default 'pending', -- pending, sent, received
+  run_id uuid references public.match_runs(id) on delete cascade,
+  giver_email text,
+  receiver_email text,
+  year integer default 2024, -- Past years feed the "no repeat pairs" constraint
+  status text default 'pending', -- pending, notified, notify_failed, sent, received
   gift_url text, -- The link to the gift (doc, video, etc)
   gift_message text,
   sent_at timestamp with time zone,
-  is_disputed boolean default false
+  is_disputed boolean default false,
+  unique (run_id, giver_email) -- Lets chunked saves upsert, so retries are idempotent
 );
 
--- 5. Disputes
+-- Readers only ever see the active run
+create or replace view public.active_assignments as
+  select a.* from public.assignments a
+  join public.match_runs r on r.id = a.run_id
+  where r.is_active;
+
+-- Active run with names joined in, for exports
+create or replace view public.active_assignments_named as
+  select a.giver_email, g.name as giver_name, a.receiver_email, r.name as receiver_name,
+         a.status, a.year, a.sent_at, a.gift_url
+  from public.active_assignments a
+  left join public.participants g on g.email = a.giver_email
+  left join public.participants r on r.email = a.receiver_email;
+
+-- The run that was final for each year: the one that went live last.
+-- Runs that never went live (status 'writing') don't count.
+create or replace view public.final_runs as
+  select distinct on (a.year) a.year, a.run_id
+  from (select distinct run_id, year from public.assignments) a
+  join public.match_runs r on r.id = a.run_id
+  where r.status in ('active', 'retired')
+  order by a.year, r.activated_at desc nulls last, r.created_at desc;
+
+-- Pairs that actually happened, one run per year (feeds "no repeat pairs")
+create or replace view public.assignment_history as
+  select a.id, a.giver_email, a.receiver_email, a.year
+  from public.assignments a
+  join public.final_runs f on f.run_id = a.run_id and f.year = a.year;
+
+-- Switch the active run in one transaction (no reader sees two runs mixed)
+create or replace function public.activate_match_run(p_run_id uuid)
+returns void language plpgsql as $$
+begin
+  update public.match_runs set is_active = false, status = 'retired'
+    where is_active and id <> p_run_id;
+  update public.match_runs set is_active = true, status = 'active', activated_at = now()
+    where id = p_run_id;
+end;
+$$;
+
+-- Local repair of a run (utils/assignment_graph.py) in one transaction:
+-- changed givers' rows go back to pending, removed givers' rows are
+-- deleted and the run's digest follows. Idempotent, so safe to retry.
+create or replace function public.apply_assignment_changes(
+  p_run_id uuid, p_changes jsonb, p_removed text[], p_year integer, p_digest text, p_size integer)
+returns void language plpgsql as $$
+begin
+  insert into public.assignments (run_id, giver_email, receiver_email, year, status, sent_at, is_disputed)
+    select p_run_id, x.giver_email, x.receiver_email, p_year, 'pending', null, false
+    from jsonb_to_recordset(p_changes) as x(giver_email text, receiver_email text)
+  on conflict (run_id, giver_email) do update
+    set receiver_email = excluded.receiver_email, year = excluded.year,
+        status = 'pending', sent_at = null, is_disputed = false;
+  delete from public.assignments
+    where run_id = p_run_id and giver_email = any(p_removed);
+  if p_digest is not null then
+    update public.match_runs set digest = p_digest, size = p_size where id = p_run_id;
+  end if;
+end;
+$$;
+
+-- Admin dashboard counts in one round trip (aggregated in the database,
+-- so the response stays a few hundred bytes however many participants)
+create or replace function public.admin_stats()
+returns jsonb language sql stable as $$
+  select jsonb_build_object(
+    'total', (select count(*) from public.participants),
+    'verified', (select count(*) from public.participants where is_verified),
+    'banned', (select count(*) from public.participants where is_banned),
+    'tiers', (select coalesce(jsonb_object_agg(level, n), '{}'::jsonb) from (
+      select coalesce(expertise_level, 'Unknown') as level, count(*) as n
+      from public.participants group by 1) t),
+    'assignments', (select count(*) from public.active_assignments),
+    'assignment_status', (select coalesce(jsonb_object_agg(status, n), '{}'::jsonb) from (
+      select coalesce(status, 'pending') as status, count(*) as n
+      from public.active_assignments group by 1) s)
+  );
+$$;
+
+-- 6. Disputes
 create table if not exists public.disputes (
   id uuid default gen_random_uuid() primary key,
   created_at timestamp with time zone default timezone('utc'::text, now()) not null,
@@ -75,6 +203,7 @@ alter table public.sponsors enable row level security;
 alter table public.sponsor_gifts enable row level security;
 alter table public.assignments enable row level security;
 alter table public.disputes enable row level security;
+alter table public.match_runs enable row level security;
 
 -- Setup initial policies (Permissive for setup/MVP, refine before launch)
 create policy "Allow public insert participants" on public.participants for insert with check (true);
@@ -86,3 +215,4 @@ create policy "Allow read sponsor_gifts" on public.sponsor_gifts for select usin
 
 create policy "Allow assignments" on public.assignments for all using (true);
 create policy "Allow disputes" on public.disputes for all using (true);
+create policy "Allow match runs" on public.match_runs for all using (true);
@@ -1,14 +1,22 @@
 import streamlit as st
 import time
 import os
-import jwt
 import datetime
-import resend
 from dotenv import load_dotenv
 
 # Utilities
-from utils.db import save_profile, load_user_profile, get_all_participants, save_assignments, get_all_assignments, get_assignment_for_user
-from utils.matching import SecretSantaMatcher
+from utils.db import save_profile, load_user_profile, get_participants_page, get_assignments_page, save_assignments, get_all_assignments, get_assignment_for_user, get_assignment_history, save_match_run, get_match_runs, get_admin_stats, cache_stats, clear_cache, get_sponsors, add_sponsor, add_sponsor_gifts, get_sponsor_gifts, get_active_run
+from utils.matching import SecretSantaMatcher, MatchingError, TIER_POLICIES
+from utils.constraints import NoReciprocal, NoRepeatPairs, SameDomainExclusion
+from utils.mailer import get_dispatcher, get_login_dispatcher, notify_assignments
+from utils.throttle import get_login_admission
+from utils.templates import MAGIC_LINK, REMINDER
+from utils.auth import get_auth
+from utils.export import EXPORTS, FORMATS, export
+from utils.assignment_graph import RepairResult, add_late_joiners, repair_active_run
+from utils.optimizer import MatchOptimizer
+from utils.sponsors import DEFAULT_TIER_WEIGHTS, SPONSOR_TIER_RANK, run_giveaway
+from utils import metrics
 
 # Load environment variables
 load_dotenv()
@@ -38,187 +46,600 @@ JWT_SECRET = get_config("SUPABASE_SERVICE_ROLE_KEY")
 JWT_ALGORITHM = "HS256"
 ADMIN_EMAILS = [e.strip() for e in get_config("ADMIN_EMAILS", "").split(",") if e.strip()]
 
-# Initialize Resend
+# Resend is imported by the email provider on the first send; hand it the key
 if RESEND_API_KEY:
-    resend.api_key = RESEND_API_KEY
+    os.environ.setdefault("RESEND_API_KEY", RESEND_API_KEY)
 else:
     st.warning("Resend API Key missing. Emails will not send.")
 
 def create_token(email):
     """Generate a JWT token for magic link."""
-    payload = {
-        "email": email,
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=24) 
-    }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return get_auth(JWT_SECRET, JWT_ALGORITHM).create_token(email)
 
 def verify_token(token):
-    """Verify the JWT token."""
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload["email"]
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
+    """Verify the JWT token (recently verified tokens skip the HMAC)."""
+    return get_auth(JWT_SECRET, JWT_ALGORITHM).verify(token)
+
+def _forget_failed_links(emails, ok, error=None):
+    """Login dispatcher callback: let a failed address request a fresh link."""
+    if not ok:
+        auth = get_auth(JWT_SECRET, JWT_ALGORITHM)
+        for email in emails:
+            auth.forget(email)
 
 def send_magic_link(email):
-    """Send the magic link via Resend."""
-    token = create_token(email)
+    """Queue the magic link on the login dispatcher and return right away.
+    Requests are admission-checked per address and globally first; repeat
+    requests within a minute reuse the link already queued."""
+    # One normalized address for admission, coalescing and the token, so
+    # "A@x.com" and "a@x.com" share a link instead of getting one each
+    email = email.strip().lower()
+    admitted, reason = get_login_admission().admit(email)
+    if not admitted:
+        if reason == "key":
+            st.warning("A link was sent to this address recently. Please check your inbox or try again in a minute.")
+        else:
+            st.warning("We're getting a lot of login requests right now. Please try again in a few seconds.")
+        return False
+
+    auth = get_auth(JWT_SECRET, JWT_ALGORITHM)
+    token, is_new = auth.issue(email)
+    if not is_new:
+        return True
     link = f"{APP_DOMAIN}?token={token}"
 
-    try:
-        r = resend.Emails.send({
-            "from": "SEO Kringle <admin@seokringle.com>",
-            "to": email,
-            "subject": "🎅 Login to SEO Kringle Secret Santa",
-            "html": f"""
-            <div style="font-family: sans-serif; max-width: 600px; margin: 0 auto;">
-                <h2>Welcome back!</h2>
-                <p>You requested a secure login link for the SEO Community Secret Santa.</p>
-                <div style="margin: 24px 0;">
-                    <a href="{link}" style="background-color: #d32f2f; color: white; padding: 12px 24px; text-decoration: none; border-radius: 4px; font-weight: bold;">👉 Click here to Login</a>
-                </div>
-                <p style="color: #666; font-size: 14px;">If you didn't request this, you can safely ignore this email.</p>
-                <p style="color: #666; font-size: 14px;"><i>Link expires in 24 hours.</i></p>
-            </div>
-            """
-        })
+    if get_login_dispatcher(on_result=_forget_failed_links).submit(MAGIC_LINK.message(email, {"link": link}), key=email):
         return True
-    except Exception as e:
-        st.error(f"Failed to send email: {e}")
-        return False
+    auth.forget(email)
+    st.error("Login emails are backed up right now. Please try again shortly.")
+    return False
+
+def build_constraints(options):
+    """Constraint objects for the admin's matching options (or a stored run's).
+    Raises MatchingError if past pairs can't be read for the no-repeat rule."""
+    constraints = []
+    if options.get("no_reciprocal"):
+        constraints.append(NoReciprocal())
+    if options.get("no_repeat"):
+        try:
+            history = get_assignment_history(before_year=options["year"])
+        except Exception:
+            raise MatchingError("Couldn't load past assignments for the no-repeat rule; try again shortly") from None
+        constraints.append(NoRepeatPairs(history))
+    if options.get("same_domain"):
+        constraints.append(SameDomainExclusion())
+    return constraints
+
+def build_matcher(options, seed=None):
+    """Create a matcher from the admin's matching options (also used to replay a stored run).
+    Participants are streamed from the DB with only the columns matching needs."""
+    if options.get("optimize"):
+        # A stored run's replay (winner seed + swap count) reproduces it without the time budget
+        return MatchOptimizer(None, constraints=build_constraints(options), policy=options.get("policy"), seed=seed,
+                              candidates=options["optimize"]["candidates"], time_budget=options["optimize"]["time_budget"],
+                              replay=options["optimize"].get("replay"))
+    return SecretSantaMatcher(None, constraints=build_constraints(options), policy=options.get("policy"), seed=seed)
+
+PAGE_CACHE_SIZE = 30  # pages remembered per session
+
+def clear_page_cache():
+    st.session_state.pop("page_cache", None)
+
+def render_paged_table(key, fetch, labels, sort_options, filter_label, filter_options, page_size=50):
+    """Sortable, searchable table that fetches one page at a time.
+    fetch(page, page_size, sort, desc, search, filter_value) -> (rows, total).
+    Pages already seen this session are served from st.session_state."""
+    search_col, filter_col, sort_col, order_col = st.columns([3, 2, 2, 1])
+    with search_col:
+        search = st.text_input("Search", key=f"{key}_search").strip()
+    with filter_col:
+        choice = st.selectbox(filter_label, ["All", *filter_options], key=f"{key}_filter")
+    with sort_col:
+        sort = st.selectbox("Sort by", sort_options, format_func=lambda c: labels.get(c, c), key=f"{key}_sort")
+    with order_col:
+        desc = st.checkbox("Desc", key=f"{key}_desc")
+    page = st.number_input("Page", min_value=1, value=1, step=1, key=f"{key}_page") - 1
+
+    query = (key, page, page_size, sort, desc, search, choice)
+    pages = st.session_state.setdefault("page_cache", {})
+    if query in pages:
+        rows, total = pages.pop(query)
+    else:
+        rows, total = fetch(page, page_size, sort, desc, search or None, None if choice == "All" else choice)
+    pages[query] = (rows, total)  # re-insert so the oldest entries are dropped first
+    while len(pages) > PAGE_CACHE_SIZE:
+        pages.pop(next(iter(pages)))
+
+    import pandas as pd
+    df = pd.DataFrame(rows, columns=list(labels)).rename(columns=labels)
+    st.dataframe(df, use_container_width=True, hide_index=True)
+    last_page = max(1, -(-total // page_size))
+    st.caption(f"Page {page + 1} of {last_page} · {total} matching rows")
+
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "exports")
+EXPORT_TTL = 600  # seconds a finished export stays downloadable
+
+def prepare_export(kind, fmt):
+    """Stream an export into a file Streamlit serves from disk (server.enableStaticServing).
+    Returns (url, row count). Each file sits in its own unguessable directory, removed by a
+    later export once older than EXPORT_TTL. A failed read raises and leaves no file behind."""
+    import secrets
+    import shutil
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    now = time.time()
+    for name in os.listdir(EXPORT_DIR):
+        old = os.path.join(EXPORT_DIR, name)
+        if now - os.path.getmtime(old) > EXPORT_TTL:
+            shutil.rmtree(old, ignore_errors=True)
+    token = secrets.token_urlsafe(24)
+    folder = os.path.join(EXPORT_DIR, token)
+    os.mkdir(folder)
+    path = os.path.join(folder, f"{kind}.{fmt}")
+    try:
+        if fmt == "csv":
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                count = export(kind, fmt, f)
+        else:
+            count = export(kind, fmt, path)
+    except Exception:
+        shutil.rmtree(folder, ignore_errors=True)
+        raise
+    return f"app/static/exports/{token}/{kind}.{fmt}", count
 
 def render_admin_panel():
     st.header("🔒 Admin Panel")
     st.warning("You are in Admin Mode.")
 
     # Tabs for different admin sections
-    tab1, tab2, tab3 = st.tabs(["📊 Statistics", "🎲 Matching", "💼 Sponsors"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📊 Statistics", "🎲 Matching", "💼 Sponsors", "⏱️ Performance"])
 
     # Tab 1: Statistics
     with tab1:
         st.subheader("Participant Statistics")
-        participants = get_all_participants()
 
-        # Debug info
-        st.caption(f"Debug: Found {len(participants) if participants else 0} participants from database")
+        # Counts are aggregated in the database; only the table below loads rows
+        summary = get_admin_stats()
+        stats = cache_stats()
+        st.caption(
+            f"Cache {stats['hits']} hits / {stats['misses']} misses ({stats['hit_rate']:.0%})"
+        )
+        if st.button("🔄 Refresh data"):
+            clear_cache()
+            clear_page_cache()
+            st.rerun()
 
-        if not participants:
+        if summary is None:
+            st.error("Statistics are unavailable. Check the database connection and that schema.sql is applied.")
+        elif not summary["total"]:
             st.info("No participants yet.")
         else:
+            tiers = summary["tiers"]
+
             # Overall metrics
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total Participants", len(participants))
+                st.metric("Total Participants", summary["total"])
             with col2:
-                expertise_counts = {}
-                for p in participants:
-                    level = p.get("expertise_level", "Unknown")
-                    expertise_counts[level] = expertise_counts.get(level, 0) + 1
-                st.metric("Seniors", expertise_counts.get("Senior", 0))
+                st.metric("Seniors", tiers.get("Senior", 0))
             with col3:
-                st.metric("Juniors", expertise_counts.get("Junior", 0))
+                st.metric("Juniors", tiers.get("Junior", 0))
+            col4, col5, col6 = st.columns(3)
+            with col4:
+                st.metric("Verified", summary["verified"])
+            with col5:
+                st.metric("Banned", summary["banned"])
+            with col6:
+                st.metric("Assignments", summary["assignments"])
 
             # Expertise breakdown
             st.markdown("---")
             st.write("**Expertise Breakdown:**")
-            for level, count in expertise_counts.items():
+            for level, count in tiers.items():
                 st.write(f"- {level}: {count}")
+            if summary["assignment_status"]:
+                st.write("**Assignment Status:**")
+                for status, count in summary["assignment_status"].items():
+                    st.write(f"- {status}: {count}")
 
             # Participant table
             st.markdown("---")
             st.subheader("Participant List")
 
-            import pandas as pd
-            df = pd.DataFrame(participants)
-
-            # Select relevant columns for display
-            display_columns = ["name", "email", "expertise_level", "pledge"]
-            if all(col in df.columns for col in display_columns):
-                display_df = df[display_columns].copy()
-                display_df.columns = ["Name", "Email", "Expertise", "Pledge"]
-                st.dataframe(display_df, use_container_width=True)
-            else:
-                st.dataframe(df)
-
-            # Export option
-            if st.button("📥 Export Participant Data (CSV)"):
-                csv = df.to_csv(index=False)
-                st.download_button(
-                    label="Download CSV",
-                    data=csv,
-                    file_name="participants.csv",
-                    mime="text/csv"
-                )
+            # One projected page at a time; long pledges are trimmed for the table
+            def fetch_participants(page, page_size, sort, desc, search, tier):
+                rows, total = get_participants_page(page, page_size, sort, desc, search, tier,
+                                                    columns=["name", "email", "expertise_level", "pledge", "is_verified"])
+                for row in rows:
+                    pledge = row.get("pledge") or ""
+                    row["pledge"] = pledge if len(pledge) <= 80 else pledge[:77] + "..."
+                return rows, total
+
+            render_paged_table(
+                "participants", fetch_participants,
+                {"name": "Name", "email": "Email", "expertise_level": "Expertise", "pledge": "Pledge", "is_verified": "Verified"},
+                ["name", "email", "expertise_level", "created_at"],
+                "Tier", ["Junior", "Mid", "Senior"],
+            )
+
+            # Export: streamed from paginated reads into a file on disk, which the
+            # browser then downloads straight from Streamlit's static file server,
+            # so neither building nor serving it holds the table in memory. One click:
+            # the download starts as soon as the file is ready. Streamlit serves
+            # static files up to 200 MB; use export_data.py for anything larger.
+            st.markdown("---")
+            st.subheader("Export")
+            kind_col, format_col = st.columns(2)
+            with kind_col:
+                export_kind = st.selectbox("Data", list(EXPORTS), format_func=str.capitalize)
+            with format_col:
+                export_format = st.selectbox("Format", FORMATS, format_func=str.upper)
+            if st.button("📥 Export"):
+                try:
+                    with st.spinner("Exporting..."):
+                        url, count = prepare_export(export_kind, export_format)
+                except Exception as e:
+                    st.error(f"❌ Export failed, no file was produced: {e}")
+                else:
+                    import streamlit.components.v1 as components
+                    file_name = f"{export_kind}.{export_format}"
+                    components.html(f'<a id="export" href="{url}" download="{file_name}"></a>'
+                                    '<script>document.getElementById("export").click()</script>', height=0)
+                    st.success(f"✅ Exported {count} rows. If the download didn't start, "
+                               f"[download {file_name}]({url}) (available for {EXPORT_TTL // 60} minutes).")
 
     # Tab 2: Matching
     with tab2:
         st.subheader("Assignment Management")
-        participants = get_all_participants()
+
+        st.write("**Matching rules:**")
+        rule_reciprocal = st.checkbox("No reciprocal pairs (A → B and B → A)", value=True)
+        rule_history = st.checkbox("Don't repeat previous years' pairs", value=True)
+        rule_domain = st.checkbox("Keep colleagues apart (same website domain)", value=False)
+        tier_policy = st.selectbox(
+            "Mentorship priority",
+            list(TIER_POLICIES),
+            format_func=lambda name: {
+                "senior_junior": "Senior → Junior",
+                "mid_junior_overflow": "Senior → Junior, then Mid → Junior",
+                "senior_mid_fallback": "Senior → Junior, then Senior → Mid",
+                "full_ladder": "Senior → Junior, Mid → Junior, Senior → Mid",
+                "none": "No priority (fully random)",
+            }.get(name, name),
+        )
+
+        optimize = st.checkbox("Optimize match quality (best of several candidates, then pair swaps)",
+                               help="Scores Senior → Junior coverage, pairs across tiers and pairs across agencies.")
+        if optimize:
+            cand_col, budget_col = st.columns(2)
+            candidates = cand_col.number_input("Candidates", min_value=1, max_value=256, value=16, step=1)
+            time_budget = budget_col.number_input("Time budget (seconds, 0 = no limit)", min_value=0, value=20, step=5)
+
+        seed_input = st.text_input("Seed (optional, leave blank for a random run)")
+        options = {
+            "policy": tier_policy,
+            "no_reciprocal": rule_reciprocal,
+            "no_repeat": rule_history,
+            "same_domain": rule_domain,
+            "year": datetime.date.today().year,
+        }
+        if optimize:
+            options["optimize"] = {"candidates": int(candidates), "time_budget": time_budget or None}
 
         col1, col2 = st.columns(2)
 
         with col1:
             if st.button("🎲 Generate New Assignments", use_container_width=True):
-                if len(participants) < 2:
-                    st.error("❌ Need at least 2 participants to generate assignments.")
+                if seed_input.strip() and not seed_input.strip().isdigit():
+                    st.error("❌ Seed must be a whole number.")
                 else:
                     with st.spinner("Running sophisticated matching logic..."):
-                        matcher = SecretSantaMatcher(participants)
-                        assignments = matcher.run_match()
+                        try:
+                            matcher = build_matcher(options, seed=seed_input.strip() or None)
+                            assignments = matcher.run_match()
+                        except MatchingError as e:
+                            st.error(f"❌ {e}")
+                            assignments = None
 
                         if assignments:
-                            # Save to DB
-                            if save_assignments(assignments):
+                            if "best_seed" in matcher.stats:
+                                # A time budget makes the search depend on timing; record what it did
+                                replay = {"best_seed": matcher.stats["best_seed"], "swaps": matcher.stats["swaps"]}
+                                options = {**options, "optimize": {**options["optimize"], "replay": replay}}
+                            # Save to DB as a new run; it only goes live once fully written
+                            run = save_match_run(matcher.seed, matcher.digest, len(assignments), options)
+                            result = save_assignments(assignments, run_id=run["id"]) if run else None
+                            if result:
+                                clear_page_cache()
                                 st.success(f"✅ Created {len(assignments)} assignments successfully!")
+                                st.caption(f"Seed: `{matcher.seed}` · Digest: `{matcher.digest}`")
+                                if "scores" in matcher.stats:
+                                    stats = matcher.stats
+                                    st.caption(
+                                        f"Quality: {stats['final_score']:.3f} (best of {stats['candidates']} candidates "
+                                        f"{stats['scores']['min']:.3f}–{stats['scores']['max']:.3f}, "
+                                        f"+{stats['swaps']} swaps) · Senior → Junior coverage "
+                                        f"{stats['terms']['senior_junior']:.0%} · cross-tier {stats['terms']['tier_mix']:.0%} "
+                                        f"· cross-agency {stats['terms']['cross_agency']:.0%}"
+                                    )
                                 st.json(assignments)
                             else:
-                                st.error("❌ Failed to save assignments to DB.")
-                        else:
+                                if result is not None:
+                                    st.session_state.pending_run = (result.run_id, assignments)
+                                    st.error(f"❌ Saved {result.written}/{result.total} assignments. The previous run is still active.")
+                                else:
+                                    st.error("❌ Failed to save assignments to DB.")
+                                st.caption(f"Re-run with seed `{matcher.seed}` to regenerate the same pairs.")
+                        elif assignments is not None:
                             st.error("❌ Algorithm failed to find a valid matching.")
 
         with col2:
-            if st.button("👁️ View Current Assignments", use_container_width=True):
-                assignments = get_all_assignments()
-
-                if assignments:
-                    st.success(f"Found {len(assignments)} assignments")
-                    import pandas as pd
-                    df_assignments = pd.DataFrame(assignments)
-                    st.dataframe(df_assignments, use_container_width=True)
+            show_assignments = st.toggle("👁️ View Current Assignments")
+
+        if show_assignments:
+            render_paged_table(
+                "assignments",
+                lambda page, page_size, sort, desc, search, status: get_assignments_page(
+                    page, page_size, sort, desc, search, status,
+                    columns=["giver_email", "receiver_email", "status", "year", "sent_at"]),
+                {"giver_email": "Giver", "receiver_email": "Receiver", "status": "Status", "year": "Year", "sent_at": "Sent"},
+                ["giver_email", "receiver_email", "status", "created_at"],
+                "Status", ["pending", "notified", "notify_failed", "sent", "received"],
+            )
+
+        with st.expander("📧 Notify givers"):
+            dispatcher = get_dispatcher()
+            stats = dispatcher.stats()
+            st.caption(
+                f"Queued: {stats['queued']} · Sent: {stats['sent']} · Failed: {stats['failed']} · "
+                f"Retries: {stats['retries']}"
+            )
+            login = get_login_dispatcher(on_result=_forget_failed_links).stats()
+            admission = get_login_admission().stats()
+            st.caption(
+                f"Login links — queued: {login['queued']} · sent: {login['sent']} · failed: {login['failed']} · "
+                f"latency p50/p95: {login['latency_p50']:.1f}s / {login['latency_p95']:.1f}s · "
+                f"throttled: {admission['rejected_key']} per-address, {admission['rejected_global']} global"
+            )
+            notify_col, remind_col = st.columns(2)
+            with notify_col:
+                if st.button("📨 Email every giver their match"):
+                    pairs = {a["giver_email"]: a["receiver_email"] for a in get_all_assignments()}
+                    if not pairs:
+                        st.info("No active assignments to notify.")
+                    else:
+                        notify_assignments(pairs, APP_DOMAIN, dispatcher=dispatcher)
+                        st.success(f"✅ Queued {len(pairs)} notifications. They are sent in the background; status is recorded per giver.")
+            with remind_col:
+                if st.button("⏰ Remind givers who haven't sent yet"):
+                    pairs = {
+                        a["giver_email"]: a["receiver_email"]
+                        for a in get_all_assignments()
+                        if a.get("status") in ("pending", "notified", "notify_failed")
+                    }
+                    if not pairs:
+                        st.info("Everyone has sent their gift. 🎉")
+                    else:
+                        notify_assignments(pairs, APP_DOMAIN, dispatcher=dispatcher, template=REMINDER)
+                        st.success(f"✅ Queued {len(pairs)} reminders.")
+
+        with st.expander("🩹 Repair assignments / add late joiners"):
+            st.caption("Takes people out of the active run without rematching everyone: their Santa is linked to "
+                       "their receiver (or one other pair is swapped if that breaks a rule). Banned participants are "
+                       "removed and disputed givers get a new receiver. Only the changed givers are saved and emailed.")
+            withdrawn = st.text_area("Withdrawn participants (one email per line)", key="repair_withdrawn")
+            include_banned = st.checkbox("Remove banned participants", value=True)
+            include_disputed = st.checkbox("Reassign disputed givers", value=True)
+            notify_changed = st.checkbox("Email the givers whose match changed", value=True)
+            if st.button("🩹 Repair active run"):
+                active = get_active_run()
+                with st.spinner("Repairing..."):
+                    try:
+                        result = repair_active_run(
+                            remove=[e.strip() for e in withdrawn.splitlines() if e.strip()],
+                            include_banned=include_banned,
+                            include_disputed=include_disputed,
+                            constraints=build_constraints((active or {}).get("options") or {}),
+                        )
+                    except MatchingError as e:
+                        result = RepairResult(error=str(e))
+                if not result:
+                    st.error(f"❌ {result.error}. The active run was not changed.")
+                elif not result.changes and not result.removed:
+                    st.info("Nothing to repair.")
+                else:
+                    clear_page_cache()
+                    if notify_changed and result.changes:
+                        notify_assignments(result.changes, APP_DOMAIN, only_receivers=True)
+                    st.success(f"✅ Removed {len(result.removed)}, reassigned {len(result.reassigned)}; "
+                               f"{len(result.changes)} givers have a new match.")
+                    st.json(result.changes)
+
+            st.markdown("---")
+            st.caption("People who registered after the active run was generated can be added without a rematch: "
+                       "each one is inserted between two existing partners (A → new → B), preferring a Senior "
+                       "Santa for new Juniors and a Junior receiver for new Seniors.")
+            if st.button("➕ Add late joiners"):
+                active = get_active_run()
+                with st.spinner("Adding late joiners..."):
+                    try:
+                        result = add_late_joiners(constraints=build_constraints((active or {}).get("options") or {}))
+                    except MatchingError as e:
+                        result = RepairResult(error=str(e))
+                if not result:
+                    st.error(f"❌ {result.error}. The active run was not changed.")
+                elif not result.added:
+                    st.info("No new participants since the active run.")
+                else:
+                    clear_page_cache()
+                    if notify_changed:
+                        notify_assignments(result.changes, APP_DOMAIN, only_receivers=True)
+                    st.success(f"✅ Added {len(result.added)} participants; {len(result.changes)} givers have a new match.")
+                    st.json(result.changes)
+
+        if "pending_run" in st.session_state:
+            run_id, pending = st.session_state.pending_run
+            st.warning(f"Run `{run_id}` was only partially saved.")
+            if st.button("🔄 Retry save"):
+                result = save_assignments(pending, run_id=run_id)
+                if result:
+                    del st.session_state.pending_run
+                    clear_page_cache()
+                    st.success(f"✅ Run completed and activated ({result.written} assignments).")
                 else:
-                    st.info("No assignments found. Generate assignments first.")
+                    st.error(f"❌ Still incomplete: {result.written}/{result.total} written.")
+
+        with st.expander("🔁 Reproduce a previous run"):
+            runs = get_match_runs()
+            if not runs:
+                st.info("No recorded runs yet.")
+            else:
+                run = st.selectbox(
+                    "Run",
+                    runs,
+                    format_func=lambda r: f"{r['created_at'][:19]} · {r['size']} pairs · seed {r['seed']}",
+                )
+                if st.button("Verify run"):
+                    try:
+                        matcher = build_matcher(run.get("options") or {}, seed=run["seed"])
+                        matcher.run_match()
+                    except MatchingError as e:
+                        st.error(f"❌ {e}")
+                    else:
+                        if matcher.digest == run["digest"]:
+                            st.success(f"✅ Re-run matches the stored digest `{run['digest']}`.")
+                        else:
+                            st.warning("⚠️ Re-run differs from the stored run (participants or history changed since).")
 
         st.markdown("---")
-        st.caption("⚠️ Generating new assignments will create new records. Make sure to clear old assignments if needed.")
+        st.caption("ℹ️ Each generation is saved as a new run and replaces the active assignments only once fully written. Previous runs are kept as history.")
 
     # Tab 3: Sponsors
     with tab3:
         st.subheader("Sponsor Management")
-        st.info("Sponsor management feature coming soon. This will allow you to manage event sponsors and their details.")
-
-        st.markdown("**Planned Features:**")
-        st.markdown("""
-        - Add/Remove sponsors
-        - Upload sponsor logos
-        - Manage sponsor tiers (Gold, Silver, Bronze)
-        - Display sponsors on public pages
-        """)
-
-        # Placeholder for sponsor management
-        with st.expander("➕ Add Sponsor (Coming Soon)"):
-            st.text_input("Sponsor Name", disabled=True)
-            st.selectbox("Tier", ["Gold", "Silver", "Bronze"], disabled=True)
-            st.text_input("Website URL", disabled=True)
-            st.file_uploader("Logo", disabled=True)
-            st.button("Save Sponsor", disabled=True)
+        sponsors = get_sponsors()
+        gifts = get_sponsor_gifts()
+
+        g1, g2, g3, g4 = st.columns(4)
+        g1.metric("Sponsors", len(sponsors))
+        g2.metric("Gifts", len(gifts))
+        g3.metric("Assigned", sum(1 for g in gifts if g.get("winner_id")))
+        g4.metric("Claimed", sum(1 for g in gifts if g.get("is_claimed")))
+
+        if sponsors:
+            import pandas as pd
+            per_sponsor = {s["id"]: {"Sponsor": s["name"], "Tier": s.get("tier") or "", "Gifts": 0, "Open": 0}
+                           for s in sponsors}
+            for g in gifts:
+                row = per_sponsor.get(g.get("sponsor_id"))
+                if row:
+                    row["Gifts"] += 1
+                    row["Open"] += g.get("winner_id") is None and not g.get("is_claimed")
+            st.dataframe(pd.DataFrame(list(per_sponsor.values())), use_container_width=True, hide_index=True)
+
+        with st.expander("➕ Add Sponsor"):
+            with st.form("add_sponsor", clear_on_submit=True):
+                sponsor_name = st.text_input("Sponsor Name")
+                sponsor_tier = st.selectbox("Tier", list(SPONSOR_TIER_RANK))
+                logo_url = st.text_input("Logo URL")
+                if st.form_submit_button("Save Sponsor"):
+                    if not sponsor_name.strip():
+                        st.error("❌ Sponsor name is required.")
+                    elif add_sponsor(sponsor_name.strip(), sponsor_tier, logo_url.strip() or None):
+                        st.success(f"✅ Added {sponsor_name.strip()}.")
+                        st.rerun()
+                    else:
+                        st.error("❌ Failed to save sponsor.")
+
+        if sponsors:
+            with st.expander("🎁 Add Gifts"):
+                with st.form("add_gifts", clear_on_submit=True):
+                    names = {s["id"]: s["name"] for s in sponsors}
+                    sponsor_id = st.selectbox("Sponsor", list(names), format_func=names.get)
+                    gift_name = st.text_input("Gift Name", placeholder="Pro Annual License")
+                    value = st.number_input("Value (USD)", min_value=0.0, step=10.0)
+                    codes = st.text_area("Redeem codes (one per line)")
+                    count = st.number_input("...or number of gifts without codes", min_value=0, step=1)
+                    if st.form_submit_button("Add Gifts"):
+                        code_list = [c.strip() for c in codes.splitlines() if c.strip()] or [None] * int(count)
+                        if not gift_name.strip() or not code_list:
+                            st.error("❌ Gift name and at least one gift are required.")
+                        else:
+                            added = add_sponsor_gifts(sponsor_id, gift_name.strip(), code_list, value or None)
+                            if added == len(code_list):
+                                st.success(f"✅ Added {added} gifts.")
+                            else:
+                                st.error(f"❌ Added {added}/{len(code_list)} gifts.")
+
+        with st.expander("🎲 Run Giveaway"):
+            st.caption("Draws winners for every open gift in one pass: banned participants and people who already "
+                       "hold a gift are excluded, and results are written in one request that never overwrites "
+                       "an assigned or claimed gift, so it's safe to run again after adding gifts.")
+            w1, w2, w3 = st.columns(3)
+            weights = {
+                "Junior": w1.number_input("Junior weight", min_value=0.0, value=DEFAULT_TIER_WEIGHTS["Junior"], step=0.5),
+                "Mid": w2.number_input("Mid weight", min_value=0.0, value=DEFAULT_TIER_WEIGHTS["Mid"], step=0.5),
+                "Senior": w3.number_input("Senior weight", min_value=0.0, value=DEFAULT_TIER_WEIGHTS["Senior"], step=0.5),
+            }
+            verified_only = st.checkbox("Verified participants only")
+            giveaway_seed = st.text_input("Seed (optional)", key="giveaway_seed",
+                                          help="Re-running with the same seed on the same data draws the same winners.")
+            if st.button("🎁 Assign Gifts", use_container_width=True):
+                if giveaway_seed.strip() and not giveaway_seed.strip().isdigit():
+                    st.error("❌ Seed must be a whole number.")
+                else:
+                    with st.spinner("Drawing winners..."):
+                        result = run_giveaway(giveaway_seed.strip() or None, weights, verified_only)
+                    if not result:
+                        st.error(f"❌ {result.error}. No gifts were changed; run it again.")
+                    elif not result.gifts:
+                        st.info("No open gifts to assign.")
+                    else:
+                        st.success(f"✅ Assigned {result.assigned} of {result.gifts} open gifts "
+                                   f"({result.eligible} eligible participants).")
+                        if result.conflicts:
+                            st.warning(f"⚠️ {result.conflicts} gifts were taken by another run meanwhile; run again to fill them.")
+                        st.caption(f"Seed: `{result.seed}` · Excluded: {result.excluded}")
+
+    # Tab 4: Performance
+    with tab4:
+        st.subheader("Performance")
+        st.caption("Timings of database calls, matching phases and email sends in this server process since start (or the last reset).")
+
+        spans = metrics.snapshot()
+        if not spans:
+            st.info("Nothing recorded yet.")
+        else:
+            import pandas as pd
+            df = pd.DataFrame(spans)[["span", "calls", "errors", "rows", "total_ms", "mean_ms", "p50_ms", "p95_ms", "max_ms"]]
+            st.dataframe(df.round(2), use_container_width=True, hide_index=True)
+            slow = [s["span"] for s in spans if s["p95_ms"] > 1000]
+            if slow:
+                st.warning(f"p95 above 1s: {', '.join(slow)}")
+
+        counters = metrics.registry.counters()
+        if counters:
+            st.write("**Counters:**")
+            for (name, labels), value in sorted(counters.items()):
+                label_text = ", ".join(f"{k}={v}" for k, v in labels)
+                st.write(f"- {name}{f' ({label_text})' if label_text else ''}: {value}")
+
+        text = metrics.render_prometheus()
+        with st.expander("Prometheus text"):
+            st.code(text, language="text")
+        reset_col, download_col = st.columns(2)
+        with reset_col:
+            if st.button("Reset timings"):
+                metrics.reset()
+                st.rerun()
+        with download_col:
+            st.download_button("Download metrics.prom", text, file_name="metrics.prom", mime="text/plain")
 
 def main():
     # Check for token in URL
     if "token" in st.query_params and "user_email" not in st.session_state:
         token = st.query_params["token"]
-        email = verify_token(token)
+        # Single use: a link that already logged someone in is rejected
+        email = get_auth(JWT_SECRET, JWT_ALGORITHM).consume(token)
         if email:
             st.session_state.user_email = email
             # Clear the token from URL to prevent reuse
@@ -282,7 +703,8 @@ def main():
         default_address = profile.get("address", "") if profile else ""
         default_pledge = profile.get("pledge", "") if profile else ""
         default_expertise = profile.get("expertise_level", "Mid") if profile else "Mid"
-        default_wishlist = profile.get("wishlist", [{"name": "", "url": ""} for _ in range(3)]) if profile else [{"name": "", "url": ""} for _ in range(3)]
+        # Copy: the profile comes from the shared read cache and must not be mutated
+        default_wishlist = list(profile.get("wishlist") or []) if profile else []
         
         while len(default_wishlist) < 3:
             default_wishlist.append({"name": "", "url": ""})
@@ -0,0 +1,171 @@
+import random
+
+import utils.db as db
+from utils.assignment_graph import AssignmentGraph, add_late_joiners, repair_active_run
+from utils.constraints import ExcludePairs, NoReciprocal, SameDomainExclusion
+from utils.fake_db import FakeDBError
+from utils.matching import MatchingError, SecretSantaMatcher, assignment_digest, verify_assignments
+from utils.synthetic import make_participants
+
+def test_remove_splices_locally():
+    print("Testing incremental repairs...")
+    people = make_participants(300, "realistic", seed=4, companies=6)
+    constraints = [NoReciprocal(), SameDomainExclusion()]
+    matcher = SecretSantaMatcher(people, constraints=constraints, seed=2)
+    original = matcher.run_match()
+    graph = AssignmentGraph(original, people, constraints, seed=1)
+
+    gone = random.Random(3).sample(sorted(original), 40)
+    for email in gone:
+        assert len(graph.remove(email)) <= 2
+    current = graph.assignments()
+    remaining = [p for p in people if p["email"] not in gone]
+    assert verify_assignments(current, remaining, constraints)
+
+    # Only the changed givers differ from the original run
+    changes = graph.changes()
+    assert {g for g in current if current[g] != original[g]} == set(changes)
+    assert len(changes) <= 2 * len(gone)
+    assert graph.digest(matcher.digest) == assignment_digest(current)
+    print(f"✅ 40 removals changed {len(changes)} of {len(current)} pairs ({graph.stats})")
+
+def test_two_cycle_and_dispute():
+    people = [{"email": e} for e in "abcdef"]
+    graph = AssignmentGraph({"a": "b", "b": "a", "c": "d", "d": "e", "e": "f", "f": "c"}, people, seed=1)
+    graph.remove("a")  # b would give to themselves: swaps with another pair
+    current = graph.assignments()
+    assert "a" not in current and current["b"] != "b"
+    assert verify_assignments(current, people[1:], [])
+
+    receiver = graph.receiver_of("c")
+    assert set(graph.reassign("c")) >= {"c"}
+    assert graph.receiver_of("c") != receiver
+    assert verify_assignments(graph.assignments(), people[1:], [])
+    print("✅ 2-cycles and disputes repaired with one swap")
+
+def test_impossible_repair_leaves_graph_unchanged():
+    people = [{"email": e} for e in "abc"]
+    graph = AssignmentGraph({"a": "b", "b": "c", "c": "a"}, people, [NoReciprocal()])
+    try:
+        graph.remove("b")
+        assert False, "expected MatchingError"
+    except MatchingError:
+        pass
+    assert graph.assignments() == {"a": "b", "b": "c", "c": "a"} and not graph.changes()
+
+    # A pair that was already excluded stays excluded after a failed reassign
+    graph = AssignmentGraph({"a": "b", "b": "a"}, [{"email": "a"}, {"email": "b"}], [ExcludePairs([("a", "b")])])
+    a, b = graph.index.ids["a"], graph.index.ids["b"]
+    for _ in range(2):
+        try:
+            graph.reassign("a")
+            assert False, "expected MatchingError"
+        except MatchingError:
+            pass
+        assert graph.assignments() == {"a": "b", "b": "a"} and not graph.compiled.allows(a, b)
+    print("✅ Impossible repairs raise and roll back")
+
+def test_repair_active_run_writes_only_changes(fake):
+    people = make_participants(500, "realistic", seed=6)
+    for row in people:
+        fake.tables["participants"].insert(row)
+    matcher = SecretSantaMatcher(people, seed=5)
+    assignments = matcher.run_match()
+    run = db.save_match_run(matcher.seed, matcher.digest, len(assignments))
+    assert db.save_assignments(assignments, run_id=run["id"])
+
+    banned = people[10]["email"]
+    disputed = people[20]["email"]
+    for row in fake.tables["participants"].rows.values():
+        if row["email"] == banned:
+            row["is_banned"] = True
+    for row in fake.tables["assignments"].rows.values():
+        if row["giver_email"] == disputed:
+            row["is_disputed"] = True
+
+    fake.requests.clear()
+    result = repair_active_run(remove=[people[30]["email"]])
+    assert result, result.error
+    assert set(result.removed) == {banned, people[30]["email"]} and result.reassigned == [disputed]
+    assert 1 <= len(result.changes) <= 6
+    assert fake.requests[("apply_assignment_changes", "rpc")] == 1  # one transaction
+    assert not fake.requests[("assignments", "upsert")] and not fake.requests[("assignments", "delete")]
+
+    stored = {a["giver_email"]: a["receiver_email"] for a in db.iter_assignments()}
+    assert len(stored) == 498 and banned not in stored.values()
+    assert stored[disputed] != assignments[disputed]
+    assert db.get_active_run()["digest"] == assignment_digest(stored)
+
+    # Only the changed pairs' receivers are read to render their emails
+    fake.requests.clear()
+    receivers = list(db.iter_participants_by_email(result.changes.values(), columns=["email", "name"]))
+    assert sorted(r["email"] for r in receivers) == sorted(set(result.changes.values()))
+    assert fake.requests[("participants", "select")] == 1
+
+    # A failed write leaves the run exactly as it was
+    def broken(client, params):
+        raise FakeDBError("connection reset")
+    fake.register_function("apply_assignment_changes", broken)
+    failed = repair_active_run(remove=[people[40]["email"]])
+    assert not failed and failed.error and failed.changes
+    assert {a["giver_email"]: a["receiver_email"] for a in db.iter_assignments()} == stored
+    assert db.get_active_run()["digest"] == assignment_digest(stored)
+    print(f"✅ Repaired the active run with {dict(fake.requests)}")
+
+def test_insert_late_joiners():
+    people = make_participants(350, "realistic", seed=8, companies=5)
+    early, late = people[:300], people[300:]
+    constraints = [NoReciprocal(), SameDomainExclusion()]
+    matcher = SecretSantaMatcher(early, constraints=constraints, seed=3)
+    original = matcher.run_match()
+    graph = AssignmentGraph(original, early, constraints, seed=4)
+
+    assert graph.insert_many(late) == [p["email"] for p in late]
+    assert graph.insert_many(late[:5]) == []  # already matched
+    current = graph.assignments()
+    assert verify_assignments(current, people, constraints)
+    # Each joiner changes at most two rows: the split pair's giver and the joiner
+    changes = graph.changes()
+    assert {p["email"] for p in late} <= set(changes) and len(changes) <= 2 * len(late)
+    assert all(current[g] == r for g, r in original.items() if g not in changes)
+    assert graph.digest(matcher.digest) == assignment_digest(current)
+
+    # Insertions keep (and add to) the Senior -> Junior pairs
+    levels = {p["email"]: p["expertise_level"] for p in people}
+    def mentorships(pairs):
+        return sum(levels[g] == "Senior" and levels[r] == "Junior" for g, r in pairs.items())
+    seniors = sum(p["expertise_level"] == "Senior" for p in late)
+    assert mentorships(current) >= mentorships(original) + seniors > mentorships(original)
+    print(f"✅ 50 late joiners, {len(changes)} rows changed, "
+          f"Senior -> Junior pairs {mentorships(original)} -> {mentorships(current)}")
+
+def test_add_late_joiners_in_one_write(fake):
+    people = make_participants(220, "realistic", seed=9)
+    for row in people[:200]:
+        fake.tables["participants"].insert(row)
+    matcher = SecretSantaMatcher(people[:200], seed=1)
+    assignments = matcher.run_match()
+    run = db.save_match_run(matcher.seed, matcher.digest, len(assignments))
+    assert db.save_assignments(assignments, run_id=run["id"])
+    for row in people[200:]:
+        fake.tables["participants"].insert(row)
+
+    fake.requests.clear()
+    result = add_late_joiners()
+    assert result and len(result.added) == 20 and 20 < len(result.changes) <= 40
+    assert fake.requests[("apply_assignment_changes", "rpc")] == 1
+
+    stored = {a["giver_email"]: a["receiver_email"] for a in db.iter_assignments()}
+    assert len(stored) == 220 and sorted(stored) == sorted(stored.values())
+    assert db.get_active_run()["digest"] == assignment_digest(stored)
+    assert not add_late_joiners().added  # nobody left to add
+    print(f"✅ 20 late joiners saved in one write: {result}")
+
+if __name__ == "__main__":
+    from conftest import run
+    test_remove_splices_locally()
+    test_two_cycle_and_dispute()
+    test_impossible_repair_leaves_graph_unchanged()
+    run(test_repair_active_run_writes_only_changes)
+    test_insert_late_joiners()
+    run(test_add_late_joiners_in_one_write)
@@ -0,0 +1,43 @@
+from unittest.mock import patch
+
+import jwt
+
+from utils.auth import MagicLinkAuth
+
+SECRET = "test-secret-that-is-at-least-32-bytes-long"
+
+def test_verify_is_cached():
+    print("Testing magic-link auth...")
+    auth = MagicLinkAuth(SECRET)
+    token = auth.create_token("user@test.com")
+    assert auth.verify(token) == "user@test.com"
+    with patch("jwt.decode", side_effect=AssertionError("decoded twice")):
+        assert auth.verify(token) == "user@test.com"
+    assert auth.verify(token + "x") is None
+    assert auth.verify(jwt.encode({"email": "x@test.com", "exp": 1}, SECRET)) is None
+    print("✅ Repeat verification skips jwt.decode")
+
+def test_links_are_single_use():
+    auth = MagicLinkAuth(SECRET)
+    token, _ = auth.issue("user@test.com")
+    assert auth.consume(token) == "user@test.com"
+    assert auth.consume(token) is None
+    # After logging in, a new request gets a fresh link
+    fresh, is_new = auth.issue("user@test.com")
+    assert is_new and fresh != token
+    print("✅ Links can't be replayed")
+
+def test_requests_are_coalesced():
+    auth = MagicLinkAuth(SECRET, coalesce_window=60)
+    first, is_new = auth.issue("user@test.com")
+    assert is_new
+    for _ in range(5):
+        assert auth.issue("user@test.com") == (first, False)
+    auth.forget("user@test.com")
+    assert auth.issue("user@test.com")[1]
+    print("✅ Repeat requests within the window reuse one link")
+
+if __name__ == "__main__":
+    test_verify_is_cached()
+    test_links_are_single_use()
+    test_requests_are_coalesced()
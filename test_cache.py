@@ -0,0 +1,51 @@
+import time
+from utils.cache import TTLCache
+
+def test_lru_and_ttl():
+    print("Testing read cache...")
+    cache = TTLCache(maxsize=2, ttl=0.05)
+    cache.set(("participants", "all"), [1, 2])
+    cache.set(("profile", "a@test.com"), {"name": "A"})
+    assert cache.get(("participants", "all")) == [1, 2]
+
+    # Least recently used entry is evicted first
+    cache.set(("profile", "b@test.com"), {"name": "B"})
+    assert cache.get(("profile", "a@test.com")) is None
+    assert cache.get(("participants", "all")) == [1, 2]
+
+    time.sleep(0.06)
+    assert cache.get(("participants", "all")) is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["hits"] == 2 and stats["misses"] == 2
+    print("✅ LRU eviction and TTL expiry work")
+
+def test_invalidation_and_loader():
+    cache = TTLCache(maxsize=10, ttl=60)
+    calls = []
+    load = lambda: calls.append(1) or len(calls)
+    assert cache.get_or_load(("profile", "a@test.com"), load) == 1
+    assert cache.get_or_load(("profile", "a@test.com"), load) == 1
+    cache.set(("profile", "b@test.com"), "B")
+    cache.set(("participants", "all"), "P")
+
+    cache.invalidate("profile", "a@test.com")
+    assert cache.get_or_load(("profile", "a@test.com"), load) == 2
+    assert cache.get(("profile", "b@test.com")) == "B"
+
+    cache.invalidate("profile")
+    assert cache.get(("profile", "b@test.com")) is None
+    assert cache.get(("participants", "all")) == "P"
+
+    # Failed loads are not cached
+    def failing():
+        raise RuntimeError("db down")
+    try:
+        cache.get_or_load(("participants", "x"), failing)
+    except RuntimeError:
+        pass
+    assert cache.get_or_load(("participants", "x"), lambda: "ok") == "ok"
+    print("✅ Prefix invalidation and read-through loading work")
+
+if __name__ == "__main__":
+    test_lru_and_ttl()
+    test_invalidation_and_loader()
@@ -0,0 +1,69 @@
+import csv
+import io
+import os
+import tempfile
+
+from utils.export import ASSIGNMENT_COLUMNS, PARTICIPANT_COLUMNS, export, iter_csv_chunks
+from utils.fake_db import FakeDBError
+
+def make_participants(n):
+    for i in range(n):
+        yield {
+            "email": f"user{i}@test.com",
+            "name": f"User, {i}",
+            "expertise_level": "Senior" if i % 3 == 0 else "Junior",
+            "wishlist": [{"name": "Book", "url": "https://example.com"}],
+            "is_verified": i % 2 == 0,
+        }
+
+def test_csv_export_is_chunked():
+    print("Testing CSV export...")
+    chunks = list(iter_csv_chunks(make_participants(2500), PARTICIPANT_COLUMNS, chunk_rows=1000))
+    assert len(chunks) == 3
+
+    out = io.StringIO()
+    assert export("participants", "csv", out, rows=make_participants(2500)) == 2500
+    rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+    assert len(rows) == 2500 and list(rows[0]) == PARTICIPANT_COLUMNS
+    assert rows[1]["name"] == "User, 1" and rows[1]["address"] == ""
+    assert rows[0]["wishlist"] == '[{"name": "Book", "url": "https://example.com"}]'
+    print(f"✅ {len(rows)} rows in {len(chunks)} chunks")
+
+def test_parquet_export():
+    import pyarrow.parquet as pq
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "participants.parquet")
+        assert export("participants", "parquet", path, rows=make_participants(25)) == 25
+        table = pq.read_table(path)
+        assert table.num_rows == 25 and table.column_names == PARTICIPANT_COLUMNS
+        assert table.column("is_verified").to_pylist()[:2] == [True, False]
+
+        path = os.path.join(tmp, "assignments.parquet")
+        assignments = [{"giver_email": "a@test.com", "giver_name": "A", "receiver_email": "b@test.com",
+                        "receiver_name": "B", "status": "pending", "year": 2024}]
+        assert export("assignments", "parquet", path, rows=assignments) == 1
+        assert pq.read_table(path).column_names == ASSIGNMENT_COLUMNS
+    print("✅ Parquet export keeps typed columns")
+
+def test_failed_read_is_not_a_short_export(fake):
+    for row in make_participants(30):
+        fake.table("participants").insert(row).execute()
+    execute, calls = fake._execute, []
+    def flaky_execute(query):
+        calls.append(query)
+        if len(calls) > 1:
+            raise FakeDBError("connection reset")
+        return execute(query)
+    fake._execute = flaky_execute
+    try:
+        export("participants", "csv", io.StringIO(), page_size=10)
+    except FakeDBError:
+        print("✅ A DB error mid-export fails the export instead of truncating it")
+    else:
+        raise AssertionError("expected the export to fail")
+
+if __name__ == "__main__":
+    from conftest import run
+    test_csv_export_is_chunked()
+    test_parquet_export()
+    run(test_failed_read_is_not_a_short_export)
@@ -0,0 +1,108 @@
+import utils.db as db
+from utils.fake_db import FakeDBError
+from utils.synthetic import make_participants
+
+def profile(name, level="Mid"):
+    return {"name": name, "linkedin_url": "", "website_url": "", "bio": "", "pledge": "p" * 120,
+            "expertise_level": level, "wishlist": []}
+
+def test_profiles_and_pages(fake):
+    print("Testing db layer on the in-memory backend...")
+    for row in make_participants(250, "realistic", seed=3):
+        ok, _ = db.save_profile(row["email"], profile(row["name"], row["expertise_level"]))
+        assert ok
+    assert db.save_profile("user0000001@synthetic.test", profile("Renamed"))[0]  # upsert, not a duplicate
+    assert len(fake.tables["participants"].rows) == 250
+
+    # Reads after a save are served from the row save_profile cached
+    before = fake.requests[("participants", "select")]
+    for _ in range(5):
+        assert db.load_user_profile("user0000001@synthetic.test")["name"] == "Renamed"
+    assert fake.requests[("participants", "select")] == before  # served from the row cached by save_profile
+
+    # Keyset pagination streams everything in email order
+    emails = [row["email"] for row in db.iter_participants(columns=["email"], page_size=40)]
+    assert emails == sorted(emails) and len(emails) == 250
+
+    rows, total = db.get_participants_page(page=1, page_size=20, sort="name", desc=True, search="USER 1")
+    # "User 1x" and "User 1xx"; "User 1" itself was renamed
+    assert total == 110
+    assert len(rows) == 20 and all("user 1" in r["name"].lower() for r in rows)
+    _, seniors = db.get_participants_page(tier="Senior")
+    assert seniors == db.get_admin_stats()["tiers"]["Senior"]
+    print(f"✅ {len(emails)} profiles, {dict(fake.requests)}")
+
+def test_assignment_runs_with_failures(fake):
+    assignments = {f"g{i}@test.com": f"g{(i + 1) % 1000}@test.com" for i in range(1000)}
+    first = db.save_assignments(assignments, chunk_size=100)
+    assert first and first.activated
+
+    fake.failure_rate = 0.3  # retries absorb most failures; a partial save never goes live
+    second = db.save_assignments({g: r for g, r in list(assignments.items())[:500]}, chunk_size=50, retries=5)
+    fake.failure_rate = 0.0
+    if not second:
+        assert db.get_active_run()["id"] == first.run_id
+        second = db.save_assignments({g: r for g, r in list(assignments.items())[:500]}, run_id=second.run_id, chunk_size=50)
+    assert second and db.get_active_run()["id"] == second.run_id
+    assert len(db.get_all_assignments()) == 500
+
+    assert db.update_assignment_status([f"g{i}@test.com" for i in range(120)], "notified")
+    stats = db.get_admin_stats()
+    assert stats["assignments"] == 500 and stats["assignment_status"] == {"notified": 120, "pending": 380}
+    assert db.get_assignment_for_user("g7@test.com")["receiver_email"] == "g8@test.com"
+    print(f"✅ Runs saved with injected failures, {fake.requests[('assignments', 'upsert')]} chunk requests")
+
+def test_history_is_paginated(fake):
+    for year in (2023, 2024):
+        assignments = {f"g{i}@test.com": f"g{(i + year) % 1500}@test.com" for i in range(1500)}
+        assert db.save_assignments(assignments, year=year)
+    fake.requests.clear()
+    history = db.get_assignment_history(before_year=2025)
+    # Past the server's default 1000-row cap, in keyset pages
+    assert len(history) == 3000 and fake.requests[("assignment_history", "select")] == 4  # 3 full pages + an empty one
+    assert {row["year"] for row in db.get_assignment_history(before_year=2024)} == {2023}
+    print(f"✅ {len(history)} history rows in keyset pages")
+
+    # An error on a later page fails the read instead of returning the first page alone
+    view, pages = fake.views["assignment_history"], []
+    def flaky_view():
+        pages.append(1)
+        if len(pages) > 1:
+            raise FakeDBError("connection reset")
+        return view()
+    fake.views["assignment_history"] = flaky_view
+    try:
+        db.get_assignment_history()
+    except FakeDBError:
+        print("✅ A failed history page is an error, not a shorter history")
+    else:
+        raise AssertionError("expected the history read to fail")
+
+def test_history_only_has_final_runs(fake):
+    first = {f"g{i}@test.com": f"g{(i + 1) % 10}@test.com" for i in range(10)}
+    final = {f"g{i}@test.com": f"g{(i + 3) % 10}@test.com" for i in range(10)}
+    draft = {f"g{i}@test.com": f"g{(i + 5) % 10}@test.com" for i in range(10)}
+    assert db.save_assignments(first, year=2023)
+    assert db.save_assignments(final, year=2023)  # replaced the first run the same year
+    db.save_assignments(draft, year=2023, activate=False)  # never went live
+    assert db.save_assignments(first, year=2024)
+    pairs = {(r["giver_email"], r["receiver_email"], r["year"]) for r in db.get_assignment_history()}
+    assert pairs == {(g, r, 2023) for g, r in final.items()} | {(g, r, 2024) for g, r in first.items()}
+    print("✅ History keeps only the run that was final each year")
+
+def test_constraints_are_enforced(fake):
+    fake.table("participants").insert({"email": "a@test.com", "name": "A"}).execute()
+    try:
+        fake.table("participants").insert({"email": "a@test.com", "name": "A again"}).execute()
+    except FakeDBError:
+        print("✅ Unique email enforced")
+    else:
+        raise AssertionError("expected a duplicate key error")
+
+if __name__ == "__main__":
+    from conftest import run
+    run(test_profiles_and_pages)
+    run(test_assignment_runs_with_failures)
+    run(test_history_is_paginated)
+    run(test_history_only_has_final_runs)
+    run(test_constraints_are_enforced)
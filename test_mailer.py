@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+
+from utils import metrics
+from utils.mailer import EmailDispatcher, FileProvider, notify_assignments
+from utils.templates import REMINDER, iter_assignment_messages
+
+class FlakyProvider:
+    """Fails every other call so the dispatcher has to retry."""
+    max_batch = 10
+
+    def __init__(self):
+        self.calls = 0
+        self.sent = []
+
+    def send_batch(self, messages):
+        self.calls += 1
+        if self.calls % 2:
+            raise RuntimeError("429 Too Many Requests")
+        self.sent.extend(m["to"] for m in messages)
+
+def test_batched_dispatch_with_status(no_backoff):
+    print("Testing email dispatch...")
+    results = {}
+    provider = FlakyProvider()
+    dispatcher = EmailDispatcher(provider, batch_size=50, workers=2, rate=1000, max_retries=3,
+                                 linger=0.01, on_result=lambda keys, ok, err: results.update((k, ok) for k in keys))
+    assignments = {f"giver{i}@test.com": f"giver{(i + 1) % 35}@test.com" for i in range(35)}
+    receivers = ({"email": email, "name": email.split("@")[0]} for email in assignments.values())
+    notify_assignments(assignments, "http://localhost:8501", receivers, dispatcher).join()
+    dispatcher.flush()
+
+    stats = dispatcher.stats()
+    assert sorted(provider.sent) == sorted(assignments)
+    assert stats["sent"] == 35 and stats["failed"] == 0 and stats["retries"] > 0
+    assert stats["batches"] >= 4  # provider caps batches at 10
+    assert results == {giver: True for giver in assignments}
+    print(f"✅ {stats['sent']} emails in {stats['batches']} batches, {stats['retries']} retries")
+
+class DownProvider:
+    def send_batch(self, messages):
+        raise RuntimeError("503 Service Unavailable")
+
+def test_failed_batches_are_counted(no_backoff):
+    results = {}
+    dispatcher = EmailDispatcher(DownProvider(), workers=1, rate=1000, max_retries=0, linger=0.01, name="down",
+                                 on_result=lambda keys, ok, err: results.update((k, ok) for k in keys))
+    dispatcher.submit({"to": "a@test.com", "subject": "Hi", "html": "Hi"}, key="a@test.com")
+    dispatcher.flush()
+    batch = next(row for row in metrics.snapshot() if row["span"] == "email.batch.down")
+    assert batch["errors"] >= 1 and results == {"a@test.com": False}
+    print("✅ Failed batches are counted as errors on their span")
+
+def test_file_provider():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "outbox.jsonl")
+        dispatcher = EmailDispatcher(FileProvider(path), rate=1000, linger=0.01)
+        for i in range(3):
+            assert dispatcher.submit({"to": f"u{i}@test.com", "subject": "Hi", "html": "<p>Hi</p>"})
+        dispatcher.flush()
+        with open(path) as f:
+            assert sorted(json.loads(line)["to"] for line in f) == ["u0@test.com", "u1@test.com", "u2@test.com"]
+    print("✅ File provider writes the outbox")
+
+def test_streamed_templates():
+    receivers = iter([
+        {"email": "bob@test.com", "name": "Bob & Co", "bio": "<script>x</script>",
+         "wishlist": [{"name": "Book", "url": "https://example.com/book"}, {"name": "Swag", "url": "javascript:alert(1)"}, {"name": ""}]},
+        {"email": "nobody@test.com", "name": "Not a receiver"},
+    ])
+    messages = list(iter_assignment_messages({"alice@test.com": "bob@test.com"}, receivers, "https://app.test", REMINDER))
+    assert len(messages) == 1
+    message, giver = messages[0]
+    assert giver == "alice@test.com" and message["to"] == "alice@test.com"
+    assert message["subject"].startswith("⏰ Reminder: Bob & Co")
+    assert "Bob &amp; Co" in message["html"] and "<script>" not in message["html"]
+    assert '<a href="https://example.com/book">Book</a>' in message["html"]
+    assert "javascript:" not in message["html"] and "<li>Swag</li>" in message["html"]
+    print("✅ Templates escape fields and render wishlists")
+
+if __name__ == "__main__":
+    from conftest import run
+    run(test_batched_dispatch_with_status)
+    run(test_failed_batches_are_counted)
+    test_file_provider()
+    test_streamed_templates()
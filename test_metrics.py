@@ -0,0 +1,53 @@
+from utils import metrics
+from utils.matching import SecretSantaMatcher
+
+def test_spans_and_prometheus_dump():
+    print("Testing instrumentation...")
+    registry = metrics.registry
+    registry.reset()
+
+    @metrics.span("test.rows")
+    def fetch(n):
+        return [{"id": i} for i in range(n)]
+
+    for n in (3, 4):
+        fetch(n)
+    try:
+        with metrics.span("test.fails"):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    with metrics.span("test.handled"):
+        metrics.log_error("Error: handled and printed")
+    metrics.incr("retries", op="upsert")
+
+    people = [{"email": f"p{i}@test.com", "expertise_level": ["Junior", "Senior"][i % 2]} for i in range(20)]
+    SecretSantaMatcher(people, seed=1).run_match()
+
+    spans = {s["span"]: s for s in metrics.snapshot()}
+    assert spans["test.rows"]["calls"] == 2 and spans["test.rows"]["rows"] == 7
+    assert spans["test.fails"]["errors"] == 1 and spans["test.handled"]["errors"] == 1
+    assert {"match.load_participants", "match.tier_pairs", "match.link_chains"} <= set(spans)
+    assert spans["match.tier_pairs"]["rows"] == 20
+
+    text = metrics.render_prometheus()
+    assert 'secret_santa_span_seconds_count{span="test.rows"} 2' in text
+    assert 'secret_santa_span_seconds_bucket{span="test.rows",le="+Inf"} 2' in text
+    assert 'secret_santa_span_errors_total{span="test.fails"} 1' in text
+    assert 'secret_santa_retries_total{op="upsert"} 1' in text
+    print(f"✅ {len(spans)} spans recorded and exported")
+
+def test_span_overhead_is_small():
+    import time
+    n = 20000
+    start = time.perf_counter()
+    for _ in range(n):
+        with metrics.span("test.overhead"):
+            pass
+    per_call = (time.perf_counter() - start) / n
+    assert per_call < 50e-6, f"{per_call * 1e6:.1f}us per span"
+    print(f"✅ {per_call * 1e6:.2f}us per span")
+
+if __name__ == "__main__":
+    test_spans_and_prometheus_dump()
+    test_span_overhead_is_small()
@@ -1,6 +1,11 @@
+import itertools
+import random
 import sys
+import time
 import pandas as pd
-from utils.matching import SecretSantaMatcher, verify_derangement
+from utils.matching import SecretSantaMatcher, MatchingError, ParticipantIndex, TierPolicy, JUNIOR, MID, assignment_digest, verify_assignments, verify_derangement
+from utils.constraints import ExcludePairs, NoReciprocal, NoRepeatPairs, SameDomainExclusion, compile_constraints
+from utils.synthetic import TIER_MIXES, make_participants, previous_pairs, tier_counts
 
 # Mock data
 mock_participants = [
@@ -26,41 +31,226 @@ def test_matching():
     print(f"Total Participants: {len(mock_participants)}")
     print(f"Total Assignments: {len(assignments)}")
     
-    # Verify everyone is assigned
-    if len(assignments) != len(mock_participants):
-        print(f"❌ Error: Not everyone was assigned. got {len(assignments)}")
-        return
-    
+    # Verify everyone is assigned exactly once
+    assert len(assignments) == len(mock_participants), f"Not everyone was assigned: got {len(assignments)}"
+    assert sorted(assignments.values()) == sorted(p["email"] for p in mock_participants)
+
     # Verify Derangement (No self-match)
-    if verify_derangement(assignments):
-        print("✅ Derangement Check Passed (No self-matches)")
-    else:
-        print("❌ Derangement Check FAILED")
-        for g, r in assignments.items():
-            if g == r:
-                print(f"   Self-match found: {g}")
+    assert verify_derangement(assignments), "Self-match found"
+    print("✅ Derangement Check Passed (No self-matches)")
+    assert verify_assignments(assignments, mock_participants)
+    giver = next(iter(assignments))
+    assert not verify_assignments({**assignments, giver: giver}, mock_participants)
+    assert not verify_assignments(assignments, mock_participants[1:])
 
     # Verify Logic: Seniors -> Juniors
     # We expect SR1 and SR2 to be assigned to Juniors
     print("\nVerifying Senior Assignments:")
     seniors = ["sr1@test.com", "sr2@test.com"]
     juniors = ["jr1@test.com", "jr2@test.com", "jr3@test.com"]
-    
-    senior_matches_valid = 0
     for sr in seniors:
-        receiver = assignments.get(sr)
-        print(f"  {sr} -> {receiver}")
-        if receiver in juniors:
-            senior_matches_valid += 1
-            
-    if senior_matches_valid == len(seniors):
-        print("✅ All Seniors matched with Juniors priority")
+        print(f"  {sr} -> {assignments.get(sr)}")
+        assert assignments.get(sr) in juniors, f"{sr} was not matched with a junior"
+    print("✅ All Seniors matched with Juniors priority")
+
+def test_synthetic_pools():
+    print("\n--- Testing Synthetic Pools ---")
+    for mix in TIER_MIXES:
+        for n in (2, 3, 10, 257):
+            people = make_participants(n, mix, seed=n)
+            junior, _, senior = tier_counts(n, mix)
+            for seed in range(5):
+                matcher = SecretSantaMatcher(people, seed=seed)
+                assignments = matcher.run_match()
+                assert len(assignments) == n and verify_derangement(assignments)
+                assert sorted(assignments.values()) == sorted(p["email"] for p in people)
+                # The fast path always makes every possible senior -> junior pair
+                level = {p["email"]: p["expertise_level"] for p in people}
+                made = sum(1 for g, r in assignments.items() if level[g] == "Senior" and level[r] == "Junior")
+                assert made == matcher.stats["tier_pairs"] == min(junior, senior)
+
+    people = make_participants(500, "realistic", seed=1, companies=10)
+    matcher = SecretSantaMatcher(people, constraints=[NoReciprocal(), SameDomainExclusion(), NoRepeatPairs(previous_pairs(people))])
+    assignments = matcher.run_match()
+    assert len(assignments) == 500 and verify_derangement(assignments)
+    assert set(matcher.stats) == {"tier_pairs", "greedy_misses", "augmented", "reciprocal_swaps"}
+    print(f"✅ Every tier mix matches fully; constrained run stats {matcher.stats}")
+
+def test_small_and_skewed_pools():
+    print("\n--- Testing Edge Cases ---")
+    # Two people can always swap
+    pair = [
+        {"email": "a@test.com", "expertise_level": "Mid"},
+        {"email": "b@test.com", "expertise_level": "Mid"},
+    ]
+    assert SecretSantaMatcher(pair).run_match() == {"a@test.com": "b@test.com", "b@test.com": "a@test.com"}
+
+    # One senior and one junior: the junior closes the loop back to the senior
+    duo = [
+        {"email": "sr@test.com", "expertise_level": "Senior"},
+        {"email": "jr@test.com", "expertise_level": "Junior"},
+    ]
+    assert SecretSantaMatcher(duo).run_match() == {"sr@test.com": "jr@test.com", "jr@test.com": "sr@test.com"}
+
+    # Seniors outnumber juniors: every junior still gets a senior
+    skewed = [{"email": f"sr{i}@test.com", "expertise_level": "Senior"} for i in range(20)]
+    skewed += [{"email": "jr@test.com", "expertise_level": "Junior"}]
+    for _ in range(50):
+        assignments = SecretSantaMatcher(skewed).run_match()
+        assert len(assignments) == len(skewed)
+        assert sorted(assignments.values()) == sorted(p["email"] for p in skewed)
+        assert verify_derangement(assignments)
+    print("✅ Small and skewed pools always produce a full derangement")
+
+    # An empty pool or a single participant can never be matched
+    for pool in ([], [{"email": "solo@test.com", "expertise_level": "Mid"}]):
+        try:
+            SecretSantaMatcher(pool).run_match()
+        except MatchingError:
+            pass
+        else:
+            raise AssertionError(f"expected MatchingError for {len(pool)} participants")
+    print("✅ Empty and single-participant pools report a MatchingError")
+
+def test_tier_policies():
+    print("\n--- Testing Tier Policies ---")
+    people = [{"email": "sr@test.com", "expertise_level": "Senior"}]
+    people += [{"email": f"mid{i}@test.com", "expertise_level": "Mid"} for i in range(2)]
+    people += [{"email": f"jr{i}@test.com", "expertise_level": "Junior"} for i in range(3)]
+    juniors = {p["email"] for p in people if p["expertise_level"] == "Junior"}
+    mids = {p["email"] for p in people if p["expertise_level"] == "Mid"}
+
+    for _ in range(50):
+        assignments = SecretSantaMatcher(people, policy="mid_junior_overflow").run_match()
+        assert verify_derangement(assignments) and len(assignments) == len(people)
+        # The senior takes one junior, both mids take the other two
+        assert assignments["sr@test.com"] in juniors
+        assert all(assignments[m] in juniors for m in mids)
+
+    seniors_heavy = [{"email": f"sr{i}@test.com", "expertise_level": "Senior"} for i in range(3)]
+    seniors_heavy += [{"email": "jr@test.com", "expertise_level": "Junior"}]
+    seniors_heavy += [{"email": f"mid{i}@test.com", "expertise_level": "Mid"} for i in range(2)]
+    for _ in range(50):
+        assignments = SecretSantaMatcher(seniors_heavy, policy="senior_mid_fallback").run_match()
+        assert verify_derangement(assignments)
+        # Seniors without a junior fall back to mids instead of the general pool
+        assert all(assignments[f"sr{i}@test.com"] != f"sr{j}@test.com" for i in range(3) for j in range(3))
+
+    try:
+        TierPolicy([(JUNIOR, MID)])
+    except ValueError:
+        print("✅ Upward tier stages are rejected")
     else:
-        print(f"⚠️  Only {senior_matches_valid}/{len(seniors)} Seniors matched with Juniors")
+        raise AssertionError("expected ValueError")
+    print("✅ Overflow and fallback policies honoured")
+
+def test_constrained_matching():
+    print("\n--- Testing Constraint-Aware Solver ---")
+    people = [
+        {"email": f"p{i}@test.com", "expertise_level": "Mid", "website_url": f"https://www.agency{i % 3}.com/team"}
+        for i in range(12)
+    ]
+    last_year = [(f"p{i}@test.com", f"p{(i + 1) % 12}@test.com") for i in range(12)]
+    constraints = [NoReciprocal(), NoRepeatPairs(last_year), SameDomainExclusion()]
+
+    for _ in range(50):
+        assignments = SecretSantaMatcher(people, constraints=constraints).run_match()
+        assert len(assignments) == len(people) and verify_derangement(assignments)
+        assert sorted(assignments.values()) == sorted(p["email"] for p in people)
+        for giver, receiver in assignments.items():
+            assert assignments[receiver] != giver
+            assert (giver, receiver) not in last_year
+            assert int(giver[1:].split("@")[0]) % 3 != int(receiver[1:].split("@")[0]) % 3
+    print("✅ Exclusions, history and no-reciprocal rules all respected")
+
+    # Two thirds of the pool at one agency: impossible, and reported as such
+    crowded = [{"email": f"c{i}@test.com", "website_url": "acme.com" if i < 4 else "other.com"} for i in range(6)]
+    try:
+        SecretSantaMatcher(crowded, constraints=[SameDomainExclusion()]).run_match()
+    except MatchingError as e:
+        print(f"✅ Impossible constraints reported: {e}")
+    else:
+        raise AssertionError("expected MatchingError")
+
+def brute_force_feasible(people, constraints):
+    index = ParticipantIndex(people, columns=["website_url"])
+    compiled = compile_constraints(index, constraints)
+    n = len(index)
+    for perm in itertools.permutations(range(n)):
+        if all(compiled.allows(g, perm[g]) for g in range(n)):
+            if not (compiled.no_reciprocal and any(perm[perm[g]] == g for g in range(n))):
+                return True
+    return False
+
+def test_reciprocal_rule_matches_brute_force():
+    print("\n--- Testing No-Reciprocal Against Brute Force ---")
+    # One swap can't fix p2 <-> p0 here; the solver has to re-route through the others
+    people = [
+        {"email": "p0", "expertise_level": "Mid"},
+        {"email": "p1", "expertise_level": "Junior", "website_url": "a.com"},
+        {"email": "p2", "expertise_level": "Senior", "website_url": "a.com"},
+        {"email": "p3", "expertise_level": "Junior"},
+    ]
+    constraints = [SameDomainExclusion(), ExcludePairs([("p0", "p2"), ("p3", "p0")], symmetric=False), NoReciprocal()]
+    for seed in range(200):
+        assert verify_assignments(SecretSantaMatcher(people, constraints=constraints, seed=seed).run_match(),
+                                  people, constraints)
+
+    # Small random pools: an error only when no valid matching exists
+    rng = random.Random(0)
+    for case in range(600):
+        n = rng.randint(2, 7)
+        people = [{"email": f"p{i}", "expertise_level": rng.choice(["Junior", "Mid", "Senior"]),
+                   "website_url": rng.choice([None, "a.com", "b.com"])} for i in range(n)]
+        pairs = [tuple(rng.sample([p["email"] for p in people], 2)) for _ in range(rng.randint(0, n))]
+        constraints = [SameDomainExclusion(), ExcludePairs(pairs, symmetric=rng.random() < 0.5), NoReciprocal()]
+        try:
+            assignments = SecretSantaMatcher(people, constraints=constraints, seed=case).run_match()
+        except MatchingError:
+            assert not brute_force_feasible(people, constraints), f"false failure: {people} {pairs}"
+        else:
+            assert verify_assignments(assignments, people, constraints)
+    print("✅ Reciprocal-free matchings found whenever one exists")
+
+def test_dominant_domain_is_fast():
+    print("\n--- Testing One Dominant Agency ---")
+    # 49% of the pool at one agency: thousands of greedy misses for the repair phase
+    people = make_participants(20000, "realistic", seed=2)
+    for i, p in enumerate(people):
+        p["website_url"] = "https://bigco.example" if i % 100 < 49 else f"https://solo{i}.example"
+    start = time.perf_counter()
+    matcher = SecretSantaMatcher(people, constraints=[SameDomainExclusion(), NoReciprocal()], seed=1)
+    assignments = matcher.run_match()
+    elapsed = time.perf_counter() - start
+    assert sorted(assignments.values()) == sorted(assignments)
+    bigco = {p["email"] for p in people if p["website_url"] == "https://bigco.example"}
+    assert not any(g in bigco and r in bigco for g, r in assignments.items())
+    assert all(assignments[r] != g for g, r in assignments.items())
+    assert matcher.stats["augmented"] > 1000 and elapsed < 10
+    print(f"✅ 20,000 participants (49% at one agency) in {elapsed:.2f}s, {matcher.stats['augmented']} augmented")
+
+def test_seeded_runs_are_reproducible():
+    print("\n--- Testing Seeded Runs ---")
+    people = [{"email": f"p{i}@test.com", "expertise_level": ["Junior", "Mid", "Senior"][i % 3]} for i in range(30)]
+    first = SecretSantaMatcher(people, seed=1234)
+    again = SecretSantaMatcher(list(reversed(people)), seed=1234)  # DB row order must not matter
+    assert first.run_match() == again.run_match()
+    assert first.digest == again.digest == assignment_digest(first.run_match())
+
+    constrained = SecretSantaMatcher(people, constraints=[NoReciprocal()], seed=99)
+    assert constrained.run_match() == SecretSantaMatcher(people, constraints=[NoReciprocal()], seed=99).run_match()
 
-    print("\nFull Assignments Map:")
-    for k, v in assignments.items():
-        print(f"{k} -> {v}")
+    other = SecretSantaMatcher(people, seed=4321)
+    other.run_match()
+    assert other.digest != first.digest
+    print(f"✅ Seed 1234 reproduces digest {first.digest}")
 
 if __name__ == "__main__":
     test_matching()
+    test_synthetic_pools()
+    test_small_and_skewed_pools()
+    test_tier_policies()
+    test_constrained_matching()
+    test_reciprocal_rule_matches_brute_force()
+    test_dominant_domain_is_fast()
+    test_seeded_runs_are_reproducible()
@@ -0,0 +1,64 @@
+from utils.constraints import NoReciprocal, SameDomainExclusion
+from utils.matching import assignment_digest
+from utils.metrics import registry
+from utils.sharding import MERGED, ShardedMatcher, plan_shards, process_pool
+from utils.synthetic import make_participants
+
+def with_regions(rows, regions):
+    for i, row in enumerate(rows):
+        row["region"] = regions[i % len(regions)]
+    return rows
+
+def test_undersized_shards_are_merged():
+    print("Testing sharded matching...")
+    rows = [{"email": f"{k}{i}", "region": k} for k, n in (("eu", 5), ("us", 1), ("apac", 1)) for i in range(n)]
+    shards = plan_shards(rows, lambda r: r["region"])
+    assert [(k, sorted(keys), len(members)) for k, keys, members in shards] == [("eu", ["eu"], 5), (MERGED, ["apac", "us"], 2)]
+
+    shards = plan_shards(rows[:6], lambda r: r["region"])  # a lone "us" joins the smallest real shard
+    assert [(k, keys, len(members)) for k, keys, members in shards] == [("eu", ["eu", "us"], 6)]
+    assert all(len(members) >= 2 for _, _, members in plan_shards(rows, lambda r: r["email"]))
+    print("✅ No shard ends up with fewer than 2 people")
+
+def test_shards_stay_separate_and_reproducible():
+    people = with_regions(make_participants(3000, "realistic", seed=2, companies=20), ["eu", "us", "apac", "latam", "x"])
+    people.append({"email": "solo@test.com", "expertise_level": "Mid", "region": "antarctica"})
+    constraints = [NoReciprocal(), SameDomainExclusion()]
+
+    single = ShardedMatcher(people, key="region", constraints=constraints, seed=9, max_workers=1)
+    assignments = single.run_match()
+    region = {p["email"]: p["region"] for p in people}
+    assert sorted(assignments) == sorted(assignments.values()) == sorted(region)
+    assert all(region[g] == region[r] for g, r in assignments.items() if region[g] != "antarctica" and region[r] != "antarctica")
+    assert single.digest == assignment_digest(assignments)
+    assert len(single.stats["shards"]) == 5 and sum(s["size"] for s in single.stats["shards"]) == 3001
+
+    parallel = ShardedMatcher(people, key="region", constraints=constraints, seed=9, max_workers=3)
+    assert parallel.run_match() == assignments and parallel.digest == single.digest
+    print(f"✅ {len(assignments)} participants in {len(single.stats['shards'])} shards, "
+          f"{parallel.stats['workers']} workers give the same run")
+
+def test_hash_sharding_for_big_events():
+    people = make_participants(20000, "uniform", seed=4)
+    matcher = ShardedMatcher(people, shards=8, seed=1, max_workers=2)
+    assignments = matcher.run_match()
+    assert len(matcher.stats["shards"]) == 8
+    assert sorted(assignments) == sorted(assignments.values()) and all(g != r for g, r in assignments.items())
+    assert matcher.stats["tier_pairs"] == sum(s["tier_pairs"] for s in matcher.stats["shards"]) > 0
+    print(f"✅ 8 hash shards: {matcher.stats['cpu_seconds']:.2f}s of solver time")
+
+def metrics_lock_held():
+    return registry._lock.locked()
+
+def test_workers_do_not_inherit_locks():
+    # A forked worker would copy the lock in its held state and block on its first span
+    with registry._lock:
+        with process_pool(1) as pool:
+            assert not pool.submit(metrics_lock_held).result(timeout=60)
+    print("✅ Worker processes start with clean locks")
+
+if __name__ == "__main__":
+    test_undersized_shards_are_merged()
+    test_shards_stay_separate_and_reproducible()
+    test_hash_sharding_for_big_events()
+    test_workers_do_not_inherit_locks()
@@ -0,0 +1,86 @@
+import random
+import time
+from collections import Counter
+
+import utils.db as db
+from utils.sponsors import EligibilityIndex, allocate, run_giveaway
+from utils.synthetic import make_participants
+
+def load_participants(fake, n, seed=0, banned_every=10):
+    """Insert synthetic participants directly; every `banned_every`-th one is banned."""
+    table = fake.tables["participants"]
+    for i, row in enumerate(make_participants(n, "uniform", seed=seed)):
+        table.insert({**row, "is_banned": i % banned_every == 0})
+
+def test_weighted_lottery():
+    print("Testing sponsor gift lottery...")
+    people = [{"id": f"p{i}", "expertise_level": level, "is_banned": i == 0}
+              for i, level in enumerate(["Junior", "Mid", "Senior"] * 1000)]
+    index = EligibilityIndex(people, winners={"p1"})
+    assert len(index) == 2998 and index.excluded["banned"] == 1 and index.excluded["already_won"] == 1
+
+    rng = random.Random(5)
+    wins = Counter()
+    for _ in range(50):
+        for pid in index.draw(300, rng):
+            wins[int(pid[1:]) % 3] += 1
+    # Weights 3:2:1 -> juniors win clearly most often, seniors least
+    assert wins[0] > wins[1] > wins[2]
+
+    gifts = [{"id": f"g{i}", "sponsor_id": "s1" if i < 5 else "s2", "value_usd": i} for i in range(10)]
+    pairs = allocate(gifts, index, random.Random(1), sponsors=[{"id": "s1", "tier": "Gold"}, {"id": "s2", "tier": "Bronze"}])
+    assert [g for g, _ in pairs][:5] == ["g4", "g3", "g2", "g1", "g0"]  # Gold first, then by value
+    assert len({w for _, w in pairs}) == 10
+    assert pairs == allocate(gifts, index, random.Random(1), sponsors=[{"id": "s1", "tier": "Gold"}, {"id": "s2", "tier": "Bronze"}])
+    print(f"✅ Wins by tier (Junior, Mid, Senior): {wins[0]}, {wins[1]}, {wins[2]}")
+
+def test_giveaway_is_batched_and_rerunnable(fake):
+    load_participants(fake, 500)
+    sponsor = db.add_sponsor("Acme", "Gold")
+    assert db.add_sponsor_gifts(sponsor["id"], "Pro licence", [f"CODE-{i}" for i in range(300)], 99) == 300
+
+    fake.requests.clear()
+    result = run_giveaway(seed=7)
+    assert result and result.assigned == result.planned == 300 and result.conflicts == 0
+    assert result.excluded["banned"] == 50 and result.eligible == 450
+    assert fake.requests[("assign_sponsor_gifts", "rpc")] == 1  # one bulk write
+
+    gifts = list(fake.tables["sponsor_gifts"].rows.values())
+    winners = [g["winner_id"] for g in gifts]
+    banned = {p["id"] for p in fake.tables["participants"].rows.values() if p["is_banned"]}
+    assert len(set(winners)) == 300 and not banned & set(winners)
+
+    # Re-running with nothing open changes nothing
+    again = run_giveaway(seed=8)
+    assert again.gifts == 0 and [g["winner_id"] for g in gifts] == winners
+
+    # New gifts go only to people without one; claimed gifts are never touched
+    db.add_sponsor_gifts(sponsor["id"], "Swag box", [None] * 201)
+    claimed = next(g for g in fake.tables["sponsor_gifts"].rows.values() if g["winner_id"] is None)
+    claimed["is_claimed"] = True
+    more = run_giveaway(seed=9)
+    assert more.excluded["already_won"] == 300 and more.assigned == more.planned == 150
+    assert claimed["winner_id"] is None
+    assert len({g["winner_id"] for g in fake.tables["sponsor_gifts"].rows.values() if g["winner_id"]}) == 450
+
+    # Stale plans are refused by the database, not written twice
+    taken = gifts[0]["id"]
+    assert db.assign_sponsor_gifts([(taken, "someone-else")]) == 0
+    print(f"✅ 300 + 150 gifts in one write each: {more}")
+
+def test_giveaway_scales(fake):
+    load_participants(fake, 50000, banned_every=50)
+    sponsor = db.add_sponsor("Bulk", "Silver")
+    db.add_sponsor_gifts(sponsor["id"], "Voucher", [None] * 5000, 10)
+    start = time.perf_counter()
+    result = run_giveaway(seed=1)
+    elapsed = time.perf_counter() - start
+    assert result.assigned == 5000 and result.eligible == 49000
+    assert elapsed < 10
+    print(f"✅ 5,000 gifts over 50,000 participants in {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    from conftest import run
+    test_weighted_lottery()
+    run(test_giveaway_is_batched_and_rerunnable)
+    run(test_giveaway_scales)
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import threading
+
+from utils.mailer import EmailDispatcher, FileProvider
+from utils.throttle import AdmissionController, TokenBucket
+
+def test_admission_per_key_and_global():
+    print("Testing login admission...")
+    # Refill is negligible during the test, so only the bursts matter
+    admission = AdmissionController(per_key_rate=0.001, per_key_burst=3, global_rate=0.001, global_burst=10, max_keys=5)
+
+    results = [admission.admit("spammer@test.com") for _ in range(5)]
+    assert [ok for ok, _ in results] == [True, True, True, False, False]
+    assert results[-1][1] == "key"
+
+    results = [admission.admit(f"user{i}@test.com") for i in range(10)]
+    assert sum(ok for ok, _ in results) == 7  # 3 of the 10 global tokens went to the spammer
+    assert {reason for ok, reason in results if not ok} == {"global"}
+
+    stats = admission.stats()
+    assert stats["admitted"] == 10 and stats["rejected_key"] == 2 and stats["rejected_global"] == 3
+    assert stats["tracked_keys"] == 5  # bounded LRU of per-address buckets
+    print(f"✅ Admission: {stats}")
+
+def test_burst_of_logins_is_queued_not_blocking():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "outbox.jsonl")
+        limiter = TokenBucket(1000)
+        login = EmailDispatcher(FileProvider(path), workers=1, linger=0.01, limiter=limiter, name="login")
+        bulk = EmailDispatcher(FileProvider(path), linger=0.01, limiter=limiter)
+        assert login.limiter is bulk.limiter
+
+        threads = [
+            threading.Thread(target=login.submit, args=({"to": f"u{i}@test.com", "subject": "Login", "html": ""}, f"u{i}@test.com"))
+            for i in range(200)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        login.flush()
+
+        stats = login.stats()
+        assert stats["submitted"] == stats["sent"] == 200 and stats["queued"] == 0
+        assert 0 <= stats["latency_p50"] <= stats["latency_p95"] <= stats["latency_max"]
+        assert stats["batches"] < 200  # the burst was batched
+        print(f"✅ 200 concurrent logins in {stats['batches']} batches, p95 {stats['latency_p95'] * 1000:.1f}ms")
+
+if __name__ == "__main__":
+    test_admission_per_key_and_global()
+    test_burst_of_logins_is_queued_not_blocking()
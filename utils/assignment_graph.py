@@ -0,0 +1,378 @@
+import random
+from itertools import chain
+
+from utils.constraints import compile_constraints, extend_constraints, required_columns
+from utils.matching import JUNIOR, SENIOR, MatchingError, ParticipantIndex, new_seed, update_digest
+from utils.metrics import span
+
+
+class AssignmentGraph:
+    """
+    An existing matching as a mutable giver -> receiver graph, for local repairs.
+
+    Removing someone splices their giver to their receiver. If that pair
+    is not allowed (a self-match, a reciprocal pair or a constraint), one
+    other pair C -> D is rewired instead: giver -> D and C -> receiver.
+    A repair touches one or two pairs. Finding a swap partner takes a few
+    random probes and falls back to a scan only in pathological cases.
+    Nothing else moves, so `changes()` lists only the givers who need a
+    new row and a new email.
+
+    Late joiners go the other way: insert() turns one pair A -> B into
+    A -> new -> B. Batches share the same in-memory indexes.
+    """
+
+    def __init__(self, assignments, participants=None, constraints=None, seed=None, tries=32):
+        """
+        assignments: {giver_email: receiver_email}, a single cycle cover
+        participants: rows with email, expertise_level and any constraint
+            columns. People missing from it get no tier or constraint data.
+        constraints: utils.constraints.Constraint list, checked on every
+            pair a repair creates
+        seed: seeds the random swap partner search
+        """
+        self.constraints = list(constraints or ())
+        self.seed = new_seed() if seed is None else int(seed)
+        self.tries = tries
+        self.index = ParticipantIndex(
+            sorted(participants or (), key=lambda p: p.get("email") or ""),
+            columns=required_columns(self.constraints),
+        )
+        for email in chain(sorted(assignments), sorted(assignments.values())):
+            self.index.add(email)
+        self.compiled = compile_constraints(self.index, self.constraints)
+
+        ids = self.index.ids
+        self.succ = {ids[g]: ids[r] for g, r in assignments.items()}
+        self.pred = {r: g for g, r in self.succ.items()}
+        self.before = {}  # giver id -> receiver id before the first change (None for new givers)
+        self.removed = []
+        self.stats = {"removed": 0, "spliced": 0, "swaps": 0, "reassigned": 0, "inserted": 0, "tier_inserts": 0}
+        self._rng = random.Random(self.seed)
+
+    def __len__(self):
+        return len(self.succ)
+
+    def __contains__(self, email):
+        return self.index.ids.get(email) in self.succ
+
+    def receiver_of(self, email):
+        pid = self.index.ids.get(email)
+        return self.index.emails[self.succ[pid]] if pid in self.succ else None
+
+    def giver_of(self, email):
+        pid = self.index.ids.get(email)
+        return self.index.emails[self.pred[pid]] if pid in self.pred else None
+
+    def assignments(self):
+        """The current {giver_email: receiver_email}."""
+        return self.index.to_emails(self.succ)
+
+    def changes(self):
+        """{giver_email: receiver_email} for every giver whose receiver changed."""
+        emails = self.index.emails
+        return {
+            emails[g]: emails[self.succ[g]]
+            for g, old in self.before.items()
+            if g in self.succ and self.succ[g] != old
+        }
+
+    def digest(self, base):
+        """assignment_digest() of the current pairs, updated from `base` in O(changes)."""
+        emails = self.index.emails
+        old = [(emails[g], emails[r]) for g, r in self.before.items() if r is not None]
+        new = [(emails[g], emails[self.succ[g]]) for g in self.before if g in self.succ]
+        return update_digest(base, old, new)
+
+    def mark_saved(self):
+        """Forget the pending changes once they are written."""
+        self.before.clear()
+        self.removed = []
+
+    # Repairs
+
+    def remove(self, email):
+        """
+        Take `email` out of the matching and close the gap.
+
+        Returns the emails of the givers whose receiver changed. Raises
+        MatchingError (leaving the graph unchanged) if no repair satisfies
+        the constraints, e.g. when fewer than 3 people would remain with
+        NoReciprocal.
+        """
+        pid = self.index.ids.get(email)
+        if pid not in self.succ:
+            return []
+        with span("graph.remove"):
+            giver, receiver = self.pred[pid], self.succ[pid]
+            self._record(giver)
+            self._record(pid)
+            self._unlink(giver)
+            self._unlink(pid)
+            try:
+                touched = self._close(giver, receiver)
+            except MatchingError:
+                self._link(pid, receiver)
+                self._link(giver, pid)
+                raise
+            self.removed.append(email)
+            self.stats["removed"] += 1
+            return [self.index.emails[g] for g in touched]
+
+    def reassign(self, giver_email):
+        """
+        Give `giver_email` a different receiver (e.g. after a dispute).
+
+        The old pair is forbidden from then on, so the repair always swaps
+        with one other pair. Returns the changed givers' emails.
+        """
+        giver = self.index.ids.get(giver_email)
+        if giver not in self.succ:
+            return []
+        with span("graph.reassign"):
+            receiver = self.succ[giver]
+            # The pair may already be excluded (e.g. NoRepeatPairs); a rollback must keep that
+            excluded = receiver in self.compiled.forbidden.get(giver, ())
+            self.compiled.forbid(giver, receiver)
+            self._record(giver)
+            self._unlink(giver)
+            try:
+                touched = self._close(giver, receiver)
+            except MatchingError:
+                if not excluded:
+                    self.compiled.forbidden[giver].discard(receiver)
+                self._link(giver, receiver)
+                raise
+            self.stats["reassigned"] += 1
+            return [self.index.emails[g] for g in touched]
+
+    def insert(self, email, expertise_level=None, row=None):
+        """
+        Add a late joiner by splitting one pair A -> B into A -> new -> B.
+
+        A few random pairs are probed and the first one that keeps the
+        Senior -> Junior preference best is used: a new Junior is placed
+        after a Senior, a new Senior before a Junior, preferably without
+        breaking an existing Senior -> Junior pair. O(1) for a typical
+        pool. Returns the two givers whose receiver changed (A and new).
+        """
+        size = len(self.index)
+        pid = self.index.add(email, expertise_level, row)
+        if pid is None or pid in self.succ:
+            return []
+        if len(self.index) > size:
+            extend_constraints(self.index, self.compiled, self.constraints, pid)
+        if not self.succ:
+            raise MatchingError("Can't add a participant to an empty assignment set.")
+        with span("graph.insert"):
+            giver = self._pick_edge(pid)
+            receiver = self.succ[giver]
+            self._record(giver)
+            self._record(pid)
+            self._unlink(giver)
+            self._link(giver, pid)
+            self._link(pid, receiver)
+            self.stats["inserted"] += 1
+            return [self.index.emails[giver], email]
+
+    def insert_many(self, rows):
+        """insert() each row (email, expertise_level, constraint columns). Returns the added emails."""
+        added = []
+        for row in rows:
+            if self.insert(row["email"], row.get("expertise_level"), row):
+                added.append(row["email"])
+        return added
+
+    def _mentorship(self, giver, receiver):
+        tiers = self.index.tiers
+        return int(tiers[giver] == SENIOR and tiers[receiver] == JUNIOR)
+
+    def _pick_edge(self, new):
+        """Giver A of the pair A -> B to split for `new`, best tier gain of the allowed pairs probed."""
+        succ = self.succ
+        allows = self.compiled.allows
+        n = len(self.index)
+        best, best_gain = None, None
+        probes = (int(self._rng.random() * n) for _ in range(self.tries))
+        for i, a in enumerate(chain(probes, succ)):  # lazy: the scan never mutates succ
+            if i == self.tries and best is not None:
+                break  # the scan is only a fallback when no probe was allowed
+            b = succ.get(a)
+            if b is None or a == new or not (allows(a, new) and allows(new, b)):
+                continue
+            gain = self._mentorship(a, new) + self._mentorship(new, b) - self._mentorship(a, b)
+            if best is None or gain > best_gain:
+                best, best_gain = a, gain
+                if gain > 0:
+                    break
+        if best is None:
+            raise MatchingError(f"No pair can take {self.index.emails[new]} without breaking the constraints.")
+        if best_gain > 0:
+            self.stats["tier_inserts"] += 1
+        return best
+
+    def _record(self, giver):
+        if giver not in self.before:
+            self.before[giver] = self.succ.get(giver)
+
+    def _link(self, giver, receiver):
+        self.succ[giver] = receiver
+        self.pred[receiver] = giver
+
+    def _unlink(self, giver):
+        receiver = self.succ.pop(giver)
+        del self.pred[receiver]
+
+    def _allowed(self, giver, receiver, reverse):
+        """giver -> receiver is allowed, given that receiver will give to `reverse`."""
+        if not self.compiled.allows(giver, receiver):
+            return False
+        return not (self.compiled.no_reciprocal and reverse == giver)
+
+    def _close(self, giver, receiver):
+        """
+        Connect a giver without a receiver to a receiver without a giver.
+
+        Directly if allowed, otherwise by rewiring one existing pair C -> D
+        into giver -> D and C -> receiver. Returns the givers touched.
+        """
+        if giver != receiver and self._allowed(giver, receiver, self.succ.get(receiver)):
+            self._link(giver, receiver)
+            self.stats["spliced"] += 1
+            return [giver]
+
+        succ = self.succ
+        n = len(self.index)
+        probes = (int(self._rng.random() * n) for _ in range(self.tries))
+        for c in chain(probes, succ):  # lazy: the loop returns right after it mutates succ
+            d = succ.get(c)
+            if d is None:
+                continue
+            # After the swap d still gives to succ[d], and receiver gives to
+            # d if receiver is the giver itself, else to its current receiver
+            receiver_gives_to = d if receiver == giver else succ.get(receiver)
+            if self._allowed(giver, d, succ.get(d)) and self._allowed(c, receiver, receiver_gives_to):
+                self._record(c)
+                self._unlink(c)
+                self._link(giver, d)
+                self._link(c, receiver)
+                self.stats["swaps"] += 1
+                return [giver, c]
+        raise MatchingError(
+            f"No valid repair for {self.index.emails[giver]} -> {self.index.emails[receiver]} "
+            "satisfies the constraints."
+        )
+
+
+class RepairResult:
+    """Outcome of repair_active_run. Truthy if the changes were saved."""
+    __slots__ = ("changes", "removed", "reassigned", "added", "digest", "error")
+
+    def __init__(self, error=None):
+        self.changes = {}
+        self.removed = []
+        self.reassigned = []
+        self.added = []
+        self.digest = None
+        self.error = error
+
+    def __bool__(self):
+        return self.error is None
+
+    def __repr__(self):
+        return (f"RepairResult(changed={len(self.changes)}, removed={len(self.removed)}, "
+                f"reassigned={len(self.reassigned)}, added={len(self.added)}, error={self.error!r})")
+
+
+def load_active_graph(constraints=None, seed=None):
+    """
+    The active run as an AssignmentGraph, read once: (graph, participants, assignment_rows).
+    Participant rows include is_banned and created_at; assignment rows is_disputed.
+    """
+    from utils import db
+    rows = list(db.iter_assignments(columns=["giver_email", "receiver_email", "is_disputed"]))
+    participants = list(db.iter_participants(
+        columns=["email", "expertise_level", "is_banned", "created_at", *required_columns(constraints)]))
+    graph = AssignmentGraph({r["giver_email"]: r["receiver_email"] for r in rows}, participants, constraints, seed)
+    return graph, participants, rows
+
+
+def _save(graph, run, result):
+    """Write the graph's pending changes to `run` and fill in `result`."""
+    from utils import db
+    result.changes = graph.changes()
+    if run.get("digest"):
+        result.digest = graph.digest(run["digest"])
+    year = (run.get("options") or {}).get("year")
+    if not db.apply_assignment_changes(result.changes, graph.removed, run["id"], result.digest, len(graph), year):
+        result.error = "Failed to save the updated assignments"
+        return result
+    graph.mark_saved()
+    return result
+
+
+def repair_active_run(remove=(), reassign=(), include_banned=True, include_disputed=True, constraints=None, seed=None):
+    """
+    Repair the active run in place instead of rematching everyone.
+
+    remove: emails to take out (withdrawals); banned participants are
+        added when include_banned
+    reassign: givers who need a new receiver; disputed givers are added
+        when include_disputed
+    Only the changed rows are written (and deleted for removed givers), and
+    the run's digest is updated to match. Notify `result.changes` afterwards.
+    """
+    from utils import db
+    result = RepairResult()
+    run = db.get_active_run()
+    if not run:
+        result.error = "No active run"
+        return result
+    graph, participants, rows = load_active_graph(constraints, seed)
+    banned = [p["email"] for p in participants if include_banned and p.get("is_banned")]
+    disputed = [r["giver_email"] for r in rows if include_disputed and r.get("is_disputed")]
+    remove = [e for e in dict.fromkeys([*remove, *banned]) if e in graph]
+    reassign = [g for g in dict.fromkeys([*reassign, *disputed]) if g not in remove]
+    try:
+        for email in remove:
+            graph.remove(email)
+            result.removed.append(email)
+        for email in reassign:
+            if graph.reassign(email):
+                result.reassigned.append(email)
+    except MatchingError as e:
+        result.error = str(e)
+        return result
+    return _save(graph, run, result)
+
+
+def add_late_joiners(emails=None, constraints=None, seed=None):
+    """
+    Insert participants who registered after the active run into it.
+
+    emails: who to add; defaults to everyone created after the run who is
+        not banned and not matched yet. The run is read once and each
+        joiner costs O(1); all of them are saved in one write of two rows
+        per joiner (the giver whose pair was split, and the joiner).
+    Notify `result.changes` afterwards: the joiners and their new Santas.
+    """
+    from utils import db
+    result = RepairResult()
+    run = db.get_active_run()
+    if not run:
+        result.error = "No active run"
+        return result
+    graph, participants, _ = load_active_graph(constraints, seed)
+    if emails is None:
+        joiners = [p for p in participants
+                   if p["email"] not in graph and not p.get("is_banned")
+                   and (p.get("created_at") or "") > run["created_at"]]
+    else:
+        wanted = set(emails)
+        joiners = [p for p in participants if p["email"] in wanted]
+    try:
+        result.added = graph.insert_many(sorted(joiners, key=lambda p: p["email"]))
+    except MatchingError as e:
+        result.error = str(e)
+        return result
+    return _save(graph, run, result)
@@ -0,0 +1,138 @@
+import datetime
+import hashlib
+import heapq
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class MagicLinkAuth:
+    """
+    Magic-link tokens with cheap re-verification, single use and request coalescing.
+
+    - Verified tokens are remembered in a bounded LRU keyed by their SHA-256
+      digest, so repeat checks skip jwt.decode and the HMAC until expiry.
+    - consume() records each token's jti in a replay table (pruned as tokens
+      expire), so a login link works once.
+    - issue() hands back the token already issued to an email within
+      `coalesce_window` seconds, so bursts of requests for one address sign
+      and send a single link.
+
+    State is per process; the JWT expiry still bounds everything.
+    """
+
+    def __init__(self, secret, algorithm="HS256", ttl_hours=24, cache_size=4096, coalesce_window=60):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.ttl = datetime.timedelta(hours=ttl_hours)
+        self.cache_size = cache_size
+        self.coalesce_window = coalesce_window
+        self._verified = OrderedDict()  # digest -> (email, exp, jti)
+        self._issued = OrderedDict()  # email -> (token, issued_at)
+        self._used = {}  # jti -> exp
+        self._used_expiry = []  # heap of (exp, jti) for pruning
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode() if isinstance(token, str) else token).digest()
+
+    def create_token(self, email):
+        """Sign a fresh token (prefer issue(), which coalesces repeats)."""
+        import jwt  # pulls in cryptography; loaded on the first login, not at app start
+        payload = {
+            "email": email,
+            "exp": datetime.datetime.now(datetime.timezone.utc) + self.ttl,
+            "jti": secrets.token_urlsafe(12),
+        }
+        return jwt.encode(payload, self.secret, algorithm=self.algorithm)
+
+    def issue(self, email):
+        """
+        Return (token, is_new). Within the coalescing window the previous
+        token is returned with is_new=False and no new email should be sent.
+        """
+        now = time.monotonic()
+        with self._lock:
+            recent = self._issued.get(email)
+            if recent and now - recent[1] < self.coalesce_window:
+                return recent[0], False
+        token = self.create_token(email)
+        with self._lock:
+            self._issued[email] = (token, now)
+            self._issued.move_to_end(email)
+            while len(self._issued) > self.cache_size:
+                self._issued.popitem(last=False)
+        return token, True
+
+    def forget(self, email):
+        """Drop the coalesced token for email (e.g. its email failed to send)."""
+        with self._lock:
+            self._issued.pop(email, None)
+
+    def _claims(self, token):
+        """(email, exp, jti) for a valid token, from the LRU when possible."""
+        if not token:
+            return None
+        digest = self._digest(token)
+        now = time.time()
+        with self._lock:
+            cached = self._verified.get(digest)
+            if cached:
+                if cached[1] > now:
+                    self._verified.move_to_end(digest)
+                    return cached
+                del self._verified[digest]
+        import jwt
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        except jwt.InvalidTokenError:  # includes ExpiredSignatureError
+            return None
+        claims = (payload["email"], payload["exp"], payload.get("jti"))
+        with self._lock:
+            self._verified[digest] = claims
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        return claims
+
+    def verify(self, token):
+        """Email for a valid token, else None. Doesn't use the token up."""
+        claims = self._claims(token)
+        return claims[0] if claims else None
+
+    def consume(self, token):
+        """Email for a valid, never-used token, else None. Marks it used."""
+        claims = self._claims(token)
+        if not claims:
+            return None
+        email, exp, jti = claims
+        # Tokens without a jti predate single-use links; fall back to the digest
+        key = jti or self._digest(token).hex()
+        with self._lock:
+            self._prune_used(time.time())
+            if key in self._used:
+                return None
+            self._used[key] = exp
+            heapq.heappush(self._used_expiry, (exp, key))
+            # A used link can't be handed out again by issue()
+            self._issued.pop(email, None)
+        return email
+
+    def _prune_used(self, now):
+        while self._used_expiry and self._used_expiry[0][0] <= now:
+            _, key = heapq.heappop(self._used_expiry)
+            self._used.pop(key, None)
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_auth(secret, algorithm="HS256"):
+    """Process-wide MagicLinkAuth for a secret (survives Streamlit reruns)."""
+    with _instances_lock:
+        auth = _instances.get((secret, algorithm))
+        if auth is None:
+            auth = _instances[(secret, algorithm)] = MagicLinkAuth(secret, algorithm)
+        return auth
@@ -0,0 +1,178 @@
+from array import array
+from urllib.parse import urlparse
+
+# Hosts many people share a profile on; they say nothing about who works together
+SHARED_HOSTS = frozenset({
+    "linkedin.com", "twitter.com", "x.com", "github.com", "medium.com",
+    "substack.com", "about.me", "linktr.ee",
+})
+
+
+def website_domain(url):
+    """Normalize a website_url to its bare domain ("https://www.Acme.com/x" -> "acme.com")."""
+    if not url:
+        return None
+    url = str(url).strip().lower()
+    if "://" not in url:
+        url = "http://" + url
+    host = urlparse(url).hostname or ""
+    if host.startswith("www."):
+        host = host[4:]
+    return host or None
+
+
+class CompiledConstraints:
+    """
+    Constraints compiled against a ParticipantIndex, checked in O(1) per edge.
+
+    forbidden: {giver_id: set(receiver_ids)} for sparse pairwise exclusions
+    groups: list of label arrays; two people with the same label >= 0 can't be paired
+    no_reciprocal: forbid A->B together with B->A
+    state: per-constraint data that Constraint.add() needs later
+    """
+    __slots__ = ("forbidden", "groups", "no_reciprocal", "state")
+
+    def __init__(self):
+        self.forbidden = {}
+        self.groups = []
+        self.no_reciprocal = False
+        self.state = {}
+
+    def forbid(self, giver, receiver):
+        if giver is None or receiver is None or giver == receiver:
+            return
+        bucket = self.forbidden.get(giver)
+        if bucket is None:
+            bucket = self.forbidden[giver] = set()
+        bucket.add(receiver)
+
+    def allows(self, giver, receiver):
+        """True if giver may give to receiver (never themselves)."""
+        if giver == receiver:
+            return False
+        bucket = self.forbidden.get(giver)
+        if bucket is not None and receiver in bucket:
+            return False
+        for labels in self.groups:
+            label = labels[giver]
+            if label >= 0 and label == labels[receiver]:
+                return False
+        return True
+
+
+class Constraint:
+    """Base class. `columns` lists the participant fields the constraint needs."""
+    columns = ()
+
+    def compile(self, index, compiled):
+        raise NotImplementedError
+
+    def add(self, index, compiled, pid):
+        """Extend `compiled` for participant `pid`, added to `index` after compile()."""
+
+
+class NoReciprocal(Constraint):
+    """Nobody gives to the person who gives to them (no A->B and B->A)."""
+
+    def compile(self, index, compiled):
+        compiled.no_reciprocal = True
+
+
+class ExcludePairs(Constraint):
+    """Explicit exclusions, e.g. partners or people who asked not to be paired."""
+
+    def __init__(self, pairs, symmetric=True):
+        self.pairs = list(pairs)
+        self.symmetric = symmetric
+        self._by_email = None  # email -> pairs, built on the first add()
+
+    def compile(self, index, compiled):
+        ids = index.ids
+        for a, b in self.pairs:
+            self._forbid(ids, compiled, a, b)
+
+    def add(self, index, compiled, pid):
+        if self._by_email is None:
+            self._by_email = {}
+            for a, b in self.pairs:
+                self._by_email.setdefault(a, []).append((a, b))
+                self._by_email.setdefault(b, []).append((a, b))
+        for a, b in self._by_email.get(index.emails[pid], ()):
+            self._forbid(index.ids, compiled, a, b)
+
+    def _forbid(self, ids, compiled, a, b):
+        ga, gb = ids.get(a), ids.get(b)
+        compiled.forbid(ga, gb)
+        if self.symmetric:
+            compiled.forbid(gb, ga)
+
+
+class NoRepeatPairs(ExcludePairs):
+    """Don't repeat a giver -> receiver pair from previous years."""
+
+    def __init__(self, history):
+        """history: (giver_email, receiver_email) tuples or assignment rows."""
+        pairs = []
+        for item in history:
+            if isinstance(item, dict):
+                item = (item.get("giver_email"), item.get("receiver_email"))
+            pairs.append(item)
+        super().__init__(pairs, symmetric=False)
+
+
+class SameGroupExclusion(Constraint):
+    """People sharing a group key (agency, company, ...) are never paired."""
+
+    def __init__(self, column, key=None, ignore=()):
+        self.column = column
+        self.columns = (column,)
+        self.key = key
+        self.ignore = frozenset(ignore)
+
+    def _label(self, value, interned):
+        if self.key is not None:
+            value = self.key(value)
+        if not value or value in self.ignore:
+            return -1
+        return interned.setdefault(value, len(interned))
+
+    def compile(self, index, compiled):
+        interned = {}
+        labels = array("l", (self._label(value, interned) for value in index.column(self.column)))
+        compiled.groups.append(labels)
+        compiled.state[self] = (labels, interned)
+
+    def add(self, index, compiled, pid):
+        labels, interned = compiled.state[self]
+        labels.append(self._label(index.column(self.column)[pid], interned))
+
+
+class SameDomainExclusion(SameGroupExclusion):
+    """Colleagues from the same agency (same website_url domain) are never paired."""
+
+    def __init__(self, ignore=SHARED_HOSTS):
+        super().__init__("website_url", key=website_domain, ignore=ignore)
+
+
+def compile_constraints(index, constraints):
+    """Compile a list of Constraint objects once for the whole run."""
+    compiled = CompiledConstraints()
+    for constraint in constraints or ():
+        constraint.compile(index, compiled)
+    return compiled
+
+
+def extend_constraints(index, compiled, constraints, pid):
+    """Update a compiled result for one participant added to `index` since, in O(1) per constraint."""
+    for constraint in constraints or ():
+        constraint.add(index, compiled, pid)
+
+
+def required_columns(constraints):
+    """Participant columns the constraints need, besides email and expertise_level."""
+    columns = []
+    for constraint in constraints or ():
+        for column in constraint.columns:
+            if column not in columns:
+                columns.append(column)
+    return columns
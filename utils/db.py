@@ -1,16 +1,25 @@
 import os
-import streamlit as st
-from supabase import create_client, Client
+import sys
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.cache import TTLCache
+from utils.metrics import gauge, incr, log_error, span
 
 # Initialize Supabase Client
-@st.cache_resource
 def get_supabase_client():
+    # SECRET_SANTA_DB_BACKEND=memory swaps in the in-memory stand-in (offline tests, load tests)
+    if os.getenv("SECRET_SANTA_DB_BACKEND", "supabase").lower() == "memory":
+        from utils.fake_db import get_fake_client
+        return get_fake_client()
+
     url = None
     key = None
     
-    # Try secrets (Streamlit Cloud)
+    # Try secrets (Streamlit Cloud); scripts that never loaded streamlit skip this
     try:
-        if hasattr(st, "secrets"):
+        st = sys.modules.get("streamlit")
+        if st is not None and hasattr(st, "secrets"):
             url = st.secrets.get("SUPABASE_URL")
             key = st.secrets.get("SUPABASE_SERVICE_ROLE_KEY")
     except Exception:
@@ -22,26 +31,70 @@ def get_supabase_client():
     
     if not url or not key:
         return None
-    return create_client(url, key)
+    from supabase import create_client  # heavy; only loaded once a DB call needs it
+    try:
+        return create_client(url, key)
+    except Exception as e:
+        log_error(f"Error creating Supabase client: {e}")
+        return None
+
+# The client is created on the first DB call, not at import, so pages that
+# never touch the DB don't pay for importing supabase. The module global
+# outlives Streamlit reruns, so it's one client per process. Tests may assign it.
+_UNSET = object()
+supabase = _UNSET
+
+def get_client():
+    """The Supabase client (or None if unconfigured), created on first use."""
+    global supabase
+    if supabase is _UNSET:
+        supabase = get_supabase_client()
+    return supabase
+
+# Retry backoff goes through this hook so tests can skip it without patching time.sleep
+_sleep = time.sleep
 
-supabase = get_supabase_client()
+# Shared read-through cache for reads that every Streamlit rerun repeats.
+# Writes below invalidate the namespaces they touch; the TTL bounds staleness
+# from writes made by other processes.
+cache = TTLCache(
+    maxsize=int(os.getenv("DB_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("DB_CACHE_TTL", "30")),
+)
 
+gauge("cache_hit_rate", lambda: cache.stats()["hit_rate"])
+gauge("cache_entries", lambda: cache.stats()["size"])
+
+def cache_stats():
+    """Hit/miss counters of the read cache."""
+    return cache.stats()
+
+def clear_cache():
+    cache.clear()
+
+def _first(rows):
+    return rows[0] if rows else None
+
+@span("db.load_user_profile")
 def load_user_profile(email):
-    """Load user profile from Supabase."""
+    """Load user profile from Supabase (cached)."""
+    supabase = get_client()
     if not supabase: return None
     try:
-        response = supabase.table("participants").select("*").eq("email", email).execute()
-        if response.data:
-            return response.data[0]
-        return None
+        return cache.get_or_load(
+            ("profile", email),
+            lambda: _first(supabase.table("participants").select("*").eq("email", email).execute().data)
+        )
     except Exception as e:
-        print(f"Error loading profile: {e}")
+        log_error(f"Error loading profile: {e}")
         return None
 
+@span("db.save_profile")
 def save_profile(email, data):
     """Upsert user profile."""
+    supabase = get_client()
     if not supabase:
-        print("Error: Supabase client not initialized")
+        log_error("Error: Supabase client not initialized")
         return False, "Database connection not available"
 
     try:
@@ -57,69 +110,530 @@ def save_profile(email, data):
             "wishlist": data["wishlist"]
         }
 
-        existing = load_user_profile(email)
-        if existing:
-            response = supabase.table("participants").update(payload).eq("email", email).execute()
-        else:
-            response = supabase.table("participants").insert(payload).execute()
+        # One round trip: insert or update on the unique email, returning the row
+        response = supabase.table("participants").upsert(payload, on_conflict="email").execute()
 
+        # The written row is the freshest profile we could read, so cache it directly
+        cache.invalidate("participants")
+        cache.invalidate("stats")
+        row = _first(response.data)
+        if row:
+            cache.set(("profile", email), row)
+        else:
+            cache.invalidate("profile", email)
         return True, "Profile saved successfully"
     except Exception as e:
         error_msg = str(e)
-        print(f"Error saving profile: {error_msg}")
+        log_error(f"Error saving profile: {error_msg}")
         return False, f"Failed to save profile: {error_msg}"
 
-def get_all_participants():
-    """Fetch all participants for matching."""
+def _iter_pages(table, key, columns=None, page_size=1000, strict=False, filters=()):
+    """Yield rows of `table` page by page, keyset-paginated on the unique `key` column.
+
+    Each request asks only for `columns` (plus the key) and only for rows
+    after the last key seen, so no page costs more than the one before it.
+    strict: raise on errors instead of printing and stopping early.
+    filters: (operator, column, value) tuples, e.g. ("lt", "year", 2025).
+    """
+    supabase = get_client()
+    if not supabase: return
+    if columns:
+        columns = list(columns)
+        if key not in columns:
+            columns.append(key)
+        select = ", ".join(columns)
+    else:
+        select = "*"
+
+    last = None
+    while True:
+        try:
+            with span(f"db.page.{table}") as page:
+                query = supabase.table(table).select(select).order(key).limit(page_size)
+                for op, column, value in filters:
+                    query = getattr(query, op)(column, value)
+                if last is not None:
+                    query = query.gt(key, last)
+                rows = query.execute().data or []
+                page.rows = len(rows)
+        except Exception as e:
+            if strict:
+                raise
+            log_error(f"Error fetching {table}: {e}")
+            return
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = rows[-1][key]
+
+def iter_participants(columns=None, page_size=1000, strict=False):
+    """Stream participants in email order. columns: fields to fetch (default all).
+    strict: raise on a DB error instead of logging it and stopping early."""
+    return _iter_pages("participants", "email", columns, page_size, strict=strict)
+
+def iter_assignments(columns=None, page_size=1000):
+    """Stream the active run's assignments in giver order. columns: fields to fetch (default all)."""
+    return _iter_pages("active_assignments", "giver_email", columns, page_size)
+
+def iter_named_assignments(columns=None, page_size=1000, strict=False):
+    """Stream the active run's assignments joined with giver and receiver names, in giver order.
+    strict: raise on a DB error instead of logging it and stopping early."""
+    return _iter_pages("active_assignments_named", "giver_email", columns, page_size, strict=strict)
+
+def iter_participants_by_email(emails, columns=None, chunk_size=100):
+    """Stream the participants with the given emails, `chunk_size` emails per request.
+    For a handful of people (e.g. the receivers a repair changed) instead of a full scan."""
+    supabase = get_client()
+    if not supabase: return
+    select = ", ".join(columns) if columns else "*"
+    emails = sorted(set(emails))
+    for i in range(0, len(emails), chunk_size):
+        try:
+            with span("db.page.participants_by_email") as page:
+                rows = supabase.table("participants").select(select) \
+                    .in_("email", emails[i:i + chunk_size]).execute().data or []
+                page.rows = len(rows)
+        except Exception as e:
+            log_error(f"Error fetching participants: {e}")
+            return
+        yield from rows
+
+@span("db.get_all_participants")
+def get_all_participants(columns=None):
+    """Fetch all participants (cached). columns: fields to fetch (default all).
+    Prefer iter_participants for one-off big reads."""
+    supabase = get_client()
     if not supabase: return []
+    columns = tuple(columns) if columns else None
     try:
-        response = supabase.table("participants").select("*").execute()
-        return response.data
+        return cache.get_or_load(
+            ("participants", "all", columns),
+            lambda: list(_iter_pages("participants", "email", columns, strict=True))
+        )
     except Exception as e:
-        print(f"Error fetching participants: {e}")
+        log_error(f"Error fetching participants: {e}")
         return []
 
-def save_assignments(assignments):
-    """Save generated assignments to DB.
-    assignments: list of dicts {'giver_email': x, 'receiver_email': y}
+PARTICIPANT_SORTS = ("name", "email", "expertise_level", "created_at")
+ASSIGNMENT_SORTS = ("giver_email", "receiver_email", "status", "created_at")
+
+def _search_filter(columns, term):
+    """PostgREST or= filter matching `term` case-insensitively in any of `columns`.
+    Characters that are syntax in the filter (or wildcards) are dropped from the term."""
+    term = "".join(c for c in term if c not in ',()*%"\\').strip()
+    if not term: return None
+    return ",".join(f"{column}.ilike.*{term}*" for column in columns)
+
+def _fetch_page(table, key, columns, page, page_size, sort, desc, search_columns, search, filters):
+    """One page of rows plus the total match count, in a single request."""
+    supabase = get_client()
+    if not supabase: return [], 0
+    select = ", ".join(columns) if columns else "*"
+    try:
+        query = supabase.table(table).select(select, count="exact")
+        for column, value in filters.items():
+            if value:
+                query = query.eq(column, value)
+        if search:
+            condition = _search_filter(search_columns, search)
+            if condition:
+                query = query.or_(condition)
+        query = query.order(sort, desc=desc)
+        if sort != key:
+            query = query.order(key)  # unique tiebreaker keeps page boundaries stable
+        start = max(0, page) * page_size
+        response = query.range(start, start + page_size - 1).execute()
+        return response.data or [], response.count or 0
+    except Exception as e:
+        log_error(f"Error fetching {table} page: {e}")
+        return [], 0
+
+@span("db.get_participants_page")
+def get_participants_page(page=0, page_size=50, sort="name", desc=False, search=None, tier=None, columns=None):
+    """One page of participants and the total number matching.
+
+    search: substring matched against name and email, server-side.
+    tier: exact expertise_level filter.
+    Returns (rows, total).
     """
-    if not supabase: return False
+    if sort not in PARTICIPANT_SORTS:
+        sort = "name"
+    return _fetch_page("participants", "email", columns, page, page_size, sort, desc,
+                       ("name", "email"), search, {"expertise_level": tier})
+
+@span("db.get_assignments_page")
+def get_assignments_page(page=0, page_size=50, sort="giver_email", desc=False, search=None, status=None, columns=None):
+    """One page of the active run's assignments and the total number matching.
+
+    search: substring matched against giver and receiver emails.
+    status: exact status filter.
+    Returns (rows, total).
+    """
+    if sort not in ASSIGNMENT_SORTS:
+        sort = "giver_email"
+    return _fetch_page("active_assignments", "giver_email", columns, page, page_size, sort, desc,
+                       ("giver_email", "receiver_email"), search, {"status": status})
+
+class SaveResult:
+    """Outcome of save_assignments. Truthy only if every row was written (and the run activated)."""
+    __slots__ = ("run_id", "written", "total", "failed_chunks", "activated", "error")
+
+    def __init__(self, run_id, total):
+        self.run_id = run_id
+        self.total = total
+        self.written = 0
+        self.failed_chunks = []
+        self.activated = False
+        self.error = None
+
+    @property
+    def complete(self):
+        return self.written == self.total and not self.failed_chunks
+
+    def __bool__(self):
+        return self.complete and self.error is None
+
+    def __repr__(self):
+        return (f"SaveResult(run_id={self.run_id!r}, written={self.written}/{self.total}, "
+                f"failed_chunks={self.failed_chunks}, activated={self.activated})")
+
+def _upsert_chunk(rows, retries):
+    """Upsert one chunk keyed on (run_id, giver_email); safe to retry."""
+    supabase = get_client()
+    for attempt in range(retries + 1):
+        try:
+            with span("db.upsert_chunk", rows=len(rows)):
+                supabase.table("assignments").upsert(rows, on_conflict="run_id,giver_email").execute()
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            incr("db_retries", op="upsert_chunk")
+            _sleep(0.5 * 2 ** attempt)
+
+@span("db.save_assignments")
+def save_assignments(assignments, run_id=None, year=None, chunk_size=500, max_workers=4, retries=2, activate=True):
+    """Save generated assignments to DB as one run.
+    assignments: dict {giver_email: receiver_email}
+    run_id: match_runs id to write into. A new run is created if omitted;
+        pass the same id again to retry a partial save (rows are upserted on
+        (run_id, giver_email), so re-sending a chunk is harmless).
+    year: event year, used as history by later runs (defaults to this year)
+    chunk_size / max_workers: rows per request and concurrent requests
+    activate: once every row is written, make this the active run. The
+        switch is a single transaction, so readers of active_assignments
+        see either the old run or the new one, never a mix.
+    Returns: SaveResult
+    """
+    if run_id is None:
+        run = save_match_run(None, None, len(assignments))
+        run_id = run["id"] if run else None
+    result = SaveResult(run_id, len(assignments))
+    supabase = get_client()
+    if not supabase or run_id is None:
+        result.error = "Database connection not available"
+        return result
+    if year is None:
+        year = datetime.date.today().year
+
+    rows = [
+        {
+            "run_id": run_id,
+            "giver_email": giver,
+            "receiver_email": receiver,
+            "year": year,
+            "status": "pending"
+        }
+        for giver, receiver in assignments.items()
+    ]
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks) or 1))) as pool:
+        futures = {pool.submit(_upsert_chunk, chunk, retries): i for i, chunk in enumerate(chunks)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                future.result()
+                result.written += len(chunks[i])
+            except Exception as e:
+                log_error(f"Error saving assignments chunk {i}: {e}")
+                result.failed_chunks.append(i)
+                result.error = str(e)
+
+    if result.complete and activate:
+        try:
+            supabase.rpc("activate_match_run", {"p_run_id": run_id}).execute()
+            result.activated = True
+        except Exception as e:
+            log_error(f"Error activating run {run_id}: {e}")
+            result.error = str(e)
+    cache.invalidate("assignments")
+    cache.invalidate("match_runs")
+    cache.invalidate("stats")
+    return result
+
+@span("db.get_all_assignments")
+def get_all_assignments():
+    """Fetch all assignments of the active run (cached). Prefer iter_assignments for big reads."""
+    supabase = get_client()
+    if not supabase: return []
+    try:
+        return cache.get_or_load(
+            ("assignments", "all"),
+            lambda: list(_iter_pages("active_assignments", "giver_email", strict=True))
+        )
+    except Exception as e:
+        log_error(f"Error fetching assignments: {e}")
+        return []
+
+@span("db.save_match_run")
+def save_match_run(seed, digest, size, options=None):
+    """Record the seed and digest of a matching run. Returns the run row (with its id) or None."""
+    supabase = get_client()
+    if not supabase: return None
+    try:
+        response = supabase.table("match_runs").insert({
+            "seed": seed,
+            "digest": digest,
+            "size": size,
+            "options": options or {}
+        }).execute()
+        cache.invalidate("match_runs")
+        return response.data[0] if response.data else None
+    except Exception as e:
+        log_error(f"Error saving match run: {e}")
+        return None
+
+@span("db.get_match_runs")
+def get_match_runs(limit=20):
+    """Fetch the most recent matching runs (cached)."""
+    supabase = get_client()
+    if not supabase: return []
     try:
-        # We don't delete immediately to be safe, but typically we'd clear old ones for a new run
+        return cache.get_or_load(
+            ("match_runs", limit),
+            lambda: supabase.table("match_runs").select("*").order("created_at", desc=True).limit(limit).execute().data
+        )
+    except Exception as e:
+        log_error(f"Error fetching match runs: {e}")
+        return []
 
-        data = []
-        for giver, receiver in assignments.items():
-            data.append({
-                "giver_email": giver,
-                "receiver_email": receiver,
-                "status": "pending"
-            })
+@span("db.get_active_run")
+def get_active_run():
+    """The active match run row (cached), or None."""
+    supabase = get_client()
+    if not supabase: return None
+    try:
+        return cache.get_or_load(
+            ("match_runs", "active"),
+            lambda: _first(supabase.table("match_runs").select("*").eq("is_active", True).execute().data)
+        )
+    except Exception as e:
+        log_error(f"Error fetching active run: {e}")
+        return None
 
-        if data:
-            supabase.table("assignments").insert(data).execute()
+@span("db.update_assignment_status")
+def update_assignment_status(giver_emails, status, run_id=None, chunk_size=100):
+    """Set the status of many givers' assignments in a few bulk updates.
+    run_id: defaults to the active run.
+    """
+    supabase = get_client()
+    if not supabase: return False
+    if run_id is None:
+        run = get_active_run()
+        if not run: return False
+        run_id = run["id"]
+    giver_emails = list(giver_emails)
+    try:
+        for i in range(0, len(giver_emails), chunk_size):
+            supabase.table("assignments").update({"status": status}) \
+                .eq("run_id", run_id).in_("giver_email", giver_emails[i:i + chunk_size]).execute()
         return True
     except Exception as e:
-        print(f"Error saving assignments: {e}")
+        log_error(f"Error updating assignment status: {e}")
         return False
+    finally:
+        cache.invalidate("assignments")
+        cache.invalidate("stats")
 
-def get_all_assignments():
-    """Fetch all assignments from DB."""
+@span("db.apply_assignment_changes")
+def apply_assignment_changes(changes, removed=(), run_id=None, digest=None, size=None, year=None, retries=2):
+    """Write a local repair of a run: only the changed and removed givers' rows.
+    changes: {giver_email: new receiver_email}; those rows go back to pending
+    removed: givers whose rows are deleted
+    digest / size: the run's new assignment digest and size, if known
+    run_id: defaults to the active run. year: as in save_assignments.
+    All of it is one call to the apply_assignment_changes() SQL function,
+    a single transaction: the run is either fully repaired or unchanged.
+    It is idempotent, so failed attempts are retried.
+    Returns True if everything was written.
+    """
+    supabase = get_client()
+    if not supabase: return False
+    if run_id is None:
+        run = get_active_run()
+        if not run: return False
+        run_id = run["id"]
+    if year is None:
+        year = datetime.date.today().year
+    params = {
+        "p_run_id": run_id,
+        "p_changes": [{"giver_email": g, "receiver_email": r} for g, r in changes.items()],
+        "p_removed": list(removed),
+        "p_year": year,
+        "p_digest": digest,
+        "p_size": size,
+    }
+    try:
+        for attempt in range(retries + 1):
+            try:
+                supabase.rpc("apply_assignment_changes", params).execute()
+                return True
+            except Exception:
+                if attempt == retries:
+                    raise
+                incr("db_retries", op="apply_assignment_changes")
+                _sleep(0.5 * 2 ** attempt)
+    except Exception as e:
+        log_error(f"Error saving assignment changes: {e}")
+        return False
+    finally:
+        cache.invalidate("assignments")
+        cache.invalidate("match_runs")
+        cache.invalidate("stats")
+
+@span("db.get_assignment_history")
+def get_assignment_history(before_year=None):
+    """Fetch past giver/receiver pairs (optionally only years < before_year).
+
+    Reads the assignment_history view: only the run that was final for
+    each year, never drafts that didn't go live or runs replaced later.
+    Streamed in keyset-paginated pages, so the server's max-rows limit
+    can't silently cut the history short. Raises on a DB error instead of
+    returning part of it: matching against partial history would quietly
+    allow repeat pairs.
+    """
+    filters = [("lt", "year", before_year)] if before_year is not None else []
+    try:
+        return list(_iter_pages("assignment_history", "id", ["giver_email", "receiver_email", "year"],
+                                strict=True, filters=filters))
+    except Exception as e:
+        log_error(f"Error fetching assignment history: {e}")
+        raise
+
+@span("db.get_assignment_for_user")
+def get_assignment_for_user(email):
+    """Get the assignment for a specific user (who they should give to). Cached."""
+    supabase = get_client()
+    if not supabase: return None
+    try:
+        return cache.get_or_load(
+            ("assignments", "giver", email),
+            lambda: _first(supabase.table("active_assignments").select("*").eq("giver_email", email).execute().data)
+        )
+    except Exception as e:
+        log_error(f"Error fetching assignment: {e}")
+        return None
+
+EMPTY_STATS = {"total": 0, "verified": 0, "banned": 0, "tiers": {}, "assignments": 0, "assignment_status": {}}
+
+@span("db.get_admin_stats")
+def get_admin_stats():
+    """Dashboard counts in one small response (cached).
+
+    Computed server-side by the admin_stats() SQL function: participant
+    totals, verified/banned counts, counts per expertise level and the
+    status breakdown of the active run. Returns None if unavailable.
+    """
+    supabase = get_client()
+    if not supabase: return None
+    try:
+        return cache.get_or_load(
+            ("stats", "admin"),
+            lambda: {**EMPTY_STATS, **(supabase.rpc("admin_stats", {}).execute().data or {})}
+        )
+    except Exception as e:
+        log_error(f"Error fetching admin stats: {e}")
+        return None
+
+@span("db.get_sponsors")
+def get_sponsors():
+    """Fetch all sponsors (cached)."""
+    supabase = get_client()
     if not supabase: return []
     try:
-        response = supabase.table("assignments").select("*").execute()
-        return response.data
+        return cache.get_or_load(
+            ("sponsors", "all"),
+            lambda: supabase.table("sponsors").select("*").order("name").execute().data
+        )
     except Exception as e:
-        print(f"Error fetching assignments: {e}")
+        log_error(f"Error fetching sponsors: {e}")
         return []
 
-def get_assignment_for_user(email):
-    """Get the assignment for a specific user (who they should give to)."""
+@span("db.add_sponsor")
+def add_sponsor(name, tier=None, logo_url=None):
+    """Create a sponsor. Returns the row (with its id) or None."""
+    supabase = get_client()
     if not supabase: return None
     try:
-        response = supabase.table("assignments").select("*").eq("giver_email", email).execute()
-        if response.data:
-            return response.data[0]
+        response = supabase.table("sponsors").insert({"name": name, "tier": tier, "logo_url": logo_url}).execute()
+        cache.invalidate("sponsors")
+        return response.data[0] if response.data else None
+    except Exception as e:
+        log_error(f"Error saving sponsor: {e}")
         return None
+
+@span("db.add_sponsor_gifts")
+def add_sponsor_gifts(sponsor_id, name, codes, value_usd=None, chunk_size=500):
+    """Add one gift per code (None for gifts without a code) in bulk inserts. Returns how many were added."""
+    supabase = get_client()
+    if not supabase: return 0
+    rows = [{"sponsor_id": sponsor_id, "name": name, "code": code, "value_usd": value_usd} for code in codes]
+    added = 0
+    try:
+        for i in range(0, len(rows), chunk_size):
+            supabase.table("sponsor_gifts").insert(rows[i:i + chunk_size]).execute()
+            added += len(rows[i:i + chunk_size])
+    except Exception as e:
+        log_error(f"Error saving sponsor gifts: {e}")
+    finally:
+        cache.invalidate("sponsors")
+    return added
+
+def iter_sponsor_gifts(columns=None, page_size=1000):
+    """Stream sponsor gifts in id order, uncached. columns: fields to fetch (default all)."""
+    return _iter_pages("sponsor_gifts", "id", columns, page_size)
+
+@span("db.get_sponsor_gifts")
+def get_sponsor_gifts():
+    """Fetch all sponsor gifts (cached). Prefer iter_sponsor_gifts for reads that must be fresh."""
+    supabase = get_client()
+    if not supabase: return []
+    try:
+        return cache.get_or_load(
+            ("sponsors", "gifts"),
+            lambda: list(_iter_pages("sponsor_gifts", "id", strict=True))
+        )
+    except Exception as e:
+        log_error(f"Error fetching sponsor gifts: {e}")
+        return []
+
+@span("db.assign_sponsor_gifts")
+def assign_sponsor_gifts(pairs):
+    """Write [(gift_id, winner_id)] in one request. Returns how many gifts were assigned, or None on error.
+
+    The assign_sponsor_gifts() SQL function only fills gifts that are still
+    unassigned and unclaimed and skips winners who already hold a gift, so
+    a re-run or a concurrent run never overwrites a winner.
+    """
+    supabase = get_client()
+    if not supabase: return None
+    payload = [{"gift_id": gift_id, "winner_id": winner_id} for gift_id, winner_id in pairs]
+    if not payload: return 0
+    try:
+        return len(supabase.rpc("assign_sponsor_gifts", {"p_assignments": payload}).execute().data or [])
     except Exception as e:
-        print(f"Error fetching assignment: {e}")
+        log_error(f"Error assigning sponsor gifts: {e}")
         return None
+    finally:
+        cache.invalidate("sponsors")
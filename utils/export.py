@@ -0,0 +1,140 @@
+import csv
+import io
+import json
+
+PARTICIPANT_COLUMNS = [
+    "email", "name", "expertise_level", "linkedin_url", "website_url", "bio",
+    "address", "pledge", "wishlist", "is_verified", "is_banned", "created_at",
+]
+ASSIGNMENT_COLUMNS = [
+    "giver_email", "giver_name", "receiver_email", "receiver_name",
+    "status", "year", "sent_at", "gift_url",
+]
+# Non-string columns; everything else is written as text (JSON for jsonb values)
+COLUMN_TYPES = {"is_verified": "bool", "is_banned": "bool", "year": "int"}
+
+EXPORTS = {
+    "participants": PARTICIPANT_COLUMNS,
+    "assignments": ASSIGNMENT_COLUMNS,
+}
+FORMATS = ("csv", "parquet")
+
+
+def _text(value):
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def iter_rows(kind, page_size=1000):
+    """
+    Stream export rows from paginated DB reads (only the exported columns are fetched).
+
+    Reads are strict: a DB error raises instead of ending the stream, so a
+    failed read can never pass for a complete (shorter) export.
+    """
+    from utils import db
+    columns = EXPORTS[kind]
+    if kind == "participants":
+        return db.iter_participants(columns=columns, page_size=page_size, strict=True)
+    return db.iter_named_assignments(columns=columns, page_size=page_size, strict=True)
+
+
+def iter_csv_chunks(rows, columns, chunk_rows=1000):
+    """
+    Yield CSV text in chunks of up to `chunk_rows` rows, header first.
+
+    Only one chunk is buffered at a time, so memory doesn't grow with
+    the number of rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow([_text(row.get(c)) for c in columns])  # None is written as ""
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending or buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_csv(rows, columns, out, chunk_rows=1000):
+    """Write rows as CSV to a text file object. Returns the number of rows written."""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    for chunk in iter_csv_chunks(counted(), columns, chunk_rows):
+        out.write(chunk)
+    return count
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    types = {"bool": pa.bool_(), "int": pa.int64()}
+    return pa.schema([(c, types.get(COLUMN_TYPES.get(c), pa.string())) for c in columns])
+
+
+def write_parquet(rows, columns, out, batch_rows=10000):
+    """
+    Write rows as Parquet (path or binary file object) one record batch at a time.
+
+    Each batch of `batch_rows` rows becomes a row group and is released
+    before the next is read. Returns the number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(columns)
+    converters = [
+        (c, (lambda v: v) if COLUMN_TYPES.get(c) else _text)
+        for c in columns
+    ]
+    count = 0
+    with pq.ParquetWriter(out, schema) as writer:
+        batch = {c: [] for c in columns}
+        size = 0
+        for row in rows:
+            for c, convert in converters:
+                batch[c].append(convert(row.get(c)))
+            size += 1
+            if size == batch_rows:
+                writer.write_batch(pa.record_batch(list(batch.values()), schema=schema))
+                count += size
+                batch = {c: [] for c in columns}
+                size = 0
+        if size or not count:
+            writer.write_batch(pa.record_batch(list(batch.values()), schema=schema))
+            count += size
+    return count
+
+
+def export(kind, fmt, out, rows=None, page_size=1000):
+    """
+    Export `kind` ("participants" or "assignments") as `fmt` ("csv" or "parquet").
+
+    out: a text file object for CSV, a path or binary file object for Parquet.
+    rows: iterable of rows to export instead of reading the database.
+    Returns the number of rows written.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f"Unknown export '{kind}' (expected one of {', '.join(EXPORTS)})")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}' (expected one of {', '.join(FORMATS)})")
+    if rows is None:
+        rows = iter_rows(kind, page_size)
+    columns = EXPORTS[kind]
+    if fmt == "csv":
+        return write_csv(rows, columns, out)
+    return write_parquet(rows, columns, out)
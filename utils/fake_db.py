@@ -0,0 +1,546 @@
+import datetime
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+
+
+class FakeDBError(Exception):
+    """Raised for injected failures and constraint violations (like postgrest's APIError)."""
+
+
+class FakeResponse:
+    __slots__ = ("data", "count")
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+# Column defaults and unique keys mirroring schema.sql
+TABLES = {
+    "participants": {
+        "unique": [("email",)],
+        "indexes": ["email"],
+        "defaults": {"wishlist": list, "is_verified": False, "is_banned": False, "is_admin": False},
+    },
+    "sponsors": {"unique": [], "indexes": [], "defaults": {}},
+    "sponsor_gifts": {
+        "unique": [],
+        "indexes": ["winner_id"],
+        "defaults": {"winner_id": None, "is_claimed": False},
+    },
+    "match_runs": {
+        "unique": [],
+        "indexes": ["is_active"],
+        "defaults": {"status": "writing", "is_active": False, "activated_at": None, "options": dict},
+    },
+    "assignments": {
+        "unique": [("run_id", "giver_email")],
+        "indexes": ["run_id", "giver_email"],
+        "defaults": {"status": "pending", "year": 2024, "is_disputed": False},
+    },
+    "disputes": {"unique": [], "indexes": [], "defaults": {"status": "pending"}},
+}
+
+
+class Table:
+    """Rows by internal id, plus unique keys and hash indexes kept up to date on every write."""
+
+    def __init__(self, name, unique=(), indexes=(), defaults=None):
+        self.name = name
+        self.rows = {}  # rid -> row, in insertion order
+        self.unique = {key: {} for key in unique}  # column tuple -> {values: rid}
+        self.indexes = {column: {} for column in indexes}  # column -> {value: set(rid)}
+        self.defaults = defaults or {}
+        self._next = 0
+
+    def _index(self, rid, row, add):
+        for key, entries in self.unique.items():
+            value = tuple(row.get(c) for c in key)
+            if add:
+                entries[value] = rid
+            elif entries.get(value) == rid:
+                del entries[value]
+        for column, entries in self.indexes.items():
+            value = row.get(column)
+            if add:
+                entries.setdefault(value, set()).add(rid)
+            else:
+                bucket = entries.get(value)
+                if bucket:
+                    bucket.discard(rid)
+                    if not bucket:
+                        del entries[value]
+
+    def find_unique(self, key, row):
+        return self.unique[key].get(tuple(row.get(c) for c in key))
+
+    def insert(self, values):
+        row = {"id": str(uuid.uuid4()), "created_at": _now()}
+        for column, default in self.defaults.items():
+            row[column] = default() if callable(default) else default
+        row.update(values)
+        for key in self.unique:
+            if self.find_unique(key, row) is not None:
+                raise FakeDBError(f'duplicate key value violates unique constraint on {self.name} ({", ".join(key)})')
+        rid = self._next
+        self._next += 1
+        self.rows[rid] = row
+        self._index(rid, row, True)
+        return row
+
+    def update(self, rid, values):
+        row = self.rows[rid]
+        self._index(rid, row, False)
+        row.update(values)
+        self._index(rid, row, True)
+        return row
+
+    def delete(self, rid):
+        self._index(rid, self.rows[rid], False)
+        return self.rows.pop(rid)
+
+    def candidates(self, eqs):
+        """Row ids that can match the eq filters, narrowed by an index when one applies."""
+        for column, value in eqs:
+            if column in self.indexes:
+                return list(self.indexes[column].get(value, ()))
+        return list(self.rows)
+
+
+# --- Filters ---
+
+def _like(pattern, value, flags=0):
+    if value is None:
+        return False
+    regex = "".join(".*" if c in "*%" else "." if c == "_" else re.escape(c) for c in pattern)
+    return re.fullmatch(regex, str(value), flags | re.DOTALL) is not None
+
+
+def _compare(op, value, operand):
+    if op == "eq":
+        return value == operand
+    if op == "neq":
+        return value is not None and value != operand
+    if op == "in":
+        return value in operand
+    if op == "is":
+        return value is operand
+    if op == "like":
+        return _like(operand, value)
+    if op == "ilike":
+        return _like(operand, value, re.IGNORECASE)
+    if value is None or operand is None:
+        return False  # SQL comparisons with NULL are never true
+    if isinstance(value, bool) or isinstance(operand, bool):
+        value, operand = str(value).lower(), str(operand).lower()
+    elif isinstance(value, (int, float)) and isinstance(operand, str):
+        operand = type(value)(operand)
+    if op == "gt":
+        return value > operand
+    if op == "gte":
+        return value >= operand
+    if op == "lt":
+        return value < operand
+    if op == "lte":
+        return value <= operand
+    raise FakeDBError(f"Unsupported filter operator '{op}'")
+
+
+def _parse_or(condition):
+    """'name.ilike.*x*,email.eq.y' -> [("name", "ilike", "*x*"), ("email", "eq", "y")]"""
+    parts = []
+    for clause in condition.split(","):
+        column, op, value = clause.strip().split(".", 2)
+        parts.append((column, op, value))
+    return parts
+
+
+def _sort_key(column):
+    # NULLs sort last ascending (and first descending), like Postgres
+    return lambda row: (row.get(column) is None, row.get(column) if row.get(column) is not None else 0)
+
+
+class Query:
+    """The chainable postgrest request builder surface used by utils.db."""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.action = "select"
+        self.columns = None
+        self.count = None
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []  # (column, op, operand) ANDed
+        self.or_filters = []  # lists of (column, op, operand), each ORed
+        self.orders = []
+        self.start = 0
+        self.stop = None
+
+    # Actions
+
+    def select(self, *columns, count=None):
+        self.action = "select"
+        names = [c.strip() for spec in columns for c in spec.split(",") if c.strip()]
+        self.columns = None if not names or "*" in names else names
+        self.count = count
+        return self
+
+    def insert(self, rows):
+        self.action, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self.action, self.payload = "upsert", rows
+        self.on_conflict = tuple(c.strip() for c in on_conflict.split(",")) if on_conflict else None
+        return self
+
+    def update(self, values):
+        self.action, self.payload = "update", values
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    # Filters and modifiers
+
+    def _filter(self, column, op, operand):
+        self.filters.append((column, op, operand))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def neq(self, column, value):
+        return self._filter(column, "neq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def in_(self, column, values):
+        return self._filter(column, "in", set(values))
+
+    def is_(self, column, value):
+        return self._filter(column, "is", None if value in (None, "null") else value)
+
+    def like(self, column, pattern):
+        return self._filter(column, "like", pattern)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, "ilike", pattern)
+
+    def or_(self, condition):
+        self.or_filters.append(_parse_or(condition))
+        return self
+
+    def order(self, column, desc=False, **_):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n):
+        self.stop = self.start + n
+        return self
+
+    def range(self, start, end):
+        self.start, self.stop = start, end + 1
+        return self
+
+    def execute(self):
+        return self.client._execute(self)
+
+    # Evaluation (called with the client lock held)
+
+    def matches(self, row):
+        return (
+            all(_compare(op, row.get(c), v) for c, op, v in self.filters)
+            and all(any(_compare(op, row.get(c), v) for c, op, v in group) for group in self.or_filters)
+        )
+
+    def eqs(self):
+        return [(c, v) for c, op, v in self.filters if op == "eq"]
+
+
+class RpcCall:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params or {}
+
+    def execute(self):
+        return self.client._call(self.name, self.params)
+
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the supabase client, for offline tests and load tests.
+
+    Implements the table()/rpc() calls utils.db makes, over indexed
+    in-memory tables shaped like schema.sql, including the
+    active_assignments views and the SQL functions. Every execute() can
+    wait `latency` seconds (plus up to `jitter`) and fail with probability
+    `failure_rate`, and is counted in `requests`.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.tables = {name: Table(name, **spec) for name, spec in TABLES.items()}
+        self.views = {
+            "active_assignments": self._active_assignments,
+            "active_assignments_named": self._active_assignments_named,
+            "assignment_history": self._assignment_history,
+        }
+        self.functions = {
+            "activate_match_run": self._activate_match_run,
+            "apply_assignment_changes": self._apply_assignment_changes,
+            "admin_stats": self._admin_stats,
+            "assign_sponsor_gifts": self._assign_sponsor_gifts,
+        }
+        self.requests = Counter()  # (table or rpc name, action) -> count
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+
+    # Client surface
+
+    def table(self, name):
+        if name not in self.tables and name not in self.views:
+            raise FakeDBError(f'relation "public.{name}" does not exist')
+        return Query(self, name)
+
+    def rpc(self, name, params=None):
+        return RpcCall(self, name, params)
+
+    def register_function(self, name, func):
+        """Add an rpc implementation: func(client, params) -> data."""
+        self.functions[name] = lambda params: func(self, params)
+
+    # Request handling
+
+    def _round_trip(self, key):
+        with self._lock:
+            self.requests[key] += 1
+            fail = self.failure_rate and self._rng.random() < self.failure_rate
+            delay = self.latency + (self._rng.random() * self.jitter if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise FakeDBError(f"Injected failure ({key[0]} {key[1]})")
+
+    def _execute(self, query):
+        self._round_trip((query.table, query.action))
+        with self._lock:
+            if query.table in self.views:
+                if query.action != "select":
+                    raise FakeDBError(f'cannot {query.action} view "{query.table}"')
+                return self._select(query, self.views[query.table]())
+            table = self.tables[query.table]
+            if query.action == "select":
+                rows = (table.rows[rid] for rid in table.candidates(query.eqs()))
+                return self._select(query, rows)
+            if query.action == "insert":
+                payload = query.payload if isinstance(query.payload, list) else [query.payload]
+                return FakeResponse([dict(table.insert(values)) for values in payload])
+            if query.action == "upsert":
+                return FakeResponse(self._upsert(table, query))
+            targets = [rid for rid in table.candidates(query.eqs()) if query.matches(table.rows[rid])]
+            if query.action == "update":
+                return FakeResponse([dict(table.update(rid, query.payload)) for rid in targets])
+            return FakeResponse([table.delete(rid) for rid in targets])
+
+    def _select(self, query, rows):
+        rows = [row for row in rows if query.matches(row)]
+        total = len(rows) if query.count else None
+        for column, desc in reversed(query.orders):  # stable sorts, last key first
+            rows.sort(key=_sort_key(column), reverse=desc)
+        rows = rows[query.start:query.stop]
+        if query.columns:
+            rows = [{c: row.get(c) for c in query.columns} for row in rows]
+        else:
+            rows = [dict(row) for row in rows]
+        return FakeResponse(rows, total)
+
+    def _upsert(self, table, query):
+        payload = query.payload if isinstance(query.payload, list) else [query.payload]
+        key = query.on_conflict or ("id",)
+        if key != ("id",) and key not in table.unique:
+            raise FakeDBError(f"there is no unique constraint matching the ON CONFLICT specification ({', '.join(key)})")
+        written = []
+        for values in payload:
+            if key == ("id",):
+                rid = next((r for r, row in table.rows.items() if row["id"] == values.get("id")), None)
+            else:
+                rid = table.find_unique(key, values)
+            written.append(dict(table.insert(values) if rid is None else table.update(rid, values)))
+        return written
+
+    def _call(self, name, params):
+        self._round_trip((name, "rpc"))
+        func = self.functions.get(name)
+        if func is None:
+            raise FakeDBError(f"Could not find the function public.{name}")
+        with self._lock:
+            return FakeResponse(func(params))
+
+    # Views and SQL functions (mirroring schema.sql)
+
+    def _active_run_ids(self):
+        runs = self.tables["match_runs"]
+        return [runs.rows[rid]["id"] for rid in runs.indexes["is_active"].get(True, ())]
+
+    def _active_assignments(self):
+        assignments = self.tables["assignments"]
+        return [
+            assignments.rows[rid]
+            for run_id in self._active_run_ids()
+            for rid in assignments.indexes["run_id"].get(run_id, ())
+        ]
+
+    def _active_assignments_named(self):
+        participants = self.tables["participants"]
+
+        def name(email):
+            rid = participants.unique[("email",)].get((email,))
+            return participants.rows[rid]["name"] if rid is not None else None
+
+        return [
+            {
+                "giver_email": a["giver_email"], "giver_name": name(a["giver_email"]),
+                "receiver_email": a["receiver_email"], "receiver_name": name(a["receiver_email"]),
+                "status": a.get("status"), "year": a.get("year"),
+                "sent_at": a.get("sent_at"), "gift_url": a.get("gift_url"),
+            }
+            for a in self._active_assignments()
+        ]
+
+    def _final_runs(self):
+        """{year: run id} of the run that went live last for each year."""
+        runs = {row["id"]: row for row in self.tables["match_runs"].rows.values()
+                if row["status"] in ("active", "retired")}
+        final = {}
+        for row in self.tables["assignments"].rows.values():
+            run = runs.get(row.get("run_id"))
+            if run is None:
+                continue
+            best = final.get(row.get("year"))
+            rank = (run["activated_at"] or "", run["created_at"])
+            if best is None or rank > best[0]:
+                final[row.get("year")] = (rank, run["id"])
+        return {year: run_id for year, (_, run_id) in final.items()}
+
+    def _assignment_history(self):
+        final = self._final_runs()
+        return [
+            {"id": a["id"], "giver_email": a["giver_email"], "receiver_email": a["receiver_email"], "year": a["year"]}
+            for a in self.tables["assignments"].rows.values()
+            if final.get(a.get("year")) == a.get("run_id")
+        ]
+
+    def _activate_match_run(self, params):
+        runs = self.tables["match_runs"]
+        run_id = params["p_run_id"]
+        for rid, row in list(runs.rows.items()):
+            if row["is_active"] and row["id"] != run_id:
+                runs.update(rid, {"is_active": False, "status": "retired"})
+            elif row["id"] == run_id:
+                runs.update(rid, {"is_active": True, "status": "active", "activated_at": _now()})
+        return None
+
+    def _apply_assignment_changes(self, params):
+        assignments = self.tables["assignments"]
+        runs = self.tables["match_runs"]
+        run_id = params["p_run_id"]
+        for change in params["p_changes"]:
+            values = {"run_id": run_id, "giver_email": change["giver_email"],
+                      "receiver_email": change["receiver_email"], "year": params["p_year"],
+                      "status": "pending", "sent_at": None, "is_disputed": False}
+            rid = assignments.find_unique(("run_id", "giver_email"), values)
+            if rid is None:
+                assignments.insert(values)
+            else:
+                assignments.update(rid, values)
+        removed = set(params["p_removed"])
+        for rid in list(assignments.indexes["run_id"].get(run_id, ())):
+            if assignments.rows[rid]["giver_email"] in removed:
+                assignments.delete(rid)
+        if params["p_digest"] is not None:
+            for rid, row in list(runs.rows.items()):
+                if row["id"] == run_id:
+                    runs.update(rid, {"digest": params["p_digest"], "size": params["p_size"]})
+        return None
+
+    def _admin_stats(self, params):
+        participants = list(self.tables["participants"].rows.values())
+        active = self._active_assignments()
+        return {
+            "total": len(participants),
+            "verified": sum(1 for p in participants if p.get("is_verified")),
+            "banned": sum(1 for p in participants if p.get("is_banned")),
+            "tiers": dict(Counter(p.get("expertise_level") or "Unknown" for p in participants)),
+            "assignments": len(active),
+            "assignment_status": dict(Counter(a.get("status") or "pending" for a in active)),
+        }
+
+    def _assign_sponsor_gifts(self, params):
+        gifts = self.tables["sponsor_gifts"]
+        by_id = {row["id"]: rid for rid, row in gifts.rows.items()}
+        holders = gifts.indexes["winner_id"]
+        assigned = []
+        for item in params["p_assignments"]:
+            rid = by_id.get(item["gift_id"])
+            winner = item["winner_id"]
+            if rid is None or winner is None or holders.get(winner):
+                continue
+            row = gifts.rows[rid]
+            if row.get("winner_id") is None and not row.get("is_claimed"):
+                gifts.update(rid, {"winner_id": winner})
+                assigned.append(row["id"])
+        return assigned
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_fake_client():
+    """
+    Process-wide FakeSupabase configured from the environment:
+    FAKE_DB_LATENCY_MS, FAKE_DB_JITTER_MS, FAKE_DB_FAILURE_RATE, FAKE_DB_SEED,
+    and FAKE_DB_PARTICIPANTS (number of synthetic participants to preload).
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            seed = os.getenv("FAKE_DB_SEED")
+            _shared = FakeSupabase(
+                latency=float(os.getenv("FAKE_DB_LATENCY_MS", "0")) / 1000,
+                jitter=float(os.getenv("FAKE_DB_JITTER_MS", "0")) / 1000,
+                failure_rate=float(os.getenv("FAKE_DB_FAILURE_RATE", "0")),
+                seed=int(seed) if seed else None,
+            )
+            preload = int(os.getenv("FAKE_DB_PARTICIPANTS", "0"))
+            if preload:
+                from utils.synthetic import make_participants
+                table = _shared.tables["participants"]
+                for row in make_participants(preload, "realistic", seed=0):
+                    table.insert(row)
+        return _shared
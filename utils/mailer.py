@@ -0,0 +1,333 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+from utils.templates import ASSIGNMENT, DEFAULT_SENDER, iter_assignment_messages
+from utils.metrics import gauge, incr, log_error, span
+from utils.throttle import TokenBucket
+
+
+# Retry backoff goes through this hook so tests can skip it without patching time.sleep
+_sleep = time.sleep
+
+
+# --- Providers ---
+# A provider sends a list of message dicts ({"from", "to", "subject", "html"})
+# in as few calls as it can and raises if the batch failed.
+
+class ResendProvider:
+    """Resend batch API (up to 100 emails per call)."""
+    max_batch = 100
+
+    def __init__(self, api_key=None):
+        import resend
+        if api_key:
+            resend.api_key = api_key
+        self._resend = resend
+
+    def send_batch(self, messages):
+        if len(messages) == 1:
+            self._resend.Emails.send(messages[0])
+        else:
+            self._resend.Batch.send(messages)
+
+
+class FileProvider:
+    """Local stand-in: appends every message as a JSON line to a file."""
+    max_batch = 1000
+
+    def __init__(self, path="outbox.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            for message in messages:
+                f.write(json.dumps(message) + "\n")
+
+
+class SMTPProvider:
+    """Plain SMTP (e.g. a local MailHog/Mailpit) over one connection per batch."""
+    max_batch = 50
+
+    def __init__(self, host="localhost", port=1025, username=None, password=None, use_tls=False):
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+
+    def send_batch(self, messages):
+        import smtplib
+        from email.message import EmailMessage
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.use_tls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                email = EmailMessage()
+                email["From"] = message.get("from", DEFAULT_SENDER)
+                email["To"] = message["to"]
+                email["Subject"] = message["subject"]
+                email.set_content(message["html"], subtype="html")
+                smtp.send_message(email)
+
+
+def get_provider(name=None):
+    """Provider from EMAIL_PROVIDER ("resend", "file" or "smtp"); defaults to resend."""
+    name = (name or os.getenv("EMAIL_PROVIDER") or "resend").lower()
+    if name == "file":
+        return FileProvider(os.getenv("EMAIL_OUTBOX", "outbox.jsonl"))
+    if name == "smtp":
+        return SMTPProvider(
+            host=os.getenv("SMTP_HOST", "localhost"),
+            port=os.getenv("SMTP_PORT", "1025"),
+            username=os.getenv("SMTP_USERNAME"),
+            password=os.getenv("SMTP_PASSWORD"),
+            use_tls=os.getenv("SMTP_TLS", "").lower() in ("1", "true", "yes"),
+        )
+    if name == "resend":
+        return ResendProvider(os.getenv("RESEND_API_KEY"))
+    raise ValueError(f"Unknown EMAIL_PROVIDER '{name}'")
+
+
+# --- Dispatcher ---
+
+class EmailDispatcher:
+    """
+    Background email pipeline.
+
+    Messages go on a bounded queue and return immediately. Worker threads
+    drain it in batches of up to `batch_size`, take one token from a shared
+    rate limiter per provider call, and retry failed batches with
+    exponential backoff and jitter. After each batch, `on_result(keys,
+    ok, error)` is called with the keys passed to submit(). Assignment
+    notifications use it to record per-recipient status.
+
+    Dispatchers that share a provider should share its `limiter` too.
+    """
+
+    def __init__(self, provider, batch_size=100, workers=2, rate=2.0, max_retries=5,
+                 queue_size=10000, linger=0.2, on_result=None, limiter=None, name="email"):
+        self.provider = provider
+        self.batch_size = min(batch_size, getattr(provider, "max_batch", batch_size))
+        self.workers = workers
+        self.max_retries = max_retries
+        self.linger = linger
+        self.on_result = on_result
+        self.name = name
+        self.limiter = limiter or TokenBucket(rate)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "sent": 0, "failed": 0, "batches": 0, "retries": 0}
+        self._latencies = deque(maxlen=1000)  # seconds from submit to provider result
+
+    # Submission
+
+    def submit(self, message, key=None):
+        """Queue one message without blocking. Returns False if the queue is full."""
+        self._start()
+        try:
+            self._queue.put_nowait((message, key, time.monotonic()))
+        except queue.Full:
+            return False
+        self._count("submitted")
+        return True
+
+    def submit_many(self, items):
+        """
+        Feed (message, key) pairs from an iterable on a background thread.
+
+        The bounded queue applies backpressure to the iterable, so a
+        generator of 20k messages is never fully materialized and the
+        caller returns immediately.
+        """
+        self._start()
+
+        def feed():
+            for message, key in items:
+                self._queue.put((message, key, time.monotonic()))
+                self._count("submitted")
+
+        thread = threading.Thread(target=feed, name=f"{self.name}-feeder", daemon=True)
+        thread.start()
+        return thread
+
+    def send_now(self, message):
+        """Send one message synchronously through the same provider and rate limit."""
+        self.limiter.acquire()
+        self._send_with_retry([message])
+        self._count("sent")
+        self._count("batches")
+
+    def flush(self):
+        """Block until everything queued so far has been handled."""
+        self._queue.join()
+
+    def stats(self):
+        """Counters plus queue depth and submit-to-send latency (recent p50/p95/max, seconds)."""
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = sorted(self._latencies)
+        counts["queued"] = self._queue.qsize()
+        if latencies:
+            counts["latency_p50"] = latencies[len(latencies) // 2]
+            counts["latency_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            counts["latency_max"] = latencies[-1]
+        else:
+            counts["latency_p50"] = counts["latency_p95"] = counts["latency_max"] = 0.0
+        return counts
+
+    # Workers
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"{self.name}-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _send_with_retry(self, messages):
+        name = f"email.send.{type(self.provider).__name__}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                with span(name, rows=len(messages)):
+                    self.provider.send_batch(messages)
+                return
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                self._count("retries")
+                incr("email_retries", dispatcher=self.name)
+                _sleep(min(60.0, 2 ** attempt) * (0.5 + random.random()))
+                self.limiter.acquire()
+
+    def _work(self):
+        while True:
+            batch = self._next_batch()
+            messages = [message for message, _, _ in batch]
+            keys = [key for _, key, _ in batch if key is not None]
+            error = None
+            # Errors below are logged against this span, so failed batches show up in /metrics
+            with span(f"email.batch.{self.name}", rows=len(messages)):
+                try:
+                    self.limiter.acquire()
+                    self._send_with_retry(messages)
+                    self._count("sent", len(messages))
+                except Exception as e:
+                    error = str(e)
+                    log_error(f"Error sending {len(messages)} emails: {e}")
+                    incr("emails_failed", len(messages), dispatcher=self.name)
+                    self._count("failed", len(messages))
+                self._count("batches")
+                now = time.monotonic()
+                with self._lock:
+                    self._latencies.extend(now - submitted for _, _, submitted in batch)
+                if self.on_result and keys:
+                    try:
+                        self.on_result(keys, error is None, error)
+                    except Exception as e:
+                        log_error(f"Error recording email status: {e}")
+            for _ in batch:
+                self._queue.task_done()
+
+
+_dispatchers = {}
+_dispatcher_lock = threading.Lock()
+_provider_limiter = None
+
+
+def record_assignment_status(giver_emails, ok, error=None):
+    """Default on_result: persist per-giver notification status on the active run."""
+    from utils.db import update_assignment_status
+    update_assignment_status(giver_emails, "notified" if ok else "notify_failed")
+
+
+def _shared_dispatcher(name, **kwargs):
+    global _provider_limiter
+    with _dispatcher_lock:
+        if name not in _dispatchers:
+            if _provider_limiter is None:
+                _provider_limiter = TokenBucket(float(os.getenv("EMAIL_RATE_PER_SEC", "2")))
+            dispatcher = _dispatchers[name] = EmailDispatcher(get_provider(), limiter=_provider_limiter, name=name, **kwargs)
+            gauge(f"email_queue_depth_{name}", lambda: dispatcher.stats()["queued"])
+        return _dispatchers[name]
+
+
+def get_dispatcher():
+    """Process-wide dispatcher for bulk notifications, configured from the environment."""
+    return _shared_dispatcher(
+        "notifications",
+        batch_size=int(os.getenv("EMAIL_BATCH_SIZE", "100")),
+        workers=int(os.getenv("EMAIL_WORKERS", "2")),
+        on_result=record_assignment_status,
+    )
+
+
+def get_login_dispatcher(on_result=None):
+    """
+    Process-wide dispatcher for magic links. It has its own queue, so logins
+    never wait behind a bulk notification backlog, but it shares the
+    provider rate limit with get_dispatcher().
+    """
+    return _shared_dispatcher(
+        "login",
+        batch_size=int(os.getenv("EMAIL_BATCH_SIZE", "100")),
+        workers=1,
+        linger=0.05,
+        queue_size=int(os.getenv("LOGIN_QUEUE_SIZE", "5000")),
+        on_result=on_result,
+    )
+
+
+# --- Notifications ---
+
+RECEIVER_COLUMNS = ["email", "name", "bio", "wishlist"]
+
+
+def notify_assignments(assignments, app_domain, receivers=None, dispatcher=None, template=ASSIGNMENT, only_receivers=False):
+    """
+    Queue one templated email per giver and return immediately.
+
+    assignments: dict {giver_email: receiver_email}
+    receivers: iterable of receiver rows (email, name, bio, wishlist). Defaults
+        to a paginated DB stream, rendered lazily as the queue drains.
+    template: ASSIGNMENT or REMINDER
+    only_receivers: fetch just the receivers in `assignments` by email
+        instead of streaming every participant; for a few changed pairs
+    """
+    dispatcher = dispatcher or get_dispatcher()
+    if receivers is None:
+        from utils.db import iter_participants, iter_participants_by_email
+        if only_receivers:
+            receivers = iter_participants_by_email(assignments.values(), columns=RECEIVER_COLUMNS)
+        else:
+            receivers = iter_participants(columns=RECEIVER_COLUMNS)
+    return dispatcher.submit_many(iter_assignment_messages(assignments, receivers, app_domain, template))
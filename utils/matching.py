@@ -1,96 +1,683 @@
+import hashlib
 import random
-import pandas as pd
-from utils.db import get_all_participants
+import secrets
+from array import array
+from itertools import chain
+
+from utils.constraints import compile_constraints, required_columns
+from utils.metrics import span
+
+# Tier codes stored in ParticipantIndex.tiers
+JUNIOR, MID, SENIOR = 0, 1, 2
+TIER_NAMES = ("Junior", "Mid", "Senior")
+_TIER_CODES = {"junior": JUNIOR, "mid": MID, "senior": SENIOR}
+
+
+def tier_code(level):
+    """Map an expertise_level string to a tier code. Unknown or missing is Mid."""
+    if not level:
+        return MID
+    return _TIER_CODES.get(str(level).strip().lower(), MID)
+
+
+class ParticipantIndex:
+    """
+    Compact participant view used by the matcher.
+
+    Emails are interned to integer ids (their position in `emails`) and each
+    tier is stored as one byte in `tiers`, so matching works on small integer
+    arrays instead of full participant rows.
+    """
+    __slots__ = ("emails", "ids", "tiers", "extra")
+
+    def __init__(self, rows=(), columns=()):
+        """columns: extra participant fields to keep (e.g. website_url for constraints)."""
+        self.emails = []
+        self.ids = {}
+        self.tiers = array("b")
+        self.extra = {column: [] for column in columns}
+        for row in rows:
+            self.add(row.get("email"), row.get("expertise_level"), row)
+
+    def add(self, email, expertise_level=None, row=None):
+        """Intern a participant and return its id. Duplicates keep their first id."""
+        if not email:
+            return None
+        pid = self.ids.get(email)
+        if pid is None:
+            pid = len(self.emails)
+            self.ids[email] = pid
+            self.emails.append(email)
+            self.tiers.append(tier_code(expertise_level))
+            for column, values in self.extra.items():
+                values.append(row.get(column) if row else None)
+        return pid
+
+    def column(self, name):
+        """Values of an extra column, aligned with the ids."""
+        return self.extra[name]
+
+    def __len__(self):
+        return len(self.emails)
+
+    def by_tier(self):
+        """Return (junior_ids, mid_ids, senior_ids) as lists."""
+        groups = ([], [], [])
+        for pid, tier in enumerate(self.tiers):
+            groups[tier].append(pid)
+        return groups
+
+    def to_emails(self, edges):
+        """Map {giver_id: receiver_id} back to {giver_email: receiver_email}."""
+        emails = self.emails
+        return {emails[g]: emails[r] for g, r in edges.items()}
+
+    def to_dataframe(self):
+        """Pandas adapter (email, expertise_level) for the admin views."""
+        import pandas as pd
+        return pd.DataFrame({
+            "email": self.emails,
+            "expertise_level": [TIER_NAMES[t] for t in self.tiers],
+        })
+
+
+class TierPolicy:
+    """
+    Ordered (giver_tier, receiver_tier) stages run before the general matching.
+
+    Each stage pairs as many available givers of one tier with available
+    receivers of another as it can; whoever is left over moves on to the
+    next stage and finally to the general pool. Stages must go from a more
+    senior to a more junior tier, which keeps the fixed pairs cycle-free.
+    """
+    __slots__ = ("name", "stages")
+
+    def __init__(self, stages, name=None):
+        for giver_tier, receiver_tier in stages:
+            if giver_tier <= receiver_tier:
+                raise ValueError(
+                    f"Tier policy stage {TIER_NAMES[giver_tier]} -> {TIER_NAMES[receiver_tier]} "
+                    "must go from a more senior to a more junior tier."
+                )
+        self.stages = tuple(stages)
+        self.name = name
+
+    def __repr__(self):
+        return f"TierPolicy({self.name or list(self.stages)})"
+
+
+TIER_POLICIES = {
+    "senior_junior": TierPolicy([(SENIOR, JUNIOR)], "senior_junior"),
+    "mid_junior_overflow": TierPolicy([(SENIOR, JUNIOR), (MID, JUNIOR)], "mid_junior_overflow"),
+    "senior_mid_fallback": TierPolicy([(SENIOR, JUNIOR), (SENIOR, MID)], "senior_mid_fallback"),
+    "full_ladder": TierPolicy([(SENIOR, JUNIOR), (MID, JUNIOR), (SENIOR, MID)], "full_ladder"),
+    "none": TierPolicy([], "none"),
+}
+DEFAULT_TIER_POLICY = "senior_junior"
+
+
+def get_tier_policy(policy):
+    """Accept a TierPolicy, a name from TIER_POLICIES, or None (default)."""
+    if isinstance(policy, TierPolicy):
+        return policy
+    name = policy or DEFAULT_TIER_POLICY
+    if name not in TIER_POLICIES:
+        raise ValueError(f"Unknown tier policy '{name}'. Choose from: {', '.join(TIER_POLICIES)}")
+    return TIER_POLICIES[name]
+
+
+def tier_priority_pairs(index, policy, rng=random):
+    """
+    Run the tier policy as one batched stage.
+
+    Each tier's ids are shuffled once (separately for the giving and the
+    receiving side); every stage then pairs the first k available givers
+    with the first k available receivers and drops both prefixes by slicing.
+    Returns: array succ where succ[giver_id] is the receiver id or -1.
+    """
+    succ = array("l", [-1]) * len(index)
+    givers = list(index.by_tier())
+    receivers = [list(ids) for ids in givers]
+    for ids in givers + receivers:
+        rng.shuffle(ids)
+
+    for giver_tier, receiver_tier in policy.stages:
+        pool_g, pool_r = givers[giver_tier], receivers[receiver_tier]
+        k = min(len(pool_g), len(pool_r))
+        if not k:
+            continue
+        for giver, receiver in zip(pool_g[:k], pool_r[:k]):
+            succ[giver] = receiver
+        givers[giver_tier] = pool_g[k:]
+        receivers[receiver_tier] = pool_r[k:]
+    return succ
+
+
+def chains_from_successors(succ):
+    """
+    Collapse the fixed pairs in `succ` into (head, tail) chains.
+
+    Anyone not in a fixed pair is a chain of one. With the Mid stages a
+    chain can be longer than one pair (Senior -> Mid -> Junior). O(n).
+    """
+    n = len(succ)
+    has_giver = bytearray(n)
+    for receiver in succ:
+        if receiver >= 0:
+            has_giver[receiver] = 1
+    chains = []
+    for head in range(n):
+        if has_giver[head]:
+            continue
+        tail = head
+        while succ[tail] >= 0:
+            tail = succ[tail]
+        chains.append((head, tail))
+    return chains
+
 
 class SecretSantaMatcher:
-    def __init__(self, participants=None):
+    def __init__(self, participants=None, constraints=None, policy=None, seed=None):
         """
-        participants: list of dicts from DB. If None, fetches from DB.
+        participants: list of dicts from DB. If None, streams email and
+            expertise_level (plus any constraint columns) from the DB.
+        constraints: optional list of utils.constraints.Constraint. When given,
+            run_match uses the constraint-aware solver instead of the fast path.
+        policy: TierPolicy or a TIER_POLICIES name (default "senior_junior").
+        seed: integer seed. The same seed, participants and options always
+            produce the same assignments. A random one is drawn if omitted.
         """
+        self.constraints = list(constraints or ())
+        self.policy = get_tier_policy(policy)
+        self.seed = new_seed() if seed is None else int(seed)
+        self.digest = None
+        self.stats = {}
+        columns = required_columns(self.constraints)
         if participants is None:
-            participants = get_all_participants()
+            # Stream only the fields matching needs; pages already come in email order
+            from utils.db import iter_participants
+            rows = iter_participants(columns=["email", "expertise_level", *columns])
+        else:
+            # Intern in email order so ids (and therefore the run) don't depend on DB row order
+            rows = sorted(participants, key=lambda p: p.get("email") or "")
         self.participants = participants
-        self.df = pd.DataFrame(participants) if participants else pd.DataFrame()
-        
+        with span("match.load_participants") as load:
+            self.index = ParticipantIndex(rows, columns=columns)
+            load.rows = len(self.index)
+
+    @property
+    def df(self):
+        """Participant rows as a DataFrame (pandas is only imported here)."""
+        if self.participants is None:
+            return self.index.to_dataframe()
+        import pandas as pd
+        return pd.DataFrame(self.participants) if self.participants else pd.DataFrame()
+
     def run_match(self):
         """
         Execute the matching logic.
         Returns: dict {giver_email: receiver_email}
+        Raises: MatchingError for fewer than 2 participants or if no valid
+            matching exists.
+
+        Uses its own random.Random(self.seed), so calling it again (or on
+        another matcher with the same seed) regenerates the same pairs.
+        The result's assignment_digest is kept in self.digest, and solver
+        counters (tier pairs, repairs) in self.stats.
         """
-        if self.df.empty:
-            return {}
-            
-        # 1. Separate by Expertise
-        # Standardize casing just in case
-        if "expertise_level" in self.df.columns:
-            juniors = self.df[self.df["expertise_level"].str.lower() == "junior"]
-            mids = self.df[self.df["expertise_level"].str.lower() == "mid"]
-            seniors = self.df[self.df["expertise_level"].str.lower() == "senior"]
-            # Others or missing? Treat as Mid
-            others = self.df[~self.df["expertise_level"].str.lower().isin(["junior", "mid", "senior"])]
-            mids = pd.concat([mids, others])
+        index = self.index
+        self.stats = {"tier_pairs": 0, "greedy_misses": 0, "augmented": 0, "reciprocal_swaps": 0}
+        if len(index) < 2:
+            raise MatchingError("Need at least 2 participants to generate assignments.")
+        rng = random.Random(self.seed)
+        if self.constraints:
+            with span("match.compile_constraints", rows=len(index)):
+                compiled = compile_constraints(index, self.constraints)
+            with span("match.solve", rows=len(index)):
+                edges = solve_constrained(index, compiled, rng=rng, policy=self.policy, stats=self.stats)
         else:
-            # Fallback if column missing
-            juniors = pd.DataFrame()
-            seniors = pd.DataFrame()
-            mids = self.df
-        
-        assignments = {}
-        givers_pool = set(self.df["email"])
-        receivers_pool = set(self.df["email"])
-
-        # --- LOGIC: Senior -> Junior Priority ---
-        # Try to assign every Senior to a Junior first
-        
-        senior_emails = list(seniors["email"]) if not seniors.empty else []
-        junior_emails = list(juniors["email"]) if not juniors.empty else []
-        mid_emails = list(mids["email"]) if not mids.empty else []
-        
-        random.shuffle(senior_emails)
-        random.shuffle(junior_emails)
-        random.shuffle(mid_emails)
-
-        # 1. Seniors give to Juniors (as much as possible)
-        for senior in senior_emails:
-            if junior_emails:
-                # Give to a junior
-                receiver = junior_emails.pop(0)
-                assignments[senior] = receiver
-                
-                givers_pool.remove(senior)
-                receivers_pool.remove(receiver)
-            else:
-                # No juniors left? Senior gives to Mid?
-                pass 
-
-        # 2. Remaining matching (Derangement)
-        # We need to take the remaining givers and match them to remaining receivers
-        # such that no one gives to themselves.
-        
-        rem_givers = list(givers_pool)
-        rem_receivers = list(receivers_pool)
-        
-        # Simple derangement attempt
-        # If we fail (someone matched to self), we retry (shuffle)
-        max_retries = 100
-        for _ in range(max_retries):
-            random.shuffle(rem_receivers)
-            valid = True
-            temp_assignments = {}
-            
-            for g, r in zip(rem_givers, rem_receivers):
-                if g == r:
-                    valid = False
-                    break
-                temp_assignments[g] = r
-            
-            if valid:
-                assignments.update(temp_assignments)
-                return assignments
-        
-        # If failed after retries (rare unless n is very small), return empty or error
-        print("Failed to find valid matching after retries.")
+            # 1. Tier priority (Senior -> Junior, plus any overflow/fallback stages)
+            with span("match.tier_pairs", rows=len(index)):
+                succ = tier_priority_pairs(index, self.policy, rng)
+
+            # 2. Remaining matching (Derangement)
+            # Every fixed pair is part of a chain: its head still needs a Santa and
+            # its tail still needs someone to give to. Everyone else is a chain of
+            # one. Linking the chains into a single cycle closes the matching in
+            # one pass, with no retries and without breaking any fixed pair.
+            with span("match.link_chains", rows=len(index)):
+                edges = {giver: receiver for giver, receiver in enumerate(succ) if receiver >= 0}
+                self.stats["tier_pairs"] = len(edges)
+                edges.update(link_chains(chains_from_successors(succ), rng))
+
+        with span("match.finish", rows=len(index)):
+            assignments = index.to_emails(edges)
+            self.digest = assignment_digest(assignments)
+        return assignments
+
+
+def new_seed():
+    """Random seed that fits a Postgres bigint."""
+    return secrets.randbits(63)
+
+
+def assignment_digest(assignments):
+    """
+    Order-independent digest of {giver_email: receiver_email}.
+
+    Each pair is hashed on its own and the hashes are summed mod 2**128, so
+    two runs can be compared in O(n) without sorting or diffing tables.
+    """
+    total = sum(_pair_hash(giver, receiver) for giver, receiver in assignments.items())
+    return f"{len(assignments)}-{total % (1 << 128):032x}"
+
+
+def _pair_hash(giver, receiver):
+    pair = f"{giver}\x1f{receiver}".encode()
+    return int.from_bytes(hashlib.blake2b(pair, digest_size=16).digest(), "big")
+
+
+def combine_digests(digests):
+    """Digest of the union of disjoint assignment sets, from their digests (e.g. shards)."""
+    size = total = 0
+    for digest in digests:
+        count, value = digest.split("-")
+        size += int(count)
+        total += int(value, 16)
+    return f"{size}-{total % (1 << 128):032x}"
+
+
+def update_digest(digest, removed, added):
+    """
+    Digest after replacing the `removed` pairs with the `added` ones, in O(k).
+
+    removed / added: iterables of (giver_email, receiver_email). Gives the
+    same result as assignment_digest() over the full new assignments.
+    """
+    size, total = digest.split("-")
+    size, total = int(size), int(total, 16)
+    for giver, receiver in removed:
+        size -= 1
+        total -= _pair_hash(giver, receiver)
+    for giver, receiver in added:
+        size += 1
+        total += _pair_hash(giver, receiver)
+    return f"{size}-{total % (1 << 128):032x}"
+
+
+class MatchingError(Exception):
+    """Raised when no valid matching can exist for the given participants."""
+
+
+def link_chains(chains, rng=random):
+    """
+    Close a set of disjoint chains into one random cycle.
+
+    chains: list of (head, tail) tuples. The head still needs a giver and the
+    tail still needs a receiver; a single participant is (p, p).
+    Returns: dict {tail: next_head} with the new edges only.
+
+    The chains are shuffled and each tail gives to the head of the next one
+    (Sattolo-style single cycle), so nobody can end up giving to themselves
+    as long as there are at least two chains. O(n), never retries.
+    """
+    if not chains:
         return {}
+    if len(chains) == 1:
+        head, tail = chains[0]
+        if head == tail:
+            raise MatchingError("Need at least 2 participants to generate assignments.")
+        return {tail: head}
+
+    chains = list(chains)
+    rng.shuffle(chains)
+    edges = {}
+    for i, (_, tail) in enumerate(chains):
+        edges[tail] = chains[(i + 1) % len(chains)][0]
+    return edges
+
+
+class _FreePool:
+    """Set of ids with O(1) random pick and removal (swap-with-last)."""
+    __slots__ = ("items", "pos")
+
+    def __init__(self, items, size):
+        self.items = list(items)
+        self.pos = array("l", [-1]) * size
+        for i, item in enumerate(self.items):
+            self.pos[item] = i
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return self.pos[item] >= 0
+
+    def pick(self, rng):
+        return self.items[int(rng.random() * len(self.items))]
+
+    def remove(self, item):
+        i = self.pos[item]
+        if i < 0:
+            return
+        last = self.items.pop()
+        if last != item:
+            self.items[i] = last
+            self.pos[last] = i
+        self.pos[item] = -1
+
+
+def solve_constrained(index, compiled, rng=random, tries=8, policy=None, stats=None, restarts=3):
+    """
+    Find a perfect matching {giver_id: receiver_id} that satisfies `compiled`.
+
+    Randomized greedy first (tier policy stages, then everyone tries a few
+    random free receivers), then augmenting paths for the givers greedy
+    couldn't place, found in shared phases (see _augment_all) over the
+    complement of the forbidden edges, so no allowed-edge graph is ever
+    materialized. Reciprocal pairs are repaired last (see
+    _break_reciprocals); if that fails the whole run is retried from
+    `restarts` fresh greedy starts, and finally by an exhaustive search.
+
+    stats: optional dict that receives tier_pairs, greedy_misses,
+    augmented and reciprocal_swaps counts.
+
+    Raises MatchingError if no matching satisfies the constraints.
+    """
+    n = len(index)
+    stats = {} if stats is None else stats
+    stats.update(tier_pairs=0, greedy_misses=0, augmented=0, reciprocal_swaps=0)
+    if n < 2:
+        raise MatchingError("Need at least 2 participants to generate assignments.")
+
+    policy = get_tier_policy(policy)
+    allows = compiled.allows
+    for _ in range(restarts + 1):
+        # 1-3. Greedy and augmenting paths; 4. reciprocal pair repair
+        match_g, match_r = _place_all(index, compiled, rng, tries, policy, stats)
+        if not compiled.no_reciprocal or _break_reciprocals(n, allows, compiled.groups, match_g, match_r, rng, stats):
+            return {g: match_g[g] for g in range(n)}
+
+    # 5. Exhaustive search (exponential, but only pools the repairs can't
+    # crack get here, and those are tiny or nearly infeasible)
+    match_g, complete = _search_no_reciprocal(n, allows)
+    if match_g is None:
+        if complete:
+            raise MatchingError("No valid matching satisfies the constraints without a reciprocal pair.")
+        raise MatchingError("No matching without a reciprocal pair was found; try fewer exclusions.")
+    return {g: match_g[g] for g in range(n)}
+
+
+def _place_all(index, compiled, rng, tries, policy, stats):
+    """
+    One greedy + augmenting-path pass of solve_constrained.
+
+    Returns (match_g, match_r) arrays: giver -> receiver, receiver -> giver.
+    Raises MatchingError if no perfect matching exists at all.
+    """
+    n = len(index)
+    stats.update(tier_pairs=0, greedy_misses=0, augmented=0, reciprocal_swaps=0)
+    allows = compiled.allows
+    no_reciprocal = compiled.no_reciprocal
+    match_g = array("l", [-1]) * n  # giver -> receiver
+    match_r = array("l", [-1]) * n  # receiver -> giver
+    free = _FreePool(range(n), n)
+
+    def try_place(giver, pool):
+        for _ in range(min(tries, len(pool))):
+            receiver = pool.pick(rng)
+            if allows(giver, receiver) and not (no_reciprocal and match_g[receiver] == giver):
+                match_g[giver] = receiver
+                match_r[receiver] = giver
+                free.remove(receiver)
+                return True
+        return False
+
+    # 1. Tier priority stages (Senior -> Junior first)
+    tier_ids = index.by_tier()
+    for giver_tier, receiver_tier in policy.stages:
+        pool = _FreePool([r for r in tier_ids[receiver_tier] if match_r[r] < 0], n)
+        givers = [g for g in tier_ids[giver_tier] if match_g[g] < 0]
+        rng.shuffle(givers)
+        for giver in givers:
+            if not len(pool):
+                break
+            if try_place(giver, pool):
+                pool.remove(match_g[giver])
+                stats["tier_pairs"] += 1
+
+    # 2. Greedy for everyone else
+    givers = [g for g in range(n) if match_g[g] < 0]
+    rng.shuffle(givers)
+    unplaced = [g for g in givers if not try_place(g, free)]
+    stats["greedy_misses"] = len(unplaced)
+
+    # 3. Augmenting-path repair
+    stuck = _augment_all(unplaced, n, allows, compiled.groups, match_g, match_r)
+    if stuck:
+        raise MatchingError(
+            f"No valid matching satisfies the constraints ({index.emails[stuck[0]]} can't be placed)."
+        )
+    stats["augmented"] = len(unplaced)
+    return match_g, match_r
+
+
+def _augment_all(roots, n, allows, groups, match_g, match_r):
+    """
+    Place the unmatched givers `roots` along augmenting paths (Hopcroft-Karp).
+
+    Each phase layers the receivers with one BFS from all unplaced roots at
+    once, then a DFS per root flips a shortest path through those layers,
+    using every receiver at most once per phase, so one phase places many
+    roots. Receivers are bucketed by the first group label (e.g. agency),
+    letting a giver skip its own group in one step instead of testing every
+    colleague; a phase costs O(n + exclusions outside that grouping).
+
+    Returns the roots that can't be placed: empty unless no perfect
+    matching exists.
+    """
+    labels = groups[0] if groups else None
+    pending = list(roots)
+    while pending:
+        layers = _bfs_layers(pending, n, allows, labels, match_r)
+        if layers is None:
+            return pending
+        for root in pending:
+            _dfs_augment(root, layers, allows, labels, match_g, match_r)
+        pending = [root for root in pending if match_g[root] < 0]
+    return []
+
+
+def _bfs_layers(roots, n, allows, labels, match_r):
+    """
+    Receivers reachable from `roots` by alternating paths, by distance.
+
+    Returns [{label: [receivers]}] per layer, stopping at the first layer
+    with a free receiver (which keeps only the free ones), or None if no
+    free receiver is reachable.
+    """
+    unvisited = {}
+    for receiver in range(n):
+        unvisited.setdefault(labels[receiver] if labels is not None else -1, []).append(receiver)
+    layers = []
+    frontier = roots
+    while frontier:
+        layer = {}
+        following = []
+        found = False
+        for giver in frontier:
+            own = labels[giver] if labels is not None else -1
+            for label in list(unvisited):
+                if label == own and own >= 0:
+                    continue
+                bucket = unvisited[label]
+                blocked = []
+                while bucket:
+                    receiver = bucket.pop()
+                    if not allows(giver, receiver):
+                        blocked.append(receiver)
+                        continue
+                    layer.setdefault(label, []).append(receiver)
+                    if match_r[receiver] < 0:
+                        found = True
+                    else:
+                        following.append(match_r[receiver])
+                if blocked:
+                    bucket.extend(blocked)
+                else:
+                    del unvisited[label]
+        if found:
+            layers.append({label: [r for r in bucket if match_r[r] < 0] for label, bucket in layer.items()})
+            return layers
+        layers.append(layer)
+        frontier = following
+    return None
+
+
+def _layer_candidates(giver, layer, allows, labels):
+    """Yield (and use up) the receivers in `layer` giver may give to; blocked ones go back on close."""
+    own = labels[giver] if labels is not None else -1
+    blocked = []
+    try:
+        for label in list(layer):
+            if label == own and own >= 0:
+                continue
+            bucket = layer.get(label, ())
+            while bucket:
+                receiver = bucket.pop()
+                if allows(giver, receiver):
+                    yield receiver
+                else:
+                    blocked.append((label, receiver))
+            if label in layer and not layer[label]:
+                del layer[label]
+    finally:
+        for label, receiver in blocked:
+            layer.setdefault(label, []).append(receiver)
+
+
+def _dfs_augment(root, layers, allows, labels, match_g, match_r):
+    """Flip one shortest augmenting path from `root` through `layers`, if any is left."""
+    givers = [root]
+    taken = []  # taken[i]: receiver linking givers[i] to givers[i + 1]
+    stack = [_layer_candidates(root, layers[0], allows, labels)]
+    while stack:
+        receiver = next(stack[-1], None)
+        if receiver is None:
+            stack.pop()
+            givers.pop()
+            if taken:
+                taken.pop()
+            continue
+        taken.append(receiver)
+        if match_r[receiver] < 0:
+            for candidates in stack:
+                candidates.close()
+            for giver, receiver in zip(givers, taken):
+                match_g[giver] = receiver
+                match_r[receiver] = giver
+            return True
+        givers.append(match_r[receiver])
+        stack.append(_layer_candidates(givers[-1], layers[len(stack)], allows, labels))
+    return False
+
+
+def _break_reciprocals(n, allows, groups, match_g, match_r, rng, stats):
+    """
+    Remove every A<->B pair from a perfect matching, in place.
+
+    Each pair first tries a local swap (_swap_reciprocal). If no single
+    swap works, one side's edge is banned and that giver re-placed along an
+    augmenting path, which can reach any receiver; new pairs that creates
+    are handled the same way, for a bounded number of rounds. Banned edges
+    stay banned so repairs can't undo each other. Returns False if some
+    pair resists; the caller then restarts from a fresh greedy pass.
+    """
+    banned = set()
+
+    def allowed(giver, receiver):
+        return allows(giver, receiver) and (giver, receiver) not in banned
+
+    for _ in range(32):
+        pairs = [a for a in range(n) if a < match_g[a] and match_g[match_g[a]] == a]
+        if not pairs:
+            return True
+        for a in pairs:
+            b = match_g[a]
+            if match_g[b] != a:
+                continue  # broken by an earlier repair
+            stats["reciprocal_swaps"] += 1
+            if _swap_reciprocal(a, b, n, allowed, match_g, match_r, rng):
+                continue
+            for giver, receiver in ((a, b), (b, a)):
+                banned.add((giver, receiver))
+                match_g[giver] = match_r[receiver] = -1
+                if not _augment_all([giver], n, allowed, groups, match_g, match_r):
+                    break
+                match_g[giver], match_r[receiver] = receiver, giver
+            else:
+                return False
+    return False
+
+
+def _swap_reciprocal(a, b, n, allows, match_g, match_r, rng):
+    """
+    Turn A<->B into A->D, C->B using some other edge C->D; False if none fits.
+
+    The swap can't create a new reciprocal pair: B gives to A and A's giver
+    is B, so neither new edge can be mirrored.
+    """
+    candidates = [int(rng.random() * n) for _ in range(16)]
+    for c in chain(candidates, range(n)):
+        if c == a or c == b:
+            continue
+        d = match_g[c]
+        if allows(a, d) and allows(c, b):
+            match_g[a], match_g[c] = d, b
+            match_r[d], match_r[b] = a, c
+            return True
+    return False
+
+
+def _search_no_reciprocal(n, allows, budget=1_000_000):
+    """
+    Depth-first search over givers in id order for a reciprocal-free matching.
+
+    Returns (match_g, True) if found, (None, True) if none exists, or
+    (None, False) if `budget` allows() checks ran out first.
+    """
+    match_g = [-1] * n
+    used = [False] * n
+    checks = 0
+
+    def candidates(giver):
+        nonlocal checks
+        for receiver in range(n):
+            if used[receiver] or match_g[receiver] == giver:
+                continue
+            checks += 1
+            if allows(giver, receiver):
+                yield receiver
+
+    stack = [candidates(0)]
+    while stack:
+        giver = len(stack) - 1
+        if match_g[giver] >= 0:
+            used[match_g[giver]] = False
+            match_g[giver] = -1
+        if checks > budget:
+            return None, False
+        receiver = next(stack[-1], None)
+        if receiver is None:
+            stack.pop()
+            continue
+        match_g[giver] = receiver
+        used[receiver] = True
+        if giver + 1 == n:
+            return match_g, True
+        stack.append(candidates(giver + 1))
+    return None, True
+
 
 def verify_derangement(assignments):
     """Ensure no one is assigned to themselves."""
@@ -98,3 +685,21 @@ def verify_derangement(assignments):
         if giver == receiver:
             return False
     return True
+
+
+def verify_assignments(assignments, participants, constraints=()):
+    """
+    Ensure every participant gives once and receives once and every pair
+    satisfies the constraints (including NoReciprocal).
+    """
+    index = ParticipantIndex(participants, columns=required_columns(constraints))
+    if not set(assignments) == set(assignments.values()) == set(index.emails) or len(assignments) != len(index):
+        return False
+    compiled = compile_constraints(index, constraints)
+    ids = index.ids
+    for giver, receiver in assignments.items():
+        if not compiled.allows(ids[giver], ids[receiver]):
+            return False
+        if compiled.no_reciprocal and assignments[receiver] == giver:
+            return False
+    return True
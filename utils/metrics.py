@@ -0,0 +1,209 @@
+import bisect
+import functools
+import threading
+import time
+
+# Span latency buckets in seconds (upper bounds; +Inf is implicit)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = "secret_santa"
+
+
+class SpanStats:
+    """Latency histogram plus error and row counters for one span name."""
+    __slots__ = ("buckets", "count", "total", "max", "errors", "rows")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+        self.rows = 0
+
+    def quantile(self, q):
+        """Estimate from the buckets (linear within a bucket), in seconds."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(self.max, low + (high - low) * (rank - seen) / n)
+            seen += n
+        return self.max
+
+
+class Registry:
+    """Thread-safe spans, counters and gauges, cheap enough for every db call."""
+
+    def __init__(self):
+        self._spans = {}
+        self._counters = {}  # (name, labels) -> value
+        self._gauges = {}  # name -> callable returning a number
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, name, seconds, rows=0, error=False):
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = SpanStats()
+            stats.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            stats.count += 1
+            stats.total += seconds
+            if seconds > stats.max:
+                stats.max = seconds
+            stats.rows += rows
+            if error:
+                stats.errors += 1
+
+    def incr(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def gauge(self, name, func):
+        """Register func() -> number, read whenever metrics are exported."""
+        with self._lock:
+            self._gauges[name] = func
+
+    def stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def snapshot(self):
+        """One dict per span, slowest total time first (milliseconds)."""
+        with self._lock:
+            spans = {name: (s.count, s.total, s.max, s.errors, s.rows, s.quantile(0.5), s.quantile(0.95))
+                     for name, s in self._spans.items()}
+        rows = [
+            {
+                "span": name, "calls": count, "errors": errors, "rows": rows,
+                "total_ms": total * 1000, "mean_ms": total / count * 1000 if count else 0.0,
+                "p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "max_ms": peak * 1000,
+            }
+            for name, (count, total, peak, errors, rows, p50, p95) in spans.items()
+        ]
+        return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def render_prometheus(self):
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            spans = sorted(self._spans.items())
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            span_data = [(name, list(s.buckets), s.count, s.total, s.errors, s.rows) for name, s in spans]
+
+        metric = f"{PREFIX}_span_seconds"
+        lines += [f"# HELP {metric} Latency of instrumented calls.", f"# TYPE {metric} histogram"]
+        for name, buckets, count, total, _, _ in span_data:
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric}_bucket{{span="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f'{metric}_count{{span="{name}"}} {count}')
+        for suffix, index, help_text in (("errors", 4, "Failed instrumented calls."),
+                                         ("rows", 5, "Rows read or written by instrumented calls.")):
+            metric = f"{PREFIX}_span_{suffix}_total"
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{span="{data[0]}"}} {data[index]}' for data in span_data]
+
+        for (name, labels), value in counters:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{PREFIX}_{name}_total{{{label_text}}} {value}" if label_text
+                         else f"{PREFIX}_{name}_total {value}")
+        for name, func in gauges:
+            try:
+                value = float(func())
+            except Exception:
+                continue
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _count_rows(result):
+    """Rows in a result: lists count themselves, (rows, total) pages their rows, a dict is one row."""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, dict):
+        return 1
+    return getattr(result, "written", 0)  # SaveResult
+
+
+class span:
+    """
+    Time a block (context manager) or a function (decorator) under `name`.
+
+    Exceptions are counted as errors and re-raised. Code that handles its
+    own errors can call log_error() inside the span instead. Set `.rows`
+    to record how many rows the block moved; decorated functions count the
+    rows in their return value.
+    """
+    __slots__ = ("name", "rows", "error", "_start")
+
+    def __init__(self, name, rows=0):
+        self.name = name
+        self.rows = rows
+        self.error = False
+
+    def __enter__(self):
+        registry.stack().append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        registry.stack().pop()
+        registry.observe(self.name, elapsed, self.rows, self.error or exc_type is not None)
+        return False
+
+    def __call__(self, func):
+        name = self.name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = func(*args, **kwargs)
+                current.rows = _count_rows(result)
+                return result
+
+        return wrapper
+
+
+def log_error(message):
+    """print() an error and count it against the innermost active span."""
+    print(message)
+    stack = registry.stack()
+    if stack:
+        stack[-1].error = True
+    else:
+        registry.incr("unscoped_errors")
+
+
+incr = registry.incr
+gauge = registry.gauge
+snapshot = registry.snapshot
+render_prometheus = registry.render_prometheus
+reset = registry.reset
@@ -0,0 +1,283 @@
+import os
+import random
+import time
+
+from utils.constraints import compile_constraints, website_domain
+from utils.matching import (JUNIOR, SENIOR, MatchingError, SecretSantaMatcher, assignment_digest,
+                            get_tier_policy, new_seed)
+from utils.metrics import span
+
+
+def match_features(index, rows):
+    """
+    Per-participant numpy arrays the scores need, aligned with index ids:
+    tier (int8), domain (website domain label, -1 if none) and the pool's
+    senior/junior counts.
+    """
+    import numpy as np
+    domains = {row.get("email"): website_domain(row.get("website_url")) for row in rows}
+    labels = {}
+    domain = np.fromiter(
+        (labels.setdefault(d, len(labels)) if d else -1 for d in map(domains.get, index.emails)),
+        dtype=np.int64, count=len(index),
+    )
+    tier = np.frombuffer(index.tiers, dtype=np.int8)
+    return {
+        "tier": tier,
+        "domain": domain,
+        "seniors": int((tier == SENIOR).sum()),
+        "juniors": int((tier == JUNIOR).sum()),
+    }
+
+
+class QualityScore:
+    """
+    Match quality as the mean of per-pair values, computed with numpy.
+
+    senior_junior: Senior -> Junior pairs, scaled so full coverage
+        (min(seniors, juniors) pairs) is worth the whole weight
+    tier_mix: pairs across different tiers
+    cross_agency: pairs between different website domains
+    Custom scores subclass this and override terms() (or pair_scores()
+    for values that aren't a weighted sum). Define them at module level
+    so they can be pickled to worker processes.
+    """
+
+    def __init__(self, senior_junior=1.0, tier_mix=0.5, cross_agency=0.5):
+        self.weights = {"senior_junior": senior_junior, "tier_mix": tier_mix, "cross_agency": cross_agency}
+
+    def terms(self, features, givers, receivers):
+        """{term name: per-pair array in [0, 1] (senior_junior scaled)}."""
+        tier, domain = features["tier"], features["domain"]
+        n = len(tier)
+        possible = min(features["seniors"], features["juniors"])
+        tg, tr = tier[givers], tier[receivers]
+        dg = domain[givers]
+        return {
+            "senior_junior": ((tg == SENIOR) & (tr == JUNIOR)) * (n / possible if possible else 0.0),
+            "tier_mix": tg != tr,
+            "cross_agency": ~((dg >= 0) & (dg == domain[receivers])),
+        }
+
+    def pair_scores(self, features, givers, receivers):
+        total = 0.0
+        for name, values in self.terms(features, givers, receivers).items():
+            total = total + self.weights[name] * values
+        return total
+
+    def __call__(self, features, receivers):
+        import numpy as np
+        givers = np.arange(len(receivers))
+        return float(np.mean(self.pair_scores(features, givers, receivers))) if len(receivers) else 0.0
+
+    def report(self, features, receivers):
+        """Mean of each term, e.g. senior_junior is the Senior -> Junior coverage."""
+        import numpy as np
+        givers = np.arange(len(receivers))
+        return {name: float(np.mean(values)) if len(receivers) else 0.0
+                for name, values in self.terms(features, givers, receivers).items()}
+
+
+def receiver_array(index, assignments):
+    """{giver_email: receiver_email} as a numpy array of receiver ids, indexed by giver id."""
+    import numpy as np
+    return np.fromiter(map(index.ids.__getitem__, map(assignments.__getitem__, index.emails)),
+                       dtype=np.int64, count=len(index))
+
+
+def _evaluate(rows, constraints, policy, seeds, score, deadline):
+    """
+    Generate and score one candidate per seed (runs in a worker process).
+
+    Stops at `deadline` (time.time()) but always finishes the first seed.
+    Returns ([(score, seed)], failures); the parent rebuilds the winner
+    from its seed, so no assignments cross the process boundary.
+    """
+    matcher = SecretSantaMatcher(rows, constraints=constraints, policy=policy, seed=seeds[0])
+    features = match_features(matcher.index, rows)
+    scored, failures = [], 0
+    for i, seed in enumerate(seeds):
+        if i and deadline is not None and time.time() >= deadline:
+            break
+        matcher.seed = seed
+        try:
+            assignments = matcher.run_match()
+        except MatchingError:
+            failures += 1
+            continue
+        scored.append((score(features, receiver_array(matcher.index, assignments)), seed))
+    return scored, failures
+
+
+def local_search(receivers, features, score, compiled, rng, deadline=None, batch=4096, patience=3, max_rounds=200,
+                 max_swaps=None):
+    """
+    Improve a matching in place with pair swaps: A -> B, C -> D becomes A -> D, C -> B.
+
+    Each round samples `batch` random pairs of givers, computes every swap's
+    score change at once from score.pair_scores, then applies the improving
+    ones (best first) that are still valid and satisfy the constraints.
+    Stops after `patience` rounds without an improvement, `max_rounds`, at
+    `deadline`, or once `max_swaps` are made. Limits are only checked
+    between rounds, so replaying with max_swaps set to an earlier run's
+    count (and no deadline) makes exactly the same swaps. Returns the
+    number of swaps made.
+    """
+    import numpy as np
+    n = len(receivers)
+    if n < 3:
+        return 0
+    allows = compiled.allows
+    no_reciprocal = compiled.no_reciprocal
+    swaps = stale = 0
+    for _ in range(max_rounds):
+        if stale >= patience or (deadline is not None and time.time() >= deadline):
+            break
+        if max_swaps is not None and swaps >= max_swaps:
+            break
+        a = rng.integers(0, n, batch)
+        c = rng.integers(0, n, batch)
+        b, d = receivers[a], receivers[c]
+        delta = (score.pair_scores(features, a, d) + score.pair_scores(features, c, b)
+                 - score.pair_scores(features, a, b) - score.pair_scores(features, c, d))
+        improving = np.nonzero(delta > 1e-12)[0]
+        made = 0
+        for i in improving[np.argsort(-delta[improving])].tolist():
+            ai, ci, bi, di = int(a[i]), int(c[i]), int(b[i]), int(d[i])
+            # An earlier swap this round may have moved one of the pairs
+            if ai == ci or receivers[ai] != bi or receivers[ci] != di:
+                continue
+            if not (allows(ai, di) and allows(ci, bi)):
+                continue
+            if no_reciprocal and (receivers[di] == ai or receivers[bi] == ci):
+                continue
+            receivers[ai], receivers[ci] = di, bi
+            made += 1
+        swaps += made
+        stale = 0 if made else stale + 1
+    return swaps
+
+
+class MatchOptimizer:
+    """
+    Best-of-N matching: generate candidates in parallel, keep the best score.
+
+    Candidate i is SecretSantaMatcher with the i-th seed drawn from `seed`.
+    Workers only report (score, seed); the winner is regenerated from its
+    seed here and then improved with a pair-swap local search. The same
+    seed and candidates give the same result unless time_budget cuts
+    the search short; replay= reproduces any run from its stats.
+    """
+
+    def __init__(self, participants=None, constraints=None, policy=None, seed=None, candidates=16,
+                 time_budget=None, max_workers=None, local=True, score=None, replay=None):
+        """
+        participants: list of dicts; streamed from the DB if None
+        candidates: matchings to generate and score
+        time_budget: seconds for the whole run (about 70% generation, the
+            rest local search); None runs every candidate and searches
+            until swaps stop helping
+        max_workers: worker processes (default: CPU count); 1 runs in-process
+        local: run the pair-swap local search on the winner
+        score: QualityScore or compatible object (default QualityScore())
+        replay: {"best_seed", "swaps"} from an earlier run's stats (with the
+            same seed): skips generation, rebuilds that winner and makes
+            exactly that many swaps with no deadline, so the earlier result
+            comes back even if its time_budget cut it short
+        """
+        self.constraints = list(constraints or ())
+        self.policy = get_tier_policy(policy)
+        self.seed = new_seed() if seed is None else int(seed)
+        self.candidates = max(1, int(candidates))
+        self.time_budget = time_budget
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.local = local
+        self.score = score or QualityScore()
+        self.replay = replay
+        self.digest = None
+        self.stats = {}
+        if participants is None:
+            from utils.constraints import required_columns
+            from utils.db import iter_participants
+            columns = ["email", "expertise_level", "website_url", *required_columns(self.constraints)]
+            participants = iter_participants(columns=list(dict.fromkeys(columns)))
+        self.participants = list(participants)
+
+    def candidate_seeds(self):
+        rng = random.Random(self.seed)
+        return [rng.getrandbits(63) for _ in range(self.candidates)]
+
+    def run_match(self):
+        """
+        Returns: dict {giver_email: receiver_email}, the best matching found.
+        Raises: MatchingError if no candidate could be matched.
+
+        self.stats holds the winner's seed, the score distribution over all
+        candidates, the scores before and after local search, each score
+        term and the number of swaps.
+        """
+        if len(self.participants) < 2:
+            raise MatchingError("Need at least 2 participants to generate assignments.")
+        import numpy as np
+        start = time.time()
+        deadline = start + self.time_budget if self.time_budget else None
+        generate_by = start + self.time_budget * (0.7 if self.local else 1.0) if self.time_budget else None
+        max_swaps = None
+
+        if self.replay:
+            best_seed, max_swaps = int(self.replay["best_seed"]), int(self.replay["swaps"])
+            deadline = None
+            scored, failures, workers = [], 0, 0
+        else:
+            with span("match.optimize.generate", rows=len(self.participants)):
+                seeds = self.candidate_seeds()
+                workers = min(self.max_workers, len(seeds))
+                chunks = [seeds[i::workers] for i in range(workers)]
+                if workers <= 1:
+                    results = [_evaluate(self.participants, self.constraints, self.policy, seeds, self.score, generate_by)]
+                else:
+                    from utils.sharding import process_pool  # loads multiprocessing; only needed here
+                    with process_pool(workers) as pool:
+                        results = list(pool.map(
+                            _evaluate, *zip(*[(self.participants, self.constraints, self.policy, chunk, self.score, generate_by)
+                                              for chunk in chunks])))
+            scored = sorted((s for chunk, _ in results for s in chunk), reverse=True)
+            failures = sum(f for _, f in results)
+            if not scored:
+                raise MatchingError("No candidate matching satisfies the constraints.")
+            best_seed = scored[0][1]
+
+        with span("match.optimize.local_search", rows=len(self.participants)):
+            matcher = SecretSantaMatcher(self.participants, constraints=self.constraints, policy=self.policy, seed=best_seed)
+            index = matcher.index
+            features = match_features(index, self.participants)
+            receivers = receiver_array(index, matcher.run_match())
+            best_score = self.score(features, receivers)
+            swaps = 0
+            if self.local:
+                compiled = compile_constraints(index, self.constraints)
+                swaps = local_search(receivers, features, self.score, compiled,
+                                     np.random.default_rng(self.seed), deadline, max_swaps=max_swaps)
+
+        emails = index.emails
+        assignments = dict(zip(emails, map(emails.__getitem__, receivers.tolist())))
+        self.digest = assignment_digest(assignments)
+        values = np.array([s for s, _ in scored] or [best_score])
+        self.stats = {
+            **matcher.stats,
+            "best_seed": best_seed,
+            "candidates": len(scored) if scored else 1,
+            "failures": failures,
+            "workers": workers,
+            "scores": {
+                "min": float(values.min()), "p10": float(np.percentile(values, 10)),
+                "p50": float(np.median(values)), "p90": float(np.percentile(values, 90)),
+                "max": float(values.max()), "mean": float(values.mean()), "std": float(values.std()),
+            },
+            "best_score": best_score,
+            "final_score": self.score(features, receivers),
+            "terms": self.score.report(features, receivers),
+            "swaps": swaps,
+            "seconds": time.time() - start,
+        }
+        return assignments
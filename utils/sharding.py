@@ -0,0 +1,158 @@
+import hashlib
+import os
+import time
+import zlib
+from array import array
+
+from utils.constraints import required_columns
+from utils.matching import SecretSantaMatcher, combine_digests, get_tier_policy, new_seed
+from utils.metrics import span
+
+MERGED = "(merged)"  # key of the shard that collects undersized groups
+
+
+def hash_key(shards):
+    """Key function spreading participants evenly over `shards` groups (by email)."""
+    def key(row):
+        return zlib.crc32((row.get("email") or "").encode()) % shards
+    return key
+
+
+def shard_seed(seed, key):
+    """Per-shard seed derived from the run seed and the shard key, independent of shard order."""
+    digest = hashlib.blake2b(f"{seed}\x1f{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> 1  # fits a Postgres bigint
+
+
+def plan_shards(rows, key, min_size=2):
+    """
+    Partition rows by key(row) into [(shard_key, original_keys, rows)], largest first.
+
+    Groups smaller than min_size are pooled into one MERGED shard; if that
+    is still too small it joins the smallest regular shard instead. Rows
+    with a missing key count as a group of their own (key None).
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+
+    shards = [[k, [k], members] for k, members in groups.items() if len(members) >= min_size]
+    small = sorted((k for k, members in groups.items() if len(members) < min_size), key=repr)
+    if small:
+        pooled = [row for k in small for row in groups[k]]
+        if len(pooled) >= min_size or not shards:
+            shards.append([MERGED, small, pooled])
+        else:
+            target = min(shards, key=lambda s: len(s[2]))
+            target[1].extend(small)
+            target[2].extend(pooled)
+    shards.sort(key=lambda s: len(s[2]), reverse=True)  # longest first keeps the pool busy
+    return [tuple(s) for s in shards]
+
+
+def process_pool(max_workers):
+    """
+    ProcessPoolExecutor whose workers are not forked from the caller.
+
+    Forking a threaded process (the Streamlit server, the email dispatcher)
+    copies locks other threads may be holding, e.g. the metrics registry's,
+    and the child deadlocks on them. Workers start from a forkserver
+    instead (spawn where that isn't available).
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method))
+
+
+def _solve_shard(rows, constraints, policy, seed):
+    """
+    Match one shard (runs in a worker process).
+
+    Returns receivers as positions into the shard's email-sorted rows, which
+    pickles far smaller than an email dict, plus the digest and stats.
+    """
+    start = time.perf_counter()
+    matcher = SecretSantaMatcher(rows, constraints=constraints, policy=policy, seed=seed)
+    assignments = matcher.run_match()
+    emails = matcher.index.emails
+    pos = matcher.index.ids
+    receivers = array("l", map(pos.__getitem__, map(assignments.__getitem__, emails)))
+    return emails, receivers, matcher.digest, matcher.stats, time.perf_counter() - start
+
+
+class ShardedMatcher:
+    """
+    Match participants in independent shards, in parallel processes.
+
+    Nobody gives outside their shard. Use it for regional or cohort
+    sub-exchanges (key = a column name or a function of the row) or, with
+    key=None, to split a huge global event into `shards` even random groups.
+    Each shard is a SecretSantaMatcher with its own seed derived from
+    `seed`, so a run is reproducible regardless of worker scheduling.
+    """
+
+    def __init__(self, participants=None, key=None, shards=None, constraints=None, policy=None, seed=None,
+                 min_shard_size=2, max_workers=None, key_columns=()):
+        """
+        participants: list of dicts. If None, streamed from the DB with the
+            columns matching, the constraints and `key_columns` need.
+        key: column name or callable(row) -> shard key; None splits by email
+            hash into `shards` groups (default: one per worker)
+        max_workers: worker processes (default: CPU count); 1 runs in-process
+        """
+        self.constraints = list(constraints or ())
+        self.policy = get_tier_policy(policy)
+        self.seed = new_seed() if seed is None else int(seed)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_shard_size = min_shard_size
+        if key is None:
+            key = hash_key(shards or self.max_workers)
+        elif isinstance(key, str):
+            key_columns = (key, *key_columns)
+            column = key
+            key = lambda row: row.get(column)
+        self.key = key
+        self.digest = None
+        self.stats = {}
+        if participants is None:
+            from utils.db import iter_participants
+            columns = ["email", "expertise_level", *required_columns(self.constraints)]
+            participants = iter_participants(columns=columns + [c for c in key_columns if c not in columns])
+        self.participants = list(participants)
+
+    def run_match(self):
+        """
+        Returns: dict {giver_email: receiver_email} over all shards.
+        Raises: MatchingError if any shard can't be matched.
+
+        self.stats holds the totals and a "shards" list with each shard's
+        key, merged keys, size, seed, solver counters and time.
+        """
+        with span("match.plan_shards") as plan:
+            shards = plan_shards(self.participants, self.key, self.min_shard_size)
+            plan.rows = sum(len(rows) for _, _, rows in shards)
+        jobs = [(rows, self.constraints, self.policy, shard_seed(self.seed, k)) for k, _, rows in shards]
+
+        with span("match.solve_shards", rows=plan.rows):
+            workers = min(self.max_workers, len(jobs))
+            if workers <= 1:
+                results = [_solve_shard(*job) for job in jobs]
+            else:
+                with process_pool(workers) as pool:
+                    results = list(pool.map(_solve_shard, *zip(*jobs)))
+
+        with span("match.merge_shards", rows=plan.rows):
+            assignments = {}
+            shard_stats = []
+            for (k, keys, _), (_, _, _, seed), (emails, receivers, digest, stats, elapsed) in zip(shards, jobs, results):
+                assignments.update(zip(emails, map(emails.__getitem__, receivers)))
+                shard_stats.append({"key": k, "keys": keys, "size": len(emails), "seed": seed,
+                                    "digest": digest, "seconds": elapsed, **stats})
+            self.digest = combine_digests(s["digest"] for s in shard_stats)
+
+        totals = {name: sum(s[name] for s in shard_stats)
+                  for name in ("tier_pairs", "greedy_misses", "augmented", "reciprocal_swaps")}
+        self.stats = {**totals, "shards": shard_stats, "workers": workers,
+                      "cpu_seconds": sum(s["seconds"] for s in shard_stats)}
+        return assignments
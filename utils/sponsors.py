@@ -0,0 +1,141 @@
+import heapq
+import math
+import random
+
+# Lottery weight per expertise level: juniors get the best odds by default
+DEFAULT_TIER_WEIGHTS = {"Junior": 3.0, "Mid": 2.0, "Senior": 1.0}
+# Gifts from higher sponsor tiers (then higher value) are drawn first
+SPONSOR_TIER_RANK = {"Gold": 0, "Silver": 1, "Bronze": 2}
+
+
+class EligibilityIndex:
+    """
+    Participants who can still win, with their lottery weights, built in one pass.
+
+    Excludes banned participants, anyone who already holds a gift, and
+    (with require_verified) unverified ones. Weights come from
+    `tier_weights`; unknown levels get the Mid weight.
+    """
+    __slots__ = ("ids", "weights", "excluded")
+
+    def __init__(self, participants, winners=(), tier_weights=None, require_verified=False):
+        tier_weights = tier_weights or DEFAULT_TIER_WEIGHTS
+        default = tier_weights.get("Mid", 1.0)
+        winners = set(winners)
+        self.ids = []
+        self.weights = []
+        self.excluded = {"banned": 0, "already_won": 0, "unverified": 0}
+        for p in participants:
+            if p.get("is_banned"):
+                self.excluded["banned"] += 1
+            elif p["id"] in winners:
+                self.excluded["already_won"] += 1
+            elif require_verified and not p.get("is_verified"):
+                self.excluded["unverified"] += 1
+            else:
+                weight = tier_weights.get(p.get("expertise_level"), default)
+                if weight > 0:
+                    self.ids.append(p["id"])
+                    self.weights.append(weight)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def draw(self, k, rng=random):
+        """
+        k distinct participant ids, weighted, in draw order (Efraimidis-Spirakis).
+
+        Each participant gets the key log(u) / weight and the k largest keys
+        win, which is a weighted sample without replacement in O(n log k).
+        """
+        keys = ((math.log(1.0 - rng.random()) / w, pid) for pid, w in zip(self.ids, self.weights))
+        return [pid for _, pid in heapq.nlargest(k, keys)]
+
+
+def gift_order(gifts, sponsors=None):
+    """Gifts sorted best first: sponsor tier, then value, then id (for a stable order)."""
+    tier_of = {s["id"]: s.get("tier") for s in sponsors or ()}
+    worst = len(SPONSOR_TIER_RANK)
+
+    def key(gift):
+        rank = SPONSOR_TIER_RANK.get(tier_of.get(gift.get("sponsor_id")), worst)
+        return rank, -float(gift.get("value_usd") or 0), str(gift["id"])
+
+    return sorted(gifts, key=key)
+
+
+def allocate(gifts, index, rng=random, sponsors=None):
+    """
+    Pair gifts with lottery winners, one gift per person.
+
+    gifts: unassigned, unclaimed gift rows (id, sponsor_id, value_usd)
+    index: EligibilityIndex
+    Returns [(gift_id, winner_id)]. The first winner drawn gets the best
+    gift. If there are more gifts than eligible people, the rest stay
+    unassigned.
+    """
+    ordered = gift_order(gifts, sponsors)
+    winners = index.draw(min(len(ordered), len(index)), rng)
+    return [(gift["id"], winner) for gift, winner in zip(ordered, winners)]
+
+
+class GiveawayResult:
+    """Outcome of run_giveaway. Truthy if the bulk write went through."""
+    __slots__ = ("seed", "gifts", "eligible", "excluded", "planned", "assigned", "error")
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.gifts = 0
+        self.eligible = 0
+        self.excluded = {}
+        self.planned = 0
+        self.assigned = 0
+        self.error = None
+
+    @property
+    def conflicts(self):
+        """Planned assignments the database refused (gift taken or claimed meanwhile)."""
+        return self.planned - self.assigned
+
+    def __bool__(self):
+        return self.error is None
+
+    def __repr__(self):
+        return (f"GiveawayResult(seed={self.seed}, gifts={self.gifts}, eligible={self.eligible}, "
+                f"assigned={self.assigned}/{self.planned})")
+
+
+def run_giveaway(seed=None, tier_weights=None, require_verified=False):
+    """
+    Assign every open sponsor gift in one batched pass.
+
+    Reads participants and gifts once, draws winners in memory and writes
+    all pairs in a single request that only fills gifts that are still
+    unassigned and unclaimed. Re-running is safe: existing winners are
+    excluded and assigned gifts are never overwritten.
+    """
+    from utils import db
+    from utils.matching import new_seed
+
+    seed = new_seed() if seed is None else int(seed)
+    result = GiveawayResult(seed)
+    gifts = list(db.iter_sponsor_gifts(columns=["id", "sponsor_id", "value_usd", "winner_id", "is_claimed"]))
+    open_gifts = [g for g in gifts if g.get("winner_id") is None and not g.get("is_claimed")]
+    winners = {g["winner_id"] for g in gifts if g.get("winner_id") is not None}
+    result.gifts = len(open_gifts)
+    if not open_gifts:
+        return result
+
+    participants = db.iter_participants(columns=["id", "email", "expertise_level", "is_banned", "is_verified"])
+    index = EligibilityIndex(participants, winners, tier_weights, require_verified)
+    result.eligible = len(index)
+    result.excluded = index.excluded
+
+    pairs = allocate(open_gifts, index, random.Random(seed), db.get_sponsors())
+    result.planned = len(pairs)
+    written = db.assign_sponsor_gifts(pairs)
+    if written is None:
+        result.error = "Bulk write failed"
+    else:
+        result.assigned = written
+    return result
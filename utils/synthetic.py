@@ -0,0 +1,69 @@
+import random
+
+LEVELS = ("Junior", "Mid", "Senior")
+
+# Tier mixes as (junior, mid, senior) shares
+TIER_MIXES = {
+    "uniform": (1 / 3, 1 / 3, 1 / 3),
+    "realistic": (0.45, 0.35, 0.20),
+    "senior_heavy": (0.05, 0.05, 0.90),
+    "junior_heavy": (0.90, 0.05, 0.05),
+    "no_juniors": (0.0, 0.5, 0.5),
+    "all_mid": (0.0, 1.0, 0.0),
+}
+
+
+def tier_counts(n, mix):
+    """Split n into exact (junior, mid, senior) counts by largest remainder."""
+    shares = TIER_MIXES[mix] if isinstance(mix, str) else mix
+    total = sum(shares)
+    raw = [n * share / total for share in shares]
+    counts = [int(x) for x in raw]
+    by_remainder = sorted(range(len(raw)), key=lambda i: raw[i] - counts[i], reverse=True)
+    for i in by_remainder[:n - sum(counts)]:
+        counts[i] += 1
+    return tuple(counts)
+
+
+def make_participants(n, mix="uniform", seed=0, companies=0, company_share=0.5):
+    """
+    Synthetic participant rows shaped like the participants table.
+
+    mix: a TIER_MIXES name or (junior, mid, senior) shares. Tier counts are
+        exact, so "senior_heavy" at n=20 is always 1 junior, 1 mid, 18 seniors.
+    companies: when > 0, `company_share` of participants get a website on one
+        of that many shared company domains (skewed, so the first companies
+        are the biggest) for SameDomainExclusion. The rest get their own.
+    The same arguments always produce the same rows.
+    """
+    rng = random.Random(seed)
+    levels = [level for level, count in zip(LEVELS, tier_counts(n, mix)) for _ in range(count)]
+    rng.shuffle(levels)
+    rows = []
+    for i, level in enumerate(levels):
+        row = {"email": f"user{i:07d}@synthetic.test", "name": f"User {i}", "expertise_level": level}
+        if companies:
+            if rng.random() < company_share:
+                # Log-uniform draw: lower-numbered companies are bigger
+                k = int((companies + 1) ** rng.random()) - 1
+                row["website_url"] = f"https://company{k}.example"
+            else:
+                row["website_url"] = f"https://user{i}.example"
+        rows.append(row)
+    return rows
+
+
+def previous_pairs(participants, seed=0, share=1.0):
+    """
+    A past year's pairs over (a `share` of) the same participants, as
+    NoRepeatPairs history: each sampled giver gave to the next one in a
+    random cycle.
+    """
+    rng = random.Random(seed)
+    emails = [p["email"] for p in participants]
+    if share < 1.0:
+        emails = rng.sample(emails, int(len(emails) * share))
+    rng.shuffle(emails)
+    if len(emails) < 2:
+        return []
+    return [(emails[i - 1], emails[i]) for i in range(len(emails))]
@@ -0,0 +1,138 @@
+import html
+from string import Formatter
+
+DEFAULT_SENDER = "SEO Kringle <admin@seokringle.com>"
+
+
+class Template:
+    """
+    A template compiled once into static chunks and field slots.
+
+    "{name}" fields are HTML-escaped; "{name!s}" inserts a value as-is (for
+    fragments rendered by another Template). Plain-text templates such as
+    subjects pass escape=False. Rendering copies the precomputed piece list,
+    fills the slots and does one join.
+    """
+    __slots__ = ("_pieces", "_slots")
+
+    def __init__(self, source, escape=True):
+        self._pieces = []
+        self._slots = []  # (position in _pieces, field name, escape?)
+        for literal, field, _, conversion in Formatter().parse(source):
+            if literal:
+                self._pieces.append(literal)
+            if field is not None:
+                self._slots.append((len(self._pieces), field, escape and conversion != "s"))
+                self._pieces.append("")
+
+    @property
+    def fields(self):
+        return [field for _, field, _ in self._slots]
+
+    def render(self, context):
+        pieces = self._pieces.copy()
+        for position, field, escape in self._slots:
+            value = context.get(field)
+            value = "" if value is None else str(value)
+            pieces[position] = html.escape(value) if escape else value
+        return "".join(pieces)
+
+
+class EmailTemplate:
+    """Subject and HTML body templates for one kind of email."""
+    __slots__ = ("subject", "body")
+
+    def __init__(self, subject, body):
+        self.subject = Template(subject, escape=False)
+        self.body = Template(body)
+
+    def message(self, to, context, sender=DEFAULT_SENDER):
+        return {
+            "from": sender,
+            "to": to,
+            "subject": self.subject.render(context),
+            "html": self.body.render(context),
+        }
+
+
+# --- Templates (compiled at import) ---
+
+MAGIC_LINK = EmailTemplate(
+    "🎅 Login to SEO Kringle Secret Santa",
+    """
+            <div style="font-family: sans-serif; max-width: 600px; margin: 0 auto;">
+                <h2>Welcome back!</h2>
+                <p>You requested a secure login link for the SEO Community Secret Santa.</p>
+                <div style="margin: 24px 0;">
+                    <a href="{link}" style="background-color: #d32f2f; color: white; padding: 12px 24px; text-decoration: none; border-radius: 4px; font-weight: bold;">👉 Click here to Login</a>
+                </div>
+                <p style="color: #666; font-size: 14px;">If you didn't request this, you can safely ignore this email.</p>
+                <p style="color: #666; font-size: 14px;"><i>Link expires in 24 hours.</i></p>
+            </div>
+            """,
+)
+
+WISHLIST_ITEM = Template('<li><a href="{url}">{name}</a></li>')
+WISHLIST_ITEM_NO_URL = Template("<li>{name}</li>")
+
+ASSIGNMENT = EmailTemplate(
+    "🎁 Your SEO Kringle Secret Santa match is here!",
+    """
+            <div style="font-family: sans-serif; max-width: 600px; margin: 0 auto;">
+                <h2>Ho ho ho! 🎅</h2>
+                <p>You are the Secret Santa for <b>{receiver_name}</b>.</p>
+                <p style="color: #444;">{receiver_bio}</p>
+                <p><b>Their wishlist:</b></p>
+                <ul>{wishlist!s}</ul>
+                <p><a href="{app_domain}">Log in</a> to see their full profile and record your gift.</p>
+            </div>
+            """,
+)
+
+REMINDER = EmailTemplate(
+    "⏰ Reminder: {receiver_name} is waiting for their Secret Santa gift",
+    """
+            <div style="font-family: sans-serif; max-width: 600px; margin: 0 auto;">
+                <h2>Friendly reminder 🎄</h2>
+                <p><b>{receiver_name}</b> hasn't received your gift yet.</p>
+                <p><b>Their wishlist:</b></p>
+                <ul>{wishlist!s}</ul>
+                <p><a href="{app_domain}">Log in</a> to record your gift once it's sent.</p>
+            </div>
+            """,
+)
+
+
+def render_wishlist(items):
+    """Render wishlist JSON ([{"name", "url"}]) as <li> fragments, skipping blanks."""
+    rendered = []
+    for item in items or ():
+        if not item or not item.get("name"):
+            continue
+        url = str(item.get("url") or "")
+        template = WISHLIST_ITEM if url.startswith(("http://", "https://")) else WISHLIST_ITEM_NO_URL
+        rendered.append(template.render(item))
+    return "".join(rendered) or "<li>No wishlist yet. Surprise them!</li>"
+
+
+def iter_assignment_messages(assignments, receivers, app_domain, template=ASSIGNMENT):
+    """
+    Stream (message, giver_email) pairs, one per giver, ready for the dispatcher.
+
+    assignments: dict {giver_email: receiver_email}
+    receivers: iterable of participant rows (email, name, bio, wishlist), e.g.
+        a paginated DB stream. Each row is rendered and dropped as it goes, so
+        only the pair map is ever held in memory.
+    """
+    giver_of = {receiver: giver for giver, receiver in assignments.items()}
+    for row in receivers:
+        giver = giver_of.get(row.get("email"))
+        if giver is None:
+            continue
+        context = {
+            "receiver_name": row.get("name") or "your match",
+            "receiver_bio": row.get("bio") or "",
+            "wishlist": render_wishlist(row.get("wishlist")),
+            "app_domain": app_domain,
+        }
+        yield template.message(giver, context), giver
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now. Returns True on success."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until tokens are available (or timeout). Returns True on success."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class AdmissionController:
+    """
+    Admission check for bursty requests: one token bucket per key (e.g.
+    per email) plus a global bucket. Per-key buckets live in a bounded
+    LRU, so a flood of distinct keys can't grow memory without limit.
+    """
+
+    def __init__(self, per_key_rate, per_key_burst, global_rate, global_burst, max_keys=10000):
+        self.per_key_rate = per_key_rate
+        self.per_key_burst = per_key_burst
+        self.max_keys = max_keys
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected_key = 0
+        self.rejected_global = 0
+
+    def _bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.per_key_rate, self.per_key_burst)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def admit(self, key):
+        """Returns (admitted, reason) where reason is None, "key" or "global"."""
+        if not self._bucket(key).try_acquire():
+            with self._lock:
+                self.rejected_key += 1
+            return False, "key"
+        if not self.global_bucket.try_acquire():
+            with self._lock:
+                self.rejected_global += 1
+            return False, "global"
+        with self._lock:
+            self.admitted += 1
+        return True, None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "admitted": self.admitted,
+                "rejected_key": self.rejected_key,
+                "rejected_global": self.rejected_global,
+                "tracked_keys": len(self._buckets),
+            }
+
+
+_login_admission = None
+_login_admission_lock = threading.Lock()
+
+
+def get_login_admission():
+    """
+    Process-wide admission control for magic-link requests. Defaults: 3 per
+    email then one every 60s, and 20/s overall with bursts of 100.
+    """
+    global _login_admission
+    with _login_admission_lock:
+        if _login_admission is None:
+            _login_admission = AdmissionController(
+                per_key_rate=1 / float(os.getenv("LOGIN_EMAIL_INTERVAL_SEC", "60")),
+                per_key_burst=int(os.getenv("LOGIN_EMAIL_BURST", "3")),
+                global_rate=float(os.getenv("LOGIN_GLOBAL_RATE_PER_SEC", "20")),
+                global_burst=int(os.getenv("LOGIN_GLOBAL_BURST", "100")),
+            )
+        return _login_admission